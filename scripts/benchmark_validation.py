@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Compares the time taken to load a large manifest with plain `json.loads`,
+with schema validation, and as trusted (or previously validated) content.
+
+Usage: benchmark_validation.py [number-of-files] [repetitions]
+"""
+
+import json
+import os
+import sys
+import timeit
+
+from zinc.models import ZincManifest
+from zinc.formats import Formats
+
+
+def make_manifest_bytes(file_count):
+    manifest = ZincManifest('com.mindsnacks.benchmark', 'bench', 1)
+    for i in range(file_count):
+        path = 'dir%d/file%d.dat' % (i % 100, i)
+        manifest.add_file(path, os.urandom(20).hex())
+        manifest.add_format_for_file(path, Formats.GZ, 1000 + i)
+        manifest.add_flavor_for_file(path, 'small' if i % 2 else 'large')
+    return manifest.to_bytes().decode('utf-8')
+
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    b = make_manifest_bytes(file_count)
+    print("Manifest with %d files, %d bytes" % (file_count, len(b)))
+
+    def validated():
+        ZincManifest._validated_digests = None
+        ZincManifest.from_bytes(b)
+
+    timings = (
+        ('json.loads', lambda: json.loads(b)),
+        ('from_bytes (validated)', validated),
+        ('from_bytes (trusted)', lambda: ZincManifest.from_bytes(b, trusted=True)),
+        ('from_bytes (seen before)', lambda: ZincManifest.from_bytes(b)),
+    )
+    for name, func in timings:
+        seconds = min(timeit.repeat(func, number=1, repeat=number))
+        print("%-26s %8.2f ms" % (name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
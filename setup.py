@@ -19,6 +19,11 @@ install_requires = [
     "jsonschema==1.3.0",
 ]
 
+extras_require = {
+    # parsed with the fastest JSON library installed, see `zinc.jsoncodec`
+    'fastjson': ["orjson"],
+}
+
 
 setup(name='zinc',
       version=version,
@@ -37,6 +42,7 @@ setup(name='zinc',
       package_data={'': ['*.json']},
       zip_safe=False,
       install_requires=install_requires,
+      extras_require=extras_require,
       entry_points={
           'console_scripts':
           ['zinc=zinc.cli:main']
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.aio
+~~~~~~~~
+
+This module provides `AsyncZincCatalog`, an asyncio facade over a
+`ZincCatalog` for importing, cloning and verifying many files at once.
+
+Nothing here does non-blocking I/O. Object reads go through an
+`AsyncStorageBackend`, which runs the blocking storage calls on a pool of
+worker threads, and imports, decoding, local file writes and index and
+manifest access run on an executor the same way. What the facade adds is
+an awaitable interface, with the number of files in progress bounded by a
+semaphore.
+
+"""
+
+import os
+import asyncio
+import functools
+import hashlib
+import logging
+import lzma
+import zlib
+
+import zinc.compression as compression
+import zinc.helpers as helpers
+import zinc.utils as utils
+from .client import Message, _cheapest_decodable_format
+from .defaults import defaults
+from .formats import Formats
+from .storages.aio import async_storage_for_storage
+
+log = logging.getLogger(__name__)
+
+
+class AsyncZincCatalog(object):
+
+    def __init__(self, catalog, storage=None, concurrency=None, executor=None):
+        """
+        Wraps `catalog`. Object I/O goes through `storage`, an
+        `AsyncStorageBackend` for the catalog's storage, which is created if
+        not given. At most `concurrency` file operations run at once. Blocking
+        catalog calls, decoding and local file writes run on `executor`, or
+        the event loop's default executor.
+        """
+        self._catalog = catalog
+        if storage is None:
+            storage = async_storage_for_storage(catalog._storage)
+        self._storage = storage
+        self._concurrency = concurrency or defaults['catalog_async_concurrency']
+        self._executor = executor
+
+    @property
+    def catalog(self):
+        return self._catalog
+
+    @property
+    def storage(self):
+        return self._storage
+
+    def _semaphore(self):
+        # Created per call, inside the running loop, as a semaphore is bound
+        # to the loop it is first used in (and on older Pythons, to the
+        # current loop when it is created).
+        return asyncio.Semaphore(self._concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          functools.partial(func, *args, **kwargs))
+
+    async def get_index(self):
+        return await self._run(self._catalog.get_index)
+
+    async def get_manifest(self, bundle_name, version):
+        return await self._run(self._catalog.get_manifest, bundle_name, version)
+
+    async def _iter_decoded(self, sha, format):
+        """Asynchronously yields the decoded contents of the object `sha`
+        stored in `format`. Decoding runs on a worker thread."""
+        ext = helpers.file_extension_for_format(format)
+        subpath = self._catalog.path_helper.path_for_file_with_sha(sha, ext=ext)
+        decompressor = None
+        if format != Formats.RAW:
+            decompressor = compression.decompressobj_for_format(format)
+        async for chunk in self._storage.iter_chunks(subpath):
+            if decompressor is not None:
+                chunk = await self._run(decompressor.decompress, chunk)
+            if chunk:
+                yield chunk
+        if hasattr(decompressor, 'flush'):
+            chunk = await self._run(decompressor.flush)
+            if chunk:
+                yield chunk
+
+    async def import_paths(self, src_paths):
+        """Imports the files at `src_paths`, returning their file infos in
+        the same order. Imports are blocking (hashing, compression and the
+        upload all happen in `ZincCatalog.import_path`), so this only runs
+        them on the executor, at most `concurrency` at a time, rather than
+        doing asynchronous I/O."""
+        semaphore = self._semaphore()
+
+        async def import_path(src_path):
+            async with semaphore:
+                return await self._run(self._catalog.import_path, src_path)
+
+        return await asyncio.gather(*[import_path(p) for p in src_paths])
+
+    async def clone_bundle(self, bundle_name, version, root_path=None,
+                           bundle_dir_name=None, flavor=None):
+        """Like `zinc.client.clone_bundle`, but downloads the bundle's files
+        concurrently, on worker threads."""
+        if root_path is None:
+            root_path = '.'
+
+        if bundle_dir_name is None:
+            bundle_id = helpers.make_bundle_id(self._catalog.id, bundle_name)
+            bundle_dir_name = helpers.make_bundle_descriptor(bundle_id, version,
+                                                             flavor=flavor)
+
+        manifest = await self.get_manifest(bundle_name, version)
+        if manifest is None:
+            raise Exception("manifest not found: %s-%d" % (bundle_name, version))
+
+        if flavor is not None and flavor not in manifest.flavors:
+            raise Exception("manifest does not contain flavor '%s'" % (flavor))
+
+        all_files = manifest.get_all_files(flavor=flavor)
+        root_dir = os.path.join(root_path, bundle_dir_name)
+        await self._run(utils.makedirs, root_dir)
+        semaphore = self._semaphore()
+
+        async def clone_file(file):
+            dst_path = os.path.join(root_dir, file)
+            sha = manifest.sha_for_file(file)
+            format = _cheapest_decodable_format(manifest.formats_for_file(file))
+            async with semaphore:
+                await self._run(utils.makedirs, os.path.dirname(dst_path))
+                outfile = await self._run(open, dst_path, 'w+b')
+                try:
+                    async for b in self._iter_decoded(sha, format):
+                        await self._run(outfile.write, b)
+                finally:
+                    await self._run(outfile.close)
+            log.info("Exported %s --> %s" % (sha, dst_path))
+
+        await asyncio.gather(*[clone_file(file) for file in all_files])
+        log.info("Exported %d files to '%s'" % (len(all_files), root_dir))
+
+    async def verify_bundle(self, bundle_name, version, check_shas=True):
+        """Verifies the files of a bundle version concurrently, on worker
+        threads, returning a list of `zinc.client.Message`s as
+        `zinc.client.bundle_verify` would yield for them. Archives are not
+        checked."""
+        manifest = await self.get_manifest(bundle_name, version)
+        if manifest is None:
+            return [Message.error("manifest not found: %s-%d" % (bundle_name, version))]
+
+        messages = list()
+        if not check_shas:
+            messages.append(Message.warn('Skipping SHA digest verification for bundle files.'))
+
+        semaphore = self._semaphore()
+
+        async def verify_file(sha, info):
+            async with semaphore:
+                meta = await self._run(self._catalog._get_file_info, sha)
+                if meta is None:
+                    return Message.error('File %s not exist' % (sha))
+                format = meta['format']
+                if meta['size'] != info['formats'][format]['size']:
+                    return Message.error('File %s wrong size' % (sha))
+                if check_shas:
+                    sha1 = hashlib.sha1()
+                    try:
+                        async for b in self._iter_decoded(sha, format):
+                            sha1.update(b)
+                    except (zlib.error, lzma.LZMAError, OSError, EOFError):
+                        # OSError for corrupt BZ2 data
+                        return Message.error('File %s wrong hash' % (sha))
+                    if sha1.hexdigest() != sha:
+                        return Message.error('File %s wrong hash' % (sha))
+                return Message.info('File %s OK' % (sha))
+
+        files = dict()
+        for path, info in manifest.files.items():
+            files.setdefault(manifest.sha_for_file(path), info)
+        messages.extend(await asyncio.gather(*[verify_file(sha, info)
+                                               for sha, info in files.items()]))
+        return messages
@@ -1,19 +1,29 @@
+import io
 import os
 import tarfile
-import tempfile
+import threading
 
-import zinc.utils as utils
 import zinc.helpers as helpers
 
 from zinc.models import ZincManifest
-from zinc.formats import Formats
+from zinc.staging import ZincBlobStage
 
 
-def build_archive_with_manifest(manifest: ZincManifest, src_dir, dst_path, flavor=None):
+def write_archive_with_manifest(manifest: ZincManifest, src_dir, fileobj, flavor=None,
+                                blob_stage=None, mode='w'):
+    """Writes the tar archive for `flavor` to the file-like object `fileobj`.
+    Encoded files are taken from `blob_stage`, and encoded into it if needed,
+    so a shared stage means each file is only compressed once across
+    archives. Use `mode='w|'` if `fileobj` is not seekable."""
+
+    if blob_stage is None:
+        with ZincBlobStage() as blob_stage:
+            return write_archive_with_manifest(manifest, src_dir, fileobj, flavor=flavor,
+                                               blob_stage=blob_stage, mode=mode)
 
     files = manifest.get_all_files(flavor=flavor)
 
-    with tarfile.open(dst_path, 'w') as tar:
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
         for f in files:
             format, format_info = manifest.get_format_info_for_file(f)
             assert format is not None
@@ -26,11 +36,75 @@ def build_archive_with_manifest(manifest: ZincManifest, src_dir, dst_path, flavo
 
             # TODO: write a test to ensure that file formats are written correctly
 
-            if format == Formats.RAW:
-                tar.add(path, arcname=arcname)
+            with blob_stage.blob(sha, format, path) as blob_path:
+                tar.add(blob_path, arcname=arcname)
+
+
+def build_archive_with_manifest(manifest: ZincManifest, src_dir, dst_path, flavor=None,
+                                blob_stage=None):
+    """Builds the tar archive for `flavor` at `dst_path`."""
+
+    with open(dst_path, 'wb') as dst_file:
+        write_archive_with_manifest(manifest, src_dir, dst_file, flavor=flavor,
+                                    blob_stage=blob_stage)
+
+
+class ArchiveStream(io.RawIOBase):
+    """A readable, non-seekable stream of the tar archive for `flavor`. The
+    archive is written into a pipe by a background thread as it is read, so
+    it can be passed straight to `StorageBackend.put` without a temporary
+    file. If building the archive fails, the error is raised from `read`
+    instead of signalling end of file, so a truncated archive is never
+    stored."""
+
+    def __init__(self, manifest: ZincManifest, src_dir, flavor=None, blob_stage=None):
+        super().__init__()
+        read_fd, write_fd = os.pipe()
+        self._reader = os.fdopen(read_fd, 'rb', buffering=0)
+        self._writer = os.fdopen(write_fd, 'wb')
+        self._error = None
+        self._thread = threading.Thread(target=self._write,
+                                        args=(manifest, src_dir, flavor, blob_stage),
+                                        daemon=True)
+        self._thread.start()
+
+    def _write(self, manifest, src_dir, flavor, blob_stage):
+        try:
+            write_archive_with_manifest(manifest, src_dir, self._writer, flavor=flavor,
+                                        blob_stage=blob_stage, mode='w|')
+        except BaseException as e:
+            self._error = e
+        finally:
+            try:
+                self._writer.close()
+            except OSError:
+                pass  # reader went away
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readinto(self, b):
+        # Fill `b` rather than returning one pipe-sized chunk: s3transfer
+        # decides whether to use a multipart upload from the length of a
+        # single read, and reads the whole stream into memory otherwise.
+        view = memoryview(b).cast('B')
+        n = 0
+        while n < len(view):
+            count = self._reader.readinto(view[n:])
+            if not count:
+                break
+            n += count
+        if n == 0:
+            self._thread.join()
+            if self._error is not None:
+                raise IOError("Failed to build archive") from self._error
+        return n
 
-            elif format == Formats.GZ:
-                gz_path = tempfile.mkstemp()[1]
-                utils.gzip_path(path, gz_path)
-                tar.add(gz_path, arcname=arcname)
-                os.remove(gz_path)
+    def close(self):
+        if not self.closed:
+            self._reader.close()
+            self._thread.join()
+        super().close()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.awspool
+~~~~~~~~~~~~
+
+This module provides a process-wide pool of boto3 sessions, and the clients
+and resources made from them, so that storage backends and coordinators for
+the same account reuse one session and its open connections instead of
+setting up their own.
+
+"""
+
+import threading
+from collections import OrderedDict
+import logging
+
+import boto3
+
+from .defaults import defaults
+
+log = logging.getLogger(__name__)
+
+
+class _PooledSession(object):
+
+    def __init__(self, session):
+        self.session = session
+        self.clients = dict()
+        self.resources = dict()
+        self.buckets = dict()
+        # boto3 sessions aren't thread-safe, so clients and resources are
+        # created from them one at a time
+        self.lock = threading.Lock()
+
+
+class AWSSessionPool(object):
+    """A thread-safe LRU pool of boto3 sessions keyed by credentials and
+    region. Each session keeps the clients and resources created from it, so
+    they are only created once per pooled session. When the pool holds more
+    than `max_size` sessions the least recently used is dropped.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size if max_size is not None \
+            else defaults['aws_session_pool_max_size']
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry(self, aws_key, aws_secret, region):
+        key = (aws_key, aws_secret, region)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+            log.debug('Creating boto3 session (region: %s)' % (region))
+            session = boto3.session.Session(aws_access_key_id=aws_key,
+                                            aws_secret_access_key=aws_secret,
+                                            region_name=region)
+            entry = _PooledSession(session)
+            self._entries[key] = entry
+            while len(self._entries) > max(self.max_size, 1):
+                self._entries.popitem(last=False)
+            return entry
+
+    def session(self, aws_key=None, aws_secret=None, region=None):
+        return self._entry(aws_key, aws_secret, region).session
+
+    def client(self, service, aws_key=None, aws_secret=None, region=None):
+        entry = self._entry(aws_key, aws_secret, region)
+        with entry.lock:
+            client = entry.clients.get(service)
+            if client is None:
+                client = entry.session.client(service)
+                entry.clients[service] = client
+            return client
+
+    def resource(self, service, aws_key=None, aws_secret=None, region=None):
+        entry = self._entry(aws_key, aws_secret, region)
+        with entry.lock:
+            resource = entry.resources.get(service)
+            if resource is None:
+                resource = entry.session.resource(service)
+                entry.resources[service] = resource
+            return resource
+
+    def bucket_exists(self, bucket_name, aws_key=None, aws_secret=None, region=None):
+        """Returns whether the S3 bucket `bucket_name` exists, only asking S3
+        the first time for each pooled session."""
+        import botocore.exceptions
+        entry = self._entry(aws_key, aws_secret, region)
+        exists = entry.buckets.get(bucket_name)
+        if exists is not None:
+            return exists
+        client = self.resource('s3', aws_key, aws_secret, region).meta.client
+        try:
+            client.head_bucket(Bucket=bucket_name)
+            exists = True
+        except botocore.exceptions.ClientError as error:
+            error_code = error.response['Error']['Code']
+            if error_code == '404':
+                exists = False
+            else:
+                raise error
+        with entry.lock:
+            entry.buckets[bucket_name] = exists
+        return exists
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+shared_session_pool = AWSSessionPool()
+"""The process-wide pool used by AWS storage backends and coordinators."""
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.binarymanifest
+~~~~~~~~~~~~~~~~~~~
+
+A compact binary encoding of manifests, written next to the JSON manifest
+by catalogs with `binary_manifests` enabled.
+
+All integers are unsigned LEB128 varints and all strings are a varint
+length followed by UTF-8. The layout is::
+
+    magic               b'ZBM' followed by a version byte (1)
+    catalog, bundle     strings
+    version             varint
+    format              string
+    flavors             varint count, then strings (flavor table)
+    manifest flavors    varint count; the manifest's flavors are the first
+                        entries of the flavor table
+    formats             varint count, then strings (format table)
+    files               varint count, then for each file:
+        path            string
+        sha             20 bytes
+        has flavors     1 byte, 0 or 1
+        flavors         if present: varint count, then flavor table indexes
+        formats         varint count, then (format table index, size) pairs
+
+"""
+
+from .defaults import defaults
+from .models import ZincManifest
+
+MAGIC = b'ZBM\x01'
+FILE_EXTENSION = 'zbm'
+
+
+def _write_varint(out, n):
+    if n < 0:
+        raise ValueError("Can't encode negative integer %d" % (n))
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_string(out, s):
+    b = s.encode('utf-8')
+    _write_varint(out, len(b))
+    out += b
+
+
+def encode(manifest: ZincManifest) -> bytes:
+    """Returns the binary encoding of `manifest`."""
+    files = manifest.files
+
+    manifest_flavors = list(manifest.flavors or [])
+    flavors = list(manifest_flavors)
+    flavor_indexes = {flavor: i for i, flavor in enumerate(flavors)}
+    formats = list()
+    format_indexes = dict()
+    for path in files.keys():
+        for flavor in files.flavors_for_file(path) or []:
+            if flavor not in flavor_indexes:
+                flavor_indexes[flavor] = len(flavors)
+                flavors.append(flavor)
+        for format in files.formats_for_file(path) or {}:
+            if format not in format_indexes:
+                format_indexes[format] = len(formats)
+                formats.append(format)
+
+    out = bytearray(MAGIC)
+    _write_string(out, manifest.catalog_id)
+    _write_string(out, manifest.bundle_name)
+    _write_varint(out, manifest.version)
+    _write_string(out, manifest.format)
+    _write_varint(out, len(flavors))
+    for flavor in flavors:
+        _write_string(out, flavor)
+    _write_varint(out, len(manifest_flavors))
+    _write_varint(out, len(formats))
+    for format in formats:
+        _write_string(out, format)
+
+    _write_varint(out, len(files))
+    for path in files.keys():
+        _write_string(out, path)
+        sha = bytes.fromhex(files.sha_for_file(path))
+        if len(sha) != 20:
+            raise ValueError("Invalid sha for %s" % (path))
+        out += sha
+        file_flavors = files.flavors_for_file(path)
+        if file_flavors is None:
+            out.append(0)
+        else:
+            out.append(1)
+            _write_varint(out, len(file_flavors))
+            for flavor in file_flavors:
+                _write_varint(out, flavor_indexes[flavor])
+        file_formats = files.formats_for_file(path) or {}
+        _write_varint(out, len(file_formats))
+        for format, format_info in file_formats.items():
+            _write_varint(out, format_indexes[format])
+            _write_varint(out, format_info['size'])
+
+    return bytes(out)
+
+
+def decode(b: bytes, mutable: bool = True) -> ZincManifest:
+    """Decodes a manifest encoded by `encode`."""
+    if b[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a binary manifest")
+    b = bytes(b)
+    pos = len(MAGIC)
+
+    def read_varint():
+        nonlocal pos
+        n = 0
+        shift = 0
+        while True:
+            byte = b[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def read_string():
+        nonlocal pos
+        length = read_varint()
+        s = b[pos:pos + length].decode('utf-8')
+        pos += length
+        return s
+
+    try:
+        catalog_id = read_string()
+        bundle_name = read_string()
+        version = read_varint()
+        format = read_string()
+        flavors = [read_string() for _ in range(read_varint())]
+        manifest_flavors = flavors[:read_varint()]
+        formats = [read_string() for _ in range(read_varint())]
+
+        # This loop is the hot path for large manifests, so single-byte
+        # varints (lengths, counts and table indexes, usually) are read inline.
+        files = dict()
+        for _ in range(read_varint()):
+            length = b[pos]
+            if length < 0x80:
+                pos += 1
+                path = b[pos:pos + length].decode('utf-8')
+                pos += length
+            else:
+                path = read_string()
+            sha = b[pos:pos + 20].hex()
+            has_flavors = b[pos + 20]
+            pos += 21
+            file_info = {'sha': sha}
+            if has_flavors:
+                count = b[pos]
+                if count == 1 and b[pos + 1] < 0x80:
+                    file_info['flavors'] = [flavors[b[pos + 1]]]
+                    pos += 2
+                else:
+                    file_info['flavors'] = [flavors[read_varint()] for _ in range(read_varint())]
+            file_formats = dict()
+            for _ in range(read_varint()):
+                format_name = formats[read_varint()]
+                file_formats[format_name] = {'size': read_varint()}
+            file_info['formats'] = file_formats
+            files[path] = file_info
+    except (IndexError, UnicodeDecodeError):
+        raise ValueError("Truncated binary manifest")
+
+    manifest = ZincManifest.from_dict({
+        'catalog': catalog_id,
+        'bundle': bundle_name,
+        'version': version,
+        'format': format or defaults['zinc_format'],
+        'flavors': manifest_flavors,
+        'files': files,
+    }, mutable=mutable)
+    return manifest
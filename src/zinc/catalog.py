@@ -1,13 +1,23 @@
 import os
 import logging
+import random
+import threading
+import time
 from functools import wraps
 from urllib.parse import urlparse
 import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from typing import List, Optional
 
 from zinc.models import ZincIndex, ZincManifest, ZincCatalogConfig, ZincFlavorSpec
 from zinc.defaults import defaults
+import zinc.jsoncodec as jsoncodec
+import zinc.binarymanifest as binarymanifest
 from zinc.formats import Formats
+from zinc.storages import PreconditionFailed
+import zinc.compression as compression
 import zinc.helpers as helpers
 import zinc.utils as utils
 
@@ -52,6 +62,27 @@ class ZincCatalogPathHelper(object):
     def path_for_index(self) -> str:
         return defaults['catalog_index_name']
 
+    @property
+    def index_dir(self):
+        return "index"
+
+    @property
+    def index_shards_dir(self):
+        return os.path.join(self.index_dir, "bundles")
+
+    def path_for_index_root(self) -> str:
+        return os.path.join(self.index_dir, "root.json")
+
+    def path_for_index_shard(self, bundle_name: str, generation: int) -> str:
+        return os.path.join(self.index_shards_dir, bundle_name, "%d.json" % (generation))
+
+    @property
+    def journal_dir(self):
+        return "journal"
+
+    def path_for_journal_record(self, seq: int) -> str:
+        return os.path.join(self.journal_dir, "%010d.json" % (seq))
+
     def manifest_name(self, bundle_name: str, version: int) -> str:
         return "%s-%d.json" % (bundle_name, version)
 
@@ -64,6 +95,12 @@ class ZincCatalogPathHelper(object):
         return self.path_for_manifest_for_bundle_version(
             manifest.bundle_name, manifest.version)
 
+    def binary_manifest_name(self, bundle_name: str, version: int) -> str:
+        return "%s-%d.%s" % (bundle_name, version, binarymanifest.FILE_EXTENSION)
+
+    def path_for_binary_manifest_for_bundle_version(self, bundle_name: str, version: int) -> str:
+        return os.path.join(self.manifests_dir, self.binary_manifest_name(bundle_name, version))
+
     def path_for_file_with_sha(self, sha: str, ext: Optional[str] = None, format=None) -> str:
 
         if ext is not None and format is not None:
@@ -102,6 +139,9 @@ def _ensure_index_lock(func):
 
         slf = args[0]
 
+        if slf.is_optimistic:
+            return slf._with_optimistic_retries(func, *args, **kwargs)
+
         assert slf._coordinator
 
         if not slf.lock().is_locked():
@@ -113,11 +153,23 @@ def _ensure_index_lock(func):
     return with_ensure_index_lock
 
 
+class ZincPublishError(Exception):
+    """Raised when some of the files published together could not be
+    written. `failures` maps each failed subpath to its exception."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super(ZincPublishError, self).__init__(
+            "Failed to write %s" % (", ".join(
+                "%s (%s)" % (subpath, exc) for subpath, exc in sorted(failures.items()))))
+
+
 class ZincAbstractCatalog(object):
 
     def get_index(self):
         """
-        Returns an *immutable* copy of the catalog index.
+        Returns an *immutable* snapshot of the catalog index. Snapshots are
+        not affected by later changes to the catalog.
         """
         raise NotImplementedError()
 
@@ -132,7 +184,7 @@ class ZincAbstractCatalog(object):
         raise NotImplementedError()
 
     # special
-    def import_path(self, src_path: str):
+    def import_path(self, src_path: str, sha: Optional[str] = None, blob_stage=None):
         raise NotImplementedError()
 
     def delete_bundle_version(self, bundle_name: str, version: int):
@@ -183,11 +235,16 @@ class ZincAbstractCatalog(object):
         for bundle_name in index.bundle_names():
             for version in index.versions_for_bundle(bundle_name):
                 bundle_descriptors.append("%s-%d" % (bundle_name, version))
-                manifest = self.manifest_for_bundle(bundle_name, version)
-                if manifest is None:
-                    log.warn('Could not load manifest for %s-%d' % (bundle_name, version))
-                    continue
-                for flavor in manifest.flavors:
+                version_info = index.version_info_for_bundle(bundle_name, version)
+                if version_info is not None:
+                    flavors = version_info['flavors']
+                else:  # not backfilled yet
+                    manifest = self.manifest_for_bundle(bundle_name, version)
+                    if manifest is None:
+                        log.warn('Could not load manifest for %s-%d' % (bundle_name, version))
+                        continue
+                    flavors = manifest.flavors
+                for flavor in flavors:
                     bundle_descriptors.append("%s-%d~%s" % (bundle_name, version, flavor))
         return bundle_descriptors
 
@@ -195,6 +252,80 @@ class ZincAbstractCatalog(object):
 ################################################################################
 
 
+class ZincManifestCache(object):
+    """A thread-safe LRU cache of parsed, immutable manifests.
+
+    Manifests never change once written, so they can be kept for as long as
+    there is room. The cache is bounded both by the number of entries and by
+    the total size of the manifests' JSON, evicting the least recently used
+    manifests first. A single cache may be shared by several catalogs, so
+    keys include the catalog URL.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries if max_entries is not None \
+            else defaults['catalog_manifest_cache_max_entries']
+        self.max_bytes = max_bytes if max_bytes is not None \
+            else defaults['catalog_manifest_cache_max_bytes']
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """Total size in bytes of the cached manifests."""
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, manifest, size):
+        assert not manifest.is_mutable
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self._entries[key] = (manifest, size)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+shared_manifest_cache = ZincManifestCache()
+"""A process-wide manifest cache which catalogs may opt into sharing."""
+
+
 class ZincCatalogLock(object):
 
     def __init__(self, catalog, lock):
@@ -213,10 +344,45 @@ class ZincCatalogLock(object):
         return self._lock.is_locked()
 
 
+class ZincCatalogOptimisticLock(object):
+    """Stands in for `ZincCatalogLock` in optimistic mode. Nothing is locked:
+    the index is reloaded on entry and published on exit with a conditional
+    write, which raises `PreconditionFailed` if another writer got there
+    first. Nothing is published if the block raises or doesn't change the
+    index. Threads sharing the catalog take turns, as they share its index
+    and the token of the conditional write."""
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+        self._local = threading.local()
+        self._mutex = threading.RLock()
+
+    def __enter__(self):
+        self._mutex.acquire()
+        try:
+            self._catalog._reload()
+        except BaseException:
+            self._mutex.release()
+            raise
+        self._local.locked = True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None and self._catalog.index.is_dirty():
+                self._catalog.save()
+        finally:
+            self._local.locked = False
+            self._mutex.release()
+
+    def is_locked(self):
+        return getattr(self._local, 'locked', False)
+
+
 class ZincCatalog(ZincAbstractCatalog):
 
     def __init__(self, storage=None, coordinator=None, path_helper=None,
-                 lock_timeout=None, **kwargs):
+                 lock_timeout=None, compressibility_estimator=None,
+                 manifest_cache=None, optimistic=None, **kwargs):
         assert storage
 
         super(ZincCatalog, self).__init__(**kwargs)
@@ -225,12 +391,26 @@ class ZincCatalog(ZincAbstractCatalog):
         self._storage = storage
 
         self._ph = path_helper or ZincCatalogPathHelper()
-        self._manifests = {}
+        if manifest_cache is None:
+            if defaults['catalog_share_manifest_cache']:
+                manifest_cache = shared_manifest_cache
+            else:
+                manifest_cache = ZincManifestCache()
+        self._manifests = manifest_cache
+        self._object_index = None
+        self._object_index_lock = threading.Lock()
+        self._compressibility_estimator = compressibility_estimator
         self.lock_timeout = lock_timeout or defaults['catalog_lock_timeout']
+        self._optimistic = optimistic
+        self._index_token = None
+        self._compacted_seq = 0
+        self.config = None
 
         self._reload()
 
-        if self._coordinator is not None:
+        if self.is_optimistic:
+            self._lock = ZincCatalogOptimisticLock(self)
+        elif self._coordinator is not None:
             self._lock = ZincCatalogLock(self,
                                          self._coordinator.get_index_lock(domain=self.id,
                                                                           timeout=lock_timeout))
@@ -257,6 +437,43 @@ class ZincCatalog(ZincAbstractCatalog):
     def path_helper(self):
         return self._ph
 
+    @property
+    def is_optimistic(self):
+        """Whether index updates use conditional writes instead of the
+        coordinator's lock. Set by the catalog config's `index_concurrency`
+        when the catalog is first loaded, unless overridden when the catalog
+        is created. Later changes to the config don't affect this catalog."""
+        if self._optimistic is None:
+            self._optimistic = self.config.index_concurrency == 'optimistic'
+        return self._optimistic
+
+    @property
+    def is_sharded(self):
+        """Whether the index is stored as one small file per bundle plus a
+        root listing the bundles, as set by the catalog config's
+        `index_layout`."""
+        return self.config.index_layout == 'sharded'
+
+    @property
+    def is_journaled(self):
+        """Whether index changes are appended to a journal, and only folded
+        into the index file once enough have accumulated, as set by the
+        catalog config's `index_journal`. Not used with the sharded layout."""
+        return self.config.index_journal and not self.is_sharded
+
+    @property
+    def manifest_cache(self):
+        return self._manifests
+
+    @property
+    def compressibility_estimator(self):
+        """The `CompressibilityEstimator` used to skip compressing files which
+        clearly won't pass `config.gzip_threshhold`."""
+        if self._compressibility_estimator is None:
+            self._compressibility_estimator = compression.default_estimator(
+                skip_extensions=self.config.gzip_skip_extensions)
+        return self._compressibility_estimator
+
     def format(self):
         return self.index.format
 
@@ -264,17 +481,38 @@ class ZincCatalog(ZincAbstractCatalog):
 
     def _reload(self):
 
+        # the config is read once per catalog, like the concurrency mode
+        if self.config is None:
+            self._read_config_file()
+
         self.index = self._read_index()
         if self.index.format != defaults['zinc_format']:
             raise Exception("Incompatible format %s" % (self.index.format))
 
-        self._read_config_file()
+    def _with_optimistic_retries(self, func, *args, **kwargs):
+        if self.lock().is_locked():
+            return func(*args, **kwargs)
+        retries = defaults['catalog_optimistic_retries']
+        for attempt in range(retries + 1):
+            try:
+                with self.lock():
+                    return func(*args, **kwargs)
+            except PreconditionFailed:
+                if attempt == retries:
+                    raise
+                log.info('Index changed while updating, retrying (%d/%d)' % (attempt + 1, retries))
+                time.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
 
     def _read_config_file(self):
-        # log.warn('reimplement config loading')
-        self.config = ZincCatalogConfig()
-        # config_path = pjoin(self.path, defaults['catalog_config_name'])
-        # self.config = load_config(config_path)
+        subpath = defaults['catalog_config_name']
+        try:
+            bytes = self._read(subpath)
+        except FileNotFoundError:
+            bytes = None
+        if bytes is None:
+            self.config = ZincCatalogConfig()
+        else:
+            self.config = ZincCatalogConfig.from_bytes(bytes.decode('utf-8'))
 
     # I/O Helpers
 
@@ -285,48 +523,310 @@ class ZincCatalog(ZincAbstractCatalog):
 
     def _write(self, subpath: str, bytes: bytes, raw: bool = True, gzip: bool = True, max_age: Optional[int] = None):
         log.debug(f'ZincCatalog: _write() called. (subpath: {subpath}, raw: {raw}, gzip: {gzip})')
+        writes = list()
         if raw:
-            self._storage.puts(subpath, bytes, max_age=max_age)
+            writes.append((subpath, bytes))
         if gzip:
-            self._storage.puts(subpath + '.gz', utils.gzip_bytes(bytes), max_age=max_age)
+            writes.append((subpath + '.gz', utils.gzip_bytes(bytes)))
+        self._publish(writes, max_age=max_age)
+
+    def _publish(self, writes, max_age=None):
+        """Writes each `(subpath, bytes)` in `writes` concurrently, and waits
+        for all of them. Raises `ZincPublishError` if any failed."""
+        if len(writes) == 0:
+            return
+        if len(writes) == 1:
+            subpath, bytes = writes[0]
+            self._storage.puts(subpath, bytes, max_age=max_age)
+            return
+        jobs = min(len(writes), defaults['catalog_publish_jobs'])
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [(subpath, executor.submit(self._storage.puts, subpath, bytes, max_age=max_age))
+                       for subpath, bytes in writes]
+        failures = dict()
+        for subpath, future in futures:
+            exc = future.exception()
+            if exc is not None:
+                log.error("Failed to write %s: %s" % (subpath, exc))
+                failures[subpath] = exc
+        if len(failures) > 0:
+            raise ZincPublishError(failures)
+
+    def _read_index_file(self, subpath):
+        if self.is_optimistic:
+            bytes, self._index_token = self._storage.get_with_token(subpath)
+        else:
+            bytes = self._read(subpath)
+        return bytes.decode('utf-8')
 
     def _read_index(self):
+        if self.is_sharded:
+            return self._read_sharded_index()
         subpath = self._ph.path_for_index()
-        bytes = self._read(subpath).decode('utf-8')
-        return ZincIndex.from_bytes(bytes)
+        index = ZincIndex.from_bytes(self._read_index_file(subpath))
+        if self.is_journaled:
+            self._compacted_seq = index.journal_seq or 0
+            self._replay_journal(index)
+        return index
+
+    def _journal_seqs(self):
+        seqs = list()
+        for path in self._storage.list(self._ph.journal_dir):
+            name = os.path.splitext(path)[0]
+            if name.isdigit():
+                seqs.append(int(name))
+        return sorted(seqs)
+
+    def journal_records(self, after_seq: int = 0):
+        """
+        Yields the index journal's records with a sequence number greater
+        than `after_seq`, in order. Each record has the keys `seq` and
+        `mutations`, a list of changes as applied by
+        `ZincIndex.apply_mutation`.
+        """
+        for seq in self._journal_seqs():
+            if seq > after_seq:
+                subpath = self._ph.path_for_journal_record(seq)
+                yield jsoncodec.loads(self._read(subpath))
+
+    def _replay_journal(self, index):
+        for record in self.journal_records(after_seq=index.journal_seq or 0):
+            for mutation in record['mutations']:
+                index.apply_mutation(mutation)
+            index.journal_seq = record['seq']
+        index.mark_clean()
+
+    def _read_index_shard(self, bundle_name, generation):
+        subpath = self._ph.path_for_index_shard(bundle_name, generation)
+        return jsoncodec.loads(self._read(subpath))
+
+    def _read_sharded_index(self):
+        subpath = self._ph.path_for_index_root()
+        if self._storage.get_meta(subpath) is None:
+            # not sharded yet, all bundles are written as shards on save
+            index = ZincIndex.from_bytes(self._read(self._ph.path_for_index()).decode('utf-8'))
+            self._index_token = None
+            return index.to_shards(self._read_index_shard)
+        d = jsoncodec.loads(self._read_index_file(subpath))
+        return ZincIndex.from_shards(d, self._read_index_shard)
+
+    def _write_index_file(self, subpath, bytes, raw=True, gzip=True, max_age=None, copies=()):
+        """Publishes an index file, along with `copies` of it at other
+        subpaths. The contents are only compressed once."""
+        gz_bytes = utils.gzip_bytes(bytes) if gzip else None
+        writes = list()
+        for path in (subpath,) + tuple(copies):
+            if raw:
+                if path == subpath and self.is_optimistic:
+                    # the conditional write of the index decides the race,
+                    # everything else is only written once it has succeeded
+                    self._index_token = self._storage.put_if_match(
+                        subpath, bytes, self._index_token, max_age=max_age)
+                else:
+                    writes.append((path, bytes))
+            if gzip:
+                writes.append((path + '.gz', gz_bytes))
+        self._publish(writes, max_age=max_age)
 
     def _write_index(self, index, raw=True, gzip=True):
+        if self.is_sharded:
+            return self._write_sharded_index(index)
+        if self.is_journaled:
+            return self._write_journal(index)
+        self._write_index_snapshot(index, raw=raw, gzip=gzip)
+        index.mark_clean()
+
+    def _write_index_snapshot(self, index, raw=True, gzip=True):
         subpath = self._ph.path_for_index()
         bytes = index.to_bytes()
+        ZincIndex.mark_validated(bytes)
         max_age = defaults['catalog_index_max_age_seconds']
-        self._write(subpath, bytes, raw=raw, gzip=gzip, max_age=max_age)
-        if defaults['catalog_write_legacy_index']:
-            self._write('index.json', bytes, raw=raw, gzip=gzip, max_age=max_age)
+        copies = ('index.json',) if defaults['catalog_write_legacy_index'] else ()
+        self._write_index_file(subpath, bytes, raw=raw, gzip=gzip, max_age=max_age,
+                               copies=copies)
 
-    def _read_manifest(self, bundle_name, version):
+    def _write_legacy_index_snapshot(self, index):
+        # In the sharded layout catalog.json is only a copy for clients which
+        # don't read shards, so it is not part of the conditional write.
+        bytes = index.to_bytes()
+        ZincIndex.mark_validated(bytes)
+        gz_bytes = utils.gzip_bytes(bytes)
+        paths = [self._ph.path_for_index()]
+        if defaults['catalog_write_legacy_index']:
+            paths.append('index.json')
+        writes = list()
+        for path in paths:
+            writes.extend([(path, bytes), (path + '.gz', gz_bytes)])
+        self._publish(writes, max_age=defaults['catalog_index_max_age_seconds'])
+
+    def _write_journal(self, index):
+        mutations = index.mutations()
+        if len(mutations) > 0:
+            # all changes from one update go in a single record, so they are
+            # published (or not) together
+            seq = (index.journal_seq or 0) + 1
+            record = {'seq': seq, 'mutations': mutations}
+            subpath = self._ph.path_for_journal_record(seq)
+            bytes = jsoncodec.dumpb(record)
+            if self.is_optimistic:
+                # creating the record claims its sequence number
+                self._storage.put_if_match(subpath, bytes, None)
+            else:
+                self._storage.puts(subpath, bytes)
+            index.journal_seq = seq
+            index.mark_clean()
+        tail = (index.journal_seq or 0) - self._compacted_seq
+        if tail >= defaults['catalog_journal_compact_threshold']:
+            self._compact_journal(index)
+
+    def _compact_journal(self, index):
+        previous_compacted_seq = self._compacted_seq
+        try:
+            self._write_index_snapshot(index)
+        except PreconditionFailed:
+            # another writer compacted first, the journal is still intact
+            log.info('Index was compacted by another writer')
+            return
+        self._compacted_seq = index.journal_seq or 0
+        log.info('Compacted index journal up to record %d' % (self._compacted_seq))
+
+        # Records folded into the previous index file are no longer needed by
+        # readers of either it or the new one.
+        for seq in self._journal_seqs():
+            if seq <= previous_compacted_seq:
+                self._storage.delete(self._ph.path_for_journal_record(seq))
+
+    def _write_sharded_index(self, index):
+        dirty_bundle_names = index.dirty_bundle_names()
+        if len(dirty_bundle_names) == 0:
+            return
+
+        # Shards are written under new generations, and only become visible
+        # once the root refers to them, so readers never see a partial update.
+        bundle_names = set(index.bundle_names())
+        generations = index.shard_generations
+        writes = list()
+        for bundle_name in dirty_bundle_names & bundle_names:
+            bytes = jsoncodec.dumpb(index.shard_for_bundle(bundle_name))
+            if self.is_optimistic:
+                # Concurrent writers would pick the same next generation, so
+                # shards are created only if absent, after any left behind by
+                # writers that lost the race. Losing a create is retried like
+                # losing the root's conditional write.
+                generation = max(generations[bundle_name],
+                                 self._latest_index_shard_generation(bundle_name)) + 1
+                subpath = self._ph.path_for_index_shard(bundle_name, generation)
+                self._storage.put_if_match(subpath, bytes, None)
+            else:
+                generation = generations[bundle_name] + 1
+                subpath = self._ph.path_for_index_shard(bundle_name, generation)
+                writes.append((subpath, bytes))
+            generations[bundle_name] = generation
+        self._publish(writes)
+        index.set_shard_generations(generations)
+
+        root_bytes = jsoncodec.dumpb(index.shard_dict())
+        max_age = defaults['catalog_index_max_age_seconds']
+        self._write_index_file(self._ph.path_for_index_root(), root_bytes,
+                               gzip=False, max_age=max_age)
+        index.mark_clean()
+
+    def _latest_index_shard_generation(self, bundle_name):
+        dir = os.path.join(self._ph.index_shards_dir, bundle_name)
+        generations = [int(os.path.splitext(f)[0]) for f in self._storage.list(dir)
+                       if os.path.splitext(f)[0].isdigit()]
+        return max(generations, default=0)
+
+    def _read_manifest(self, bundle_name, version, mutable=True):
+        if self.config.binary_manifests:
+            # Versions created before binary manifests were enabled only have
+            # a JSON manifest, so fall back to that on a miss.
+            subpath = self._ph.path_for_binary_manifest_for_bundle_version(bundle_name, version)
+            try:
+                bytes = self._read(subpath)
+            except FileNotFoundError:
+                bytes = None
+            if bytes is not None:
+                return binarymanifest.decode(bytes, mutable=mutable), len(bytes)
         subpath = self._ph.path_for_manifest_for_bundle_version(bundle_name,
                                                                 version)
-        bytes = self._read(subpath).decode('utf-8')
+        bytes = self._read(subpath)
         if bytes is not None:
-            return ZincManifest.from_bytes(bytes)
+            return ZincManifest.from_bytes(bytes.decode('utf-8'), mutable=mutable), len(bytes)
         else:
-            return None
+            return None, 0
+
+    def _manifest_cache_key(self, bundle_name, version):
+        return (self.url, bundle_name, int(version))
 
     def _write_manifest(self, manifest, raw=True, gzip=True):
         subpath = self._ph.path_for_manifest(manifest)
         bytes = manifest.to_bytes()
-        self._write(subpath, bytes, raw=raw, gzip=gzip)
+        ZincManifest.mark_validated(bytes)
+        writes = list()
+        if raw:
+            writes.append((subpath, bytes))
+        if gzip:
+            writes.append((subpath + '.gz', utils.gzip_bytes(bytes)))
+        if self.config.binary_manifests:
+            binary_subpath = self._ph.path_for_binary_manifest_for_bundle_version(
+                manifest.bundle_name, manifest.version)
+            writes.append((binary_subpath, binarymanifest.encode(manifest)))
+        self._publish(writes)
+
+    def _load_object_index(self):
+        object_index = dict()
+        for path, meta in self._storage.list_meta(self._ph.objects_dir).items():
+            sha, ext = os.path.splitext(os.path.basename(path))
+            format = helpers.format_for_file_extension(ext[1:])
+            object_index.setdefault(sha, dict())[format] = meta['size']
+        log.debug("Loaded object index with %d objects" % (len(object_index)))
+        return object_index
+
+    def _get_object_index(self):
+        """
+        Returns a dictionary of `sha` -> {`format`: `size`} for every object
+        in the catalog. It is built from a single listing of the objects
+        directory the first time it is needed, and kept up to date as files
+        are imported.
+        """
+        with self._object_index_lock:
+            if self._object_index is None:
+                self._object_index = self._load_object_index()
+            return self._object_index
+
+    def _add_to_object_index(self, sha, format, size):
+        object_index = self._get_object_index()
+        with self._object_index_lock:
+            object_index.setdefault(sha, dict())[format] = size
+
+    def _invalidate_object_index(self):
+        with self._object_index_lock:
+            self._object_index = None
+
+    def _preferred_formats(self):
+        """The default preferred formats, limited to RAW and the codecs in
+        the catalog config."""
+        return [format for format in defaults['catalog_preferred_formats']
+                if format == Formats.RAW or format in self.config.codecs]
 
     def _get_file_info(self, sha, preferred_formats=None):
+        """
+        Returns the file info for the object with `sha` from the object
+        index. Unless `preferred_formats` is given, the formats of the
+        catalog's codecs are preferred, then any other valid format the
+        object was stored in before the config changed.
+        """
         if preferred_formats is None:
-            preferred_formats = defaults['catalog_preferred_formats']
+            preferred_formats = self._preferred_formats()
+            preferred_formats.extend(format for format in defaults['catalog_valid_formats']
+                                     if format not in preferred_formats)
+        sizes = self._get_object_index().get(sha) or dict()
         for format in preferred_formats:
-            subpath = self._ph.path_for_file_with_sha(sha, format=format)
-            meta = self._storage.get_meta(subpath)
-            if meta is not None:
+            if format in sizes:
                 return {
                     'sha': sha,
-                    'size': meta['size'],
+                    'size': sizes[format],
                     'format': format
                 }
         return None
@@ -335,15 +835,22 @@ class ZincCatalog(ZincAbstractCatalog):
         subpath = self._ph.path_for_file_with_sha(sha, ext=ext)
         return self._storage.get(subpath)
 
+    def _iter_file(self, sha, ext=None):
+        subpath = self._ph.path_for_file_with_sha(sha, ext=ext)
+        return self._storage.iter_chunks(subpath)
+
     def _write_file(self, sha, src_path, format=None):
         log.debug(f'ZincCatalog: _write_file() called. (sha: {sha}, src_path: {src_path}, format: {format})')
+        with open(src_path, 'rb') as src_file:
+            return self._write_fileobj(sha, src_file, format=format)
+
+    def _write_fileobj(self, sha, fileobj, format=None):
         format = format or Formats.RAW  # default to RAW
         if format not in defaults['catalog_valid_formats']:
             raise Exception("Invalid format '%s'." % (format))
-        ext = format if format != Formats.RAW else None
+        ext = helpers.file_extension_for_format(format)
         subpath = self._ph.path_for_file_with_sha(sha, ext)
-        with open(src_path, 'rb') as src_file:
-            self._storage.put(subpath, src_file)
+        self._storage.put(subpath, fileobj)
         return subpath
 
     def _get_archive_info(self, bundle_name, version, flavor=None):
@@ -356,11 +863,14 @@ class ZincCatalog(ZincAbstractCatalog):
     def _write_archive(self, bundle_name, version, src_path, flavor=None):
         log.debug(f'ZincCatalog: _write_archive() called. (bundle_name: {bundle_name}, version: {version},'
                   f' src_path: {src_path}, flavor: {flavor})')
+        with open(src_path, 'rb') as src_file:
+            return self._write_archive_fileobj(bundle_name, version, src_file, flavor=flavor)
+
+    def _write_archive_fileobj(self, bundle_name, version, fileobj, flavor=None):
         subpath = self._ph.path_for_archive_for_bundle_version(bundle_name,
                                                                version,
                                                                flavor=flavor)
-        with open(src_path, 'rb') as src_file:
-            self._storage.put(subpath, src_file)
+        self._storage.put(subpath, fileobj)
         return subpath
 
     def _read_archive(self, bundle_name, version, flavor=None):
@@ -380,10 +890,27 @@ class ZincCatalog(ZincAbstractCatalog):
         self._write_index(self.index)
 
     def get_index(self):
-        return self.index.clone(mutable=False)
+        return self.index.snapshot()
+
+    @_ensure_index_lock
+    def compact_index(self):
+        """Folds the index journal into the index file, if the catalog uses
+        one, or writes the sharded index out as one file, if the catalog is
+        sharded, so that clients reading `catalog.json` or `index.json`
+        directly see every update."""
+        if self.is_sharded:
+            self._write_legacy_index_snapshot(self.index)
+        elif self.is_journaled and (self.index.journal_seq or 0) > self._compacted_seq:
+            self._compact_journal(self.index)
 
     def get_manifest(self, bundle_name: str, version: int) -> ZincManifest:
-        return self._read_manifest(bundle_name, version)
+        key = self._manifest_cache_key(bundle_name, version)
+        manifest = self._manifests.get(key)
+        if manifest is None:
+            manifest, size = self._read_manifest(bundle_name, version, mutable=False)
+            if manifest is not None:
+                self._manifests.put(key, manifest, size)
+        return manifest
 
     @_ensure_index_lock
     def update_bundle(self, new_manifest: ZincManifest):
@@ -400,17 +927,17 @@ class ZincCatalog(ZincAbstractCatalog):
 
         # verify all files in the filelist exist in the repo
 
-        missing_shas = list()
-        info_by_path = dict()
-
+        # The object index may be out of date (e.g. another process imported
+        # or cleaned up objects after it was loaded), so now that the index is
+        # locked it is reloaded from one listing of the objects directory.
+        self._invalidate_object_index()
+        file_info_by_sha = dict()
         for path in new_manifest.files.keys():
             sha = new_manifest.sha_for_file(path)
-            file_info = self._get_file_info(sha)
-            if file_info is None:
-                missing_shas.append(sha)
-            else:
-                info_by_path[path] = file_info
+            if sha not in file_info_by_sha:
+                file_info_by_sha[sha] = self._get_file_info(sha)
 
+        missing_shas = [sha for sha, file_info in file_info_by_sha.items() if file_info is None]
         if len(missing_shas) > 0:
             # TODO: better error
             raise Exception("Missing shas: %s" % (missing_shas))
@@ -425,39 +952,118 @@ class ZincCatalog(ZincAbstractCatalog):
 
         self.index.add_version_for_bundle(new_manifest.bundle_name,
                                           new_manifest.version)
+        self._set_version_info(new_manifest)
+
+    def _set_version_info(self, manifest):
+        size = 0
+        for path in manifest.files.keys():
+            _, format_info = manifest.get_format_info_for_file(path)
+            if format_info is not None:
+                size += format_info['size']
+        self.index.set_version_info_for_bundle(manifest.bundle_name,
+                                               manifest.version,
+                                               manifest.flavors,
+                                               file_count=len(manifest.files),
+                                               size=size)
 
-    def import_path(self, src_path: str):
+    @_ensure_index_lock
+    def backfill_version_info(self):
+        """Records version info in the index for bundle versions created
+        before it was recorded by `update_bundle`. Returns the number of
+        versions updated."""
+        count = 0
+        for bundle_name in list(self.index.bundle_names()):
+            for version in list(self.index.versions_for_bundle(bundle_name)):
+                if self.index.version_info_for_bundle(bundle_name, version) is not None:
+                    continue
+                manifest = self.get_manifest(bundle_name, version)
+                if manifest is None:
+                    log.warn('Could not load manifest for %s-%d' % (bundle_name, version))
+                    continue
+                self._set_version_info(manifest)
+                count += 1
+        log.info('Backfilled version info for %d bundle versions' % (count))
+        return count
 
-        sha = utils.sha1_for_path(src_path)
+    def import_path(self, src_path: str, sha: Optional[str] = None, blob_stage=None):
+        """
+        Imports the file at `src_path` into the catalog and returns its file
+        info. If `sha` is already known (e.g. from a hash cache) and the
+        object exists, the file is not read at all. If a `ZincBlobStage` is
+        given, the compressed bytes are kept in it for building archives.
+        """
 
-        file_info = self._get_file_info(sha)
-        if file_info is not None:
-            return file_info
+        if sha is not None:
+            file_info = self._get_file_info(sha)
+            if file_info is not None:
+                return file_info
 
-        # gzip the file first, and see if it passes the compression threshhold
-        # TODO: this is stupid inefficient
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            src_path_gz = tmp_file.name
-            with open(src_path, 'rb') as src_file:
-                tmp_file.write(utils.gzip_bytes(src_file.read()))
-            tmp_file.flush()
+        if not self.compressibility_estimator.is_compressible(src_path, self.config.gzip_threshhold):
+            # clearly not worth compressing, so only hash it
+            sha = sha or utils.sha1_for_path(src_path)
+            file_info = self._get_file_info(sha)
+            if file_info is not None:
+                return file_info
+            imported_path = self._write_file(sha, src_path, format=Formats.RAW)
+            return self._imported(src_path, imported_path, sha, Formats.RAW,
+                                  os.path.getsize(src_path))
+
+        # hash and encode the file with every configured codec in a single
+        # pass, spilling the encoded bytes to disk so memory use does not
+        # depend on the file size
+        codecs = self.config.codecs
+        with ExitStack() as stack:
+            encoded_files = list()
+            for codec in codecs:
+                if blob_stage is not None:
+                    encoded_file = blob_stage.temporary_file()
+                else:
+                    encoded_file = tempfile.TemporaryFile()
+                encoded_files.append(stack.enter_context(encoded_file))
+
+            outputs = [(compression.compressobj_for_format(codec, self.config.level_for_format(codec)), f)
+                       for codec, f in zip(codecs, encoded_files)]
+            sha, src_size, encoded_sizes = utils.sha1_and_compress_path(src_path, outputs)
+
+            def stage(format):
+                # archives only read back the format the object is stored in
+                if blob_stage is not None and format in codecs:
+                    encoded_file = encoded_files[codecs.index(format)]
+                    encoded_file.flush()
+                    blob_stage.add_path(sha, format, encoded_file.name)
 
-            src_size = os.path.getsize(src_path)
-            src_gz_size = os.path.getsize(src_path_gz)
-            if src_size > 0 and float(src_gz_size) / src_size <= self.config.gzip_threshhold:
-                final_src_path = src_path_gz
-                final_src_size = src_gz_size
-                format = Formats.GZ
+            file_info = self._get_file_info(sha)
+            if file_info is not None:
+                stage(file_info['format'])
+                return file_info
+
+            # pick the smallest encoding that passes the compression
+            # threshhold, or RAW if none do
+            format = Formats.RAW
+            final_src_size = src_size
+            final_src_file = None
+            for codec, encoded_file, encoded_size in zip(codecs, encoded_files, encoded_sizes):
+                if src_size > 0 and float(encoded_size) / src_size <= self.config.gzip_threshhold \
+                        and (final_src_file is None or encoded_size < final_src_size):
+                    format = codec
+                    final_src_size = encoded_size
+                    final_src_file = encoded_file
+
+            stage(format)
+            if final_src_file is not None:
+                final_src_file.seek(0)
+                imported_path = self._write_fileobj(sha, final_src_file, format=format)
             else:
-                final_src_path = src_path
-                final_src_size = src_size
-                format = Formats.RAW
+                imported_path = self._write_file(sha, src_path, format=format)
+
+        return self._imported(src_path, imported_path, sha, format, final_src_size)
 
-            imported_path = self._write_file(sha, final_src_path, format=format)
+    def _imported(self, src_path, imported_path, sha, format, size):
+        self._add_to_object_index(sha, format, size)
 
         file_info = {
             'sha': sha,
-            'size': final_src_size,
+            'size': size,
             'format': format
         }
         log.info("Imported %s --> %s" % (src_path, file_info))
@@ -467,6 +1073,7 @@ class ZincCatalog(ZincAbstractCatalog):
     @_ensure_index_lock
     def delete_bundle_version(self, bundle_name: str, version: int):
         self.index.delete_bundle_version(bundle_name, version)
+        self._manifests.invalidate(self._manifest_cache_key(bundle_name, version))
 
     @_ensure_index_lock
     def update_distribution(self, distribution_name: str, bundle_name: str, bundle_version: int, save_previous: bool = True):
@@ -486,6 +1093,13 @@ class ZincCatalog(ZincAbstractCatalog):
             prev_distro = helpers.distro_previous_name(distribution_name)
             self.index.delete_distribution(prev_distro, bundle_name)
 
+    def update_config(self, config: ZincCatalogConfig):
+        """Writes the catalog config, e.g. to choose the codecs and
+        compression levels used for newly imported files."""
+        self._write(defaults['catalog_config_name'], config.to_bytes(), raw=True, gzip=False)
+        self.config = config
+        self._compressibility_estimator = None
+
     def get_flavorspec_names(self) -> List[str]:
         subpath = self.path_helper.config_flavorspec_dir
         return [os.path.splitext(p)[0] for p in self._storage.list(prefix=subpath)]
@@ -510,8 +1124,17 @@ class ZincCatalog(ZincAbstractCatalog):
         subpath = self._ph.path_for_flavorspec_name(name)
         self._storage.delete(subpath)
 
-    @_ensure_index_lock
     def clean(self, dry_run: bool = False):
+        if self.is_optimistic:
+            # Optimistic writers aren't excluded by any lock, and a retried
+            # update can't bring back files that were already deleted.
+            raise Exception("Can't clean a catalog with optimistic index concurrency. Set the "
+                            "catalog config's 'index_concurrency' to 'lock' and reopen the "
+                            "catalog once no optimistic writers are running.")
+        self._clean(dry_run=dry_run)
+
+    @_ensure_index_lock
+    def _clean(self, dry_run: bool = False):
         verb = 'Would remove' if dry_run else 'Removing'
 
         bundle_descriptors = self.bundle_descriptors()
@@ -521,7 +1144,8 @@ class ZincCatalog(ZincAbstractCatalog):
         dir = self._ph.manifests_dir
         for f in self._storage.list(dir):
             remove = False
-            if not (f.endswith(".json") or f.endswith(".json.gz")):
+            if not (f.endswith(".json") or f.endswith(".json.gz") or
+                    f.endswith("." + binarymanifest.FILE_EXTENSION)):
                 # remove stray files
                 remove = True
             else:
@@ -575,3 +1199,26 @@ class ZincCatalog(ZincAbstractCatalog):
                 log.info("%s %s" % (verb, subpath))
                 if not dry_run:
                     self._storage.delete(subpath)
+
+        # 4. clean index shards which have been superseded
+
+        if self.is_sharded:
+            generations = self.index.shard_generations
+            dir = self._ph.index_shards_dir
+            for path in self._storage.list(dir):
+                bundle_name, basename = os.path.split(path)
+                current = generations.get(bundle_name)
+                if current is None:
+                    # the bundle is no longer in the index
+                    remove = True
+                else:
+                    generation = os.path.splitext(basename)[0]
+                    remove = not generation.isdigit() or int(generation) < current
+                if remove:
+                    subpath = os.path.join(dir, path)
+                    log.info("%s %s" % (verb, subpath))
+                    if not dry_run:
+                        self._storage.delete(subpath)
+
+        if not dry_run:
+            self._invalidate_object_index()
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import json
 import logging
 import os
 import sys
@@ -10,10 +9,13 @@ from functools import wraps
 
 from zinc.utils import canonical_path
 from zinc.models import ZincFlavorSpec
+from zinc.hashcache import ZincHashCache
 from zinc.formats import Formats
 from zinc.client import ZincClientConfig
+from zinc.defaults import defaults
 import zinc.client as client
 import zinc.helpers as helpers
+import zinc.jsoncodec as jsoncodec
 import zinc.utils as utils
 
 log = logging.getLogger(__name__)
@@ -123,10 +125,15 @@ def parse_multi_version_ish(catalog, bundle_name, version_list):
 
 
 def bundle_update(catalog, bundle_name, path, flavors=None, force=False,
-                  skip_master_archive=True):
+                  skip_master_archive=True, jobs=None, hash_cache=None,
+                  archive_jobs=None, archive_tmp_limit=None, incremental=False):
     manifest = client.create_bundle_version(catalog, bundle_name, path,
                                             flavor_spec=flavors, force=force,
-                                            skip_master_archive=skip_master_archive)
+                                            skip_master_archive=skip_master_archive,
+                                            jobs=jobs, hash_cache=hash_cache,
+                                            archive_jobs=archive_jobs,
+                                            archive_tmp_limit=archive_tmp_limit,
+                                            incremental=incremental)
     #print("Updated %s v%d" % (manifest.bundle_name, manifest.version))
     # TODO: add some nice human readable and machine readable output options
     print("%d" % (manifest.version))
@@ -211,6 +218,17 @@ def subcmd_catalog_clean(config, cargs):
     catalog.clean(dry_run=not cargs.force)
 
 
+def subcmd_catalog_compact(config, cargs):
+    catalog = get_catalog(config, cargs)
+    catalog.compact_index()
+
+
+def subcmd_catalog_backfill(config, cargs):
+    catalog = get_catalog(config, cargs)
+    count = catalog.backfill_version_info()
+    print("Backfilled version info for %d bundle versions." % (count))
+
+
 @cli_cmd
 def subcmd_bundle_list(config, cargs):
     catalog = get_catalog(config, cargs)
@@ -229,7 +247,7 @@ def subcmd_bundle_update(config, cargs):
     if cargs.flavors is not None:
         try:
             with open(cargs.flavors) as f:
-                flavors_dict = json.load(f)
+                flavors_dict = jsoncodec.loads(f.read())
                 flavors = ZincFlavorSpec.from_dict(flavors_dict)
         except IOError:
             flavors = catalog.get_flavorspec(cargs.flavors)
@@ -240,9 +258,25 @@ def subcmd_bundle_update(config, cargs):
     path = cargs.path
     force = cargs.force
     skip_master_archive = cargs.skip_master_archive
-
-    bundle_update(catalog, bundle_name, path, flavors=flavors, force=force,
-                  skip_master_archive=skip_master_archive)
+    jobs = cargs.jobs
+    archive_jobs = cargs.archive_jobs
+    archive_tmp_limit = cargs.archive_tmp_limit
+    incremental = cargs.incremental
+
+    if incremental and cargs.no_hash_cache:
+        sys.exit("--incremental requires the hash cache.")
+
+    if cargs.no_hash_cache:
+        bundle_update(catalog, bundle_name, path, flavors=flavors, force=force,
+                      skip_master_archive=skip_master_archive, jobs=jobs,
+                      archive_jobs=archive_jobs, archive_tmp_limit=archive_tmp_limit,
+                      incremental=incremental)
+    else:
+        with ZincHashCache(path=cargs.hash_cache) as hash_cache:
+            bundle_update(catalog, bundle_name, path, flavors=flavors, force=force,
+                          skip_master_archive=skip_master_archive, jobs=jobs,
+                          hash_cache=hash_cache, archive_jobs=archive_jobs,
+                          archive_tmp_limit=archive_tmp_limit, incremental=incremental)
 
 
 def subcmd_bundle_clone(config, cargs):
@@ -486,6 +520,26 @@ def main():
                                           actually be removed.')
     parser_catalog_clean.set_defaults(func=subcmd_catalog_clean)
 
+    # catalog:compact
+    parser_catalog_compact = subparsers.add_parser('catalog:compact',
+                                                   help='Fold the index journal into the catalog \
+                                                       index file, or write a sharded index out to \
+                                                       it. With a journal or shards, catalog.json and \
+                                                       index.json only include the latest updates \
+                                                       once they are compacted.')
+    add_catalog_arg(parser_catalog_compact)
+    add_timeout_arg(parser_catalog_compact)
+    parser_catalog_compact.set_defaults(func=subcmd_catalog_compact)
+
+    # catalog:backfill
+    parser_catalog_backfill = subparsers.add_parser('catalog:backfill',
+                                                    help='Record flavors, file counts and sizes in the \
+                                                        index for bundle versions created before they \
+                                                        were recorded.')
+    add_catalog_arg(parser_catalog_backfill)
+    add_timeout_arg(parser_catalog_backfill)
+    parser_catalog_backfill.set_defaults(func=subcmd_catalog_backfill)
+
     # catalog:verify
     parser_catalog_verify = subparsers.add_parser('catalog:verify',
                                                   help='catalog:verify help')
@@ -537,6 +591,35 @@ def main():
                                       default=False,
                                       action='store_true',
                                       help='Update bundle even if no files changed.')
+    parser_bundle_update.add_argument('-j', '--jobs',
+                                      type=int,
+                                      default=None,
+                                      help='Number of files to import in parallel. Defaults to %d.'
+                                      % (defaults['bundle_update_jobs']))
+    parser_bundle_update.add_argument('--incremental',
+                                      default=False,
+                                      action='store_true',
+                                      help=('Only import files that are new or changed since the latest version. '
+                                            'Unchanged files are found with the hash cache and copied from its '
+                                            'manifest. Cannot be used with --no-hash-cache.'))
+    parser_bundle_update.add_argument('--archive-jobs',
+                                      type=int,
+                                      default=None,
+                                      help='Number of archives to build and upload in parallel. Defaults to %d.'
+                                      % (defaults['bundle_update_archive_jobs']))
+    parser_bundle_update.add_argument('--archive-tmp-limit',
+                                      type=int,
+                                      default=None,
+                                      help=('Maximum bytes of temporary disk used for archives, including compressed '
+                                            'files kept to build them.'))
+    parser_bundle_update.add_argument('--hash-cache',
+                                      default=None,
+                                      help='Path to the local hash cache. Defaults to \'%s\'.'
+                                      % (defaults['hash_cache_path']))
+    parser_bundle_update.add_argument('--no-hash-cache',
+                                      default=False,
+                                      action='store_true',
+                                      help='Hash every file instead of using the local hash cache.')
 
     parser_bundle_update_master_archive_group = parser_bundle_update.add_mutually_exclusive_group()
     parser_bundle_update_master_archive_group.add_argument('--skip-master-archive',
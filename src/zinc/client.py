@@ -7,15 +7,15 @@ import hashlib
 from collections import namedtuple
 from urllib.parse import urlparse
 import toml
-import json
 from typing import Optional
 
+import zinc.compression as compression
 import zinc.helpers as helpers
+import zinc.jsoncodec as jsoncodec
 import zinc.utils as utils
 from .catalog import ZincCatalog
 from .defaults import defaults
 from .coordinators import coordinator_for_url
-from .formats import Formats
 from .models import ZincModel, ZincIndex, ZincCatalogConfig
 from .storages import storage_for_url
 from .tasks.bundle_update import ZincBundleUpdateTask
@@ -47,7 +47,7 @@ class ZincClientConfig(ZincModel):
         self._d = d or dict()
 
     @classmethod
-    def from_bytes(cls, b, mutable=True):
+    def from_bytes(cls, b, mutable=True, trusted=False):
         d = toml.loads(b)
         return cls.from_dict(d, mutable=mutable)
 
@@ -108,7 +108,7 @@ class _Result(object):
 
     def format(self, fmt):
         if fmt == OutputType.JSON:
-            return json.dumps(self.to_dict())
+            return jsoncodec.dumps(self.to_dict())
         elif fmt == OutputType.PRETTY:
             return self._pretty(self)
         else:
@@ -324,15 +324,21 @@ def verify_catalog(catalog, should_lock=False, **kwargs):
 
 
 def create_bundle_version(catalog, bundle_name, src_dir, flavor_spec=None,
-                          force=False, skip_master_archive=False):
-
-    task = ZincBundleUpdateTask()
-    task.catalog = catalog
-    task.bundle_name = bundle_name
-    task.src_dir = src_dir
-    task.flavor_spec = flavor_spec
-    task.skip_master_archive = skip_master_archive
-    task.force = force
+                          force=False, skip_master_archive=False, jobs=None,
+                          hash_cache=None, archive_jobs=None, archive_tmp_limit=None,
+                          incremental=False):
+
+    task = ZincBundleUpdateTask(catalog=catalog,
+                                bundle_name=bundle_name,
+                                src_dir=src_dir,
+                                flavor_spec=flavor_spec,
+                                skip_master_archive=skip_master_archive,
+                                force=force,
+                                jobs=jobs,
+                                hash_cache=hash_cache,
+                                archive_jobs=archive_jobs,
+                                archive_tmp_limit=archive_tmp_limit,
+                                incremental=incremental)
     return task.run()
 
 
@@ -355,6 +361,15 @@ def delete_distribution(catalog, distribution_name, bundle_name,
                                 delete_previous=delete_previous)
 
 
+def _cheapest_decodable_format(formats):
+    """Returns the format in `formats` (as found in a manifest) with the
+    smallest size that this client can decode, or `None`."""
+    decodable = [f for f in formats.keys() if f in compression.DECODABLE_FORMATS]
+    if len(decodable) == 0:
+        return None
+    return min(decodable, key=lambda f: formats[f]['size'])
+
+
 def clone_bundle(catalog, bundle_name, version, root_path=None, bundle_dir_name=None, flavor=None):
 
     assert catalog
@@ -390,19 +405,11 @@ def clone_bundle(catalog, bundle_name, version, root_path=None, bundle_dir_name=
 
         utils.makedirs(os.path.dirname(dst_path))
 
-        if formats.get(Formats.RAW) is not None:
-            format = Formats.RAW
-        elif formats.get(Formats.GZ) is not None:
-            format = Formats.GZ
-        else:
-            format = None
+        format = _cheapest_decodable_format(formats)
 
         ext = helpers.file_extension_for_format(format)
-        with catalog._read_file(sha, ext=ext) as infile:
-            b = infile.read()
-            if format == Formats.GZ:
-                b = utils.gunzip_bytes(b)
-            with open(dst_path, 'w+b') as outfile:
+        with open(dst_path, 'w+b') as outfile:
+            for b in compression.decompress_chunks(format, catalog._iter_file(sha, ext=ext)):
                 outfile.write(b)
 
         log.info("Exported %s --> %s" % (sha, dst_path))
@@ -550,14 +557,12 @@ def _verify_bundle_with_manifest(catalog, manifest, check_shas=True,
 
         if check_shas:
             ext = helpers.file_extension_for_format(format)
-            with catalog._read_file(sha, ext=ext) as f:
-                b = f.read()
-                if format == Formats.GZ:
-                    b = utils.gunzip_bytes(b)
-                digest = hashlib.sha1(b).hexdigest()
-                if digest != sha:
-                    yield Message.error('File %s wrong hash' % (sha))
-                    continue
+            sha1 = hashlib.sha1()
+            for b in compression.decompress_chunks(format, catalog._iter_file(sha, ext=ext)):
+                sha1.update(b)
+            if sha1.hexdigest() != sha:
+                yield Message.error('File %s wrong hash' % (sha))
+                continue
 
         yield Message.info('File %s OK' % (sha))
 
@@ -596,47 +601,55 @@ def _verify_archive(catalog, manifest, flavor=None, check_shas=True):
     archive_name = catalog.path_helper.archive_name(manifest.bundle_name, manifest.version, flavor=flavor)
     all_files = manifest.get_all_files(flavor=flavor)
 
-    with catalog._read_archive(manifest.bundle_name, manifest.version, flavor=flavor) as fileobj:
-
-        tar = tarfile.open(fileobj=fileobj)
-
-        # Note: getmembers and getnames return objects in the same order
-        members = tar.getmembers()
-        member_names = tar.getnames()
-
-        found_error = False
+    # The archive is read as a stream, in member order, so it doesn't need to
+    # be seekable or fully downloaded first.
+    targets = dict()
+    for file in all_files:
+        sha = manifest.sha_for_file(file)
+        format, info = manifest.get_format_info_for_file(file, preferred_formats=defaults['catalog_preferred_formats'])
+        target_member_name = helpers.append_file_extension_for_format(sha, format)
+        targets[target_member_name] = (sha, format, info)
 
-        for file in all_files:
-            sha = manifest.sha_for_file(file)
-            format, info = manifest.get_format_info_for_file(file, preferred_formats=defaults['catalog_preferred_formats'])
-            target_member_name = helpers.append_file_extension_for_format(sha, format)
-            if target_member_name not in member_names:
-                found_error = True
-                yield Message.error('File \'%s\' not found in %s.'
-                                    % (target_member_name,
-                                       helpers.make_bundle_descriptor(manifest.bundle_name,
-                                                                      manifest.version,
-                                                                      flavor=flavor)))
-            else:
-                member = members[member_names.index(target_member_name)]
+    found = dict()
+    with catalog._read_archive(manifest.bundle_name, manifest.version, flavor=flavor) as fileobj:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            for member in tar:
+                if member.name not in targets or member.name in found:
+                    continue
+                digest = None
                 if check_shas:
+                    format = targets[member.name][1]
                     f = tar.extractfile(member)
-                    b = f.read()
+                    sha1 = hashlib.sha1()
+                    chunks = iter(lambda: f.read(utils.CHUNK_SIZE), b'')
+                    for b in compression.decompress_chunks(format, chunks):
+                        sha1.update(b)
                     f.close()
-                    if format == Formats.GZ:
-                        b = utils.gunzip_bytes(b)
-                    digest = hashlib.sha1(b).hexdigest()
-                    if digest != sha:
-                        found_error = True
-                        yield Message.error('File \'%s\' digest does not match: %s.' % (target_member_name, digest))
-                else:
-                    # check length only
-                    if info['size'] != member.size:
-                        found_error = True
-                        yield Message.error('File \'%s\' has size %d, expected %d.'
-                                            % (target_member_name, info['size'], member.size))
-
-        tar.close()
+                    digest = sha1.hexdigest()
+                found[member.name] = (member.size, digest)
+
+    found_error = False
+
+    for target_member_name, (sha, format, info) in targets.items():
+        if target_member_name not in found:
+            found_error = True
+            yield Message.error('File \'%s\' not found in %s.'
+                                % (target_member_name,
+                                   helpers.make_bundle_descriptor(manifest.bundle_name,
+                                                                  manifest.version,
+                                                                  flavor=flavor)))
+            continue
+        size, digest = found[target_member_name]
+        if check_shas:
+            if digest != sha:
+                found_error = True
+                yield Message.error('File \'%s\' digest does not match: %s.' % (target_member_name, digest))
+        else:
+            # check length only
+            if info['size'] != size:
+                found_error = True
+                yield Message.error('File \'%s\' has size %d, expected %d.'
+                                    % (target_member_name, info['size'], size))
 
     if not found_error:
         yield Message.info('Archive %s OK' % (archive_name))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.compression
+~~~~~~~~~~~~~~~~
+
+This module implements the codecs used for catalog objects, and estimators
+that decide, cheaply, whether a file is worth compressing before it is
+imported. Files that are clearly incompressible (images, audio, video,
+archives) are stored RAW without spending CPU on a full compression that
+would be thrown away.
+
+"""
+
+import os
+import bz2
+import lzma
+import zlib
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from .formats import Formats
+
+# Compression levels used when a catalog does not specify one. GZ matches the
+# `gzip` module, XZ matches `lzma`.
+DEFAULT_LEVELS: Dict[str, int] = {
+    Formats.GZ: 9,
+    Formats.BZ2: 9,
+    Formats.XZ: 6,
+}
+
+# Formats which can be encoded and decoded by this version of Zinc.
+CODEC_FORMATS: Sequence[str] = (Formats.GZ, Formats.BZ2, Formats.XZ)
+DECODABLE_FORMATS: Sequence[str] = (Formats.RAW,) + tuple(CODEC_FORMATS)
+
+# (offset, magic bytes) for formats which are already compressed
+DEFAULT_SKIP_MAGIC_NUMBERS: Sequence[Tuple[int, bytes]] = (
+    (0, b'\x89PNG\r\n\x1a\n'),  # PNG
+    (0, b'\xff\xd8\xff'),  # JPEG
+    (0, b'GIF8'),  # GIF
+    (0, b'OggS'),  # Ogg
+    (0, b'ID3'),  # MP3
+    (0, b'PK\x03\x04'),  # zip
+    (0, b'\x1f\x8b'),  # gzip
+    (0, b'BZh'),  # bzip2
+    (0, b'\xfd7zXZ\x00'),  # xz
+    (4, b'ftyp'),  # MP4, M4A, MOV
+)
+
+DEFAULT_SKIP_EXTENSIONS: Sequence[str] = (
+    'png', 'jpg', 'jpeg', 'gif', 'webp',
+    'mp3', 'm4a', 'aac', 'ogg', 'oga', 'opus',
+    'mp4', 'm4v', 'mov', 'ogv', 'webm',
+    'zip', 'gz', 'bz2', 'xz', '7z',
+)
+
+
+def compressobj_for_format(format: str, level: Optional[int] = None):
+    """Returns a new compressor object (with `compress` and `flush`) for
+    `format`."""
+    if level is None:
+        level = DEFAULT_LEVELS[format]
+    if format == Formats.GZ:
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif format == Formats.BZ2:
+        return bz2.BZ2Compressor(level)
+    elif format == Formats.XZ:
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=level)
+    raise ValueError("Unsupported format '%s'." % (format))
+
+
+def decompressobj_for_format(format: str):
+    """Returns a new decompressor object (with `decompress`) for `format`."""
+    if format == Formats.GZ:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif format == Formats.BZ2:
+        return bz2.BZ2Decompressor()
+    elif format == Formats.XZ:
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    raise ValueError("Unsupported format '%s'." % (format))
+
+
+def decompress_bytes(format: str, b: bytes) -> bytes:
+    """Decodes `b`, which is encoded in `format`."""
+    if format == Formats.RAW:
+        return b
+    return decompressobj_for_format(format).decompress(b)
+
+
+def decompress_chunks(format: str, chunks: Iterable[bytes]) -> Iterable[bytes]:
+    """Decodes the concatenation of `chunks`, which is encoded in `format`,
+    yielding the decoded bytes a chunk at a time."""
+    if format == Formats.RAW:
+        yield from chunks
+        return
+    decompressor = decompressobj_for_format(format)
+    for chunk in chunks:
+        b = decompressor.decompress(chunk)
+        if b:
+            yield b
+    if hasattr(decompressor, 'flush'):
+        b = decompressor.flush()
+        if b:
+            yield b
+
+
+class CompressibilityEstimator(object):
+
+    def is_compressible(self, path: str, threshold: float) -> bool:
+        """
+        Returns False if the file at `path` is clearly not going to compress
+        to `threshold` of its size or better. Returning True does not
+        guarantee that it will.
+        """
+        raise NotImplementedError()
+
+
+class SkipListEstimator(CompressibilityEstimator):
+    """Rejects files by extension or by the magic bytes at their start."""
+
+    def __init__(self, extensions: Optional[Iterable[str]] = None,
+                 magic_numbers: Optional[Iterable[Tuple[int, bytes]]] = None):
+        if extensions is None:
+            extensions = DEFAULT_SKIP_EXTENSIONS
+        if magic_numbers is None:
+            magic_numbers = DEFAULT_SKIP_MAGIC_NUMBERS
+        self._extensions = frozenset(e.lower().lstrip('.') for e in extensions)
+        self._magic_numbers = tuple(magic_numbers)
+        self._header_size = max([o + len(m) for o, m in self._magic_numbers] or [0])
+
+    def is_compressible(self, path, threshold):
+        ext = os.path.splitext(path)[1][1:].lower()
+        if ext in self._extensions:
+            return False
+        if self._header_size == 0:
+            return True
+        with open(path, 'rb') as f:
+            header = f.read(self._header_size)
+        for offset, magic in self._magic_numbers:
+            if header[offset:offset + len(magic)] == magic:
+                return False
+        return True
+
+
+class SamplingEstimator(CompressibilityEstimator):
+    """Compresses a few blocks sampled from the start, middle and end of the
+    file, and rejects it if they do not get within `margin` of the
+    threshold. Small files are always accepted, since compressing them
+    completely is as cheap as sampling."""
+
+    def __init__(self, block_size: int = 16 * 1024, blocks: int = 3, margin: float = 0.1,
+                 level: int = 9):
+        self.block_size = block_size
+        self.blocks = blocks
+        self.margin = margin
+        self.level = level
+
+    def is_compressible(self, path, threshold):
+        size = os.path.getsize(path)
+        if size <= self.block_size * self.blocks:
+            return True
+
+        sampled = 0
+        compressed = 0
+        stride = (size - self.block_size) // (self.blocks - 1) if self.blocks > 1 else 0
+        with open(path, 'rb') as f:
+            for i in range(self.blocks):
+                f.seek(i * stride)
+                block = f.read(self.block_size)
+                sampled += len(block)
+                compressed += len(zlib.compress(block, self.level))
+
+        return float(compressed) / sampled <= threshold + self.margin
+
+
+class CombinedEstimator(CompressibilityEstimator):
+    """Accepts a file only if all of `estimators` accept it. Estimators are
+    asked in order, so cheap ones should come first."""
+
+    def __init__(self, *estimators: CompressibilityEstimator):
+        self._estimators = estimators
+
+    def is_compressible(self, path, threshold):
+        for estimator in self._estimators:
+            if not estimator.is_compressible(path, threshold):
+                return False
+        return True
+
+
+def default_estimator(skip_extensions: Optional[Iterable[str]] = None) -> CompressibilityEstimator:
+    return CombinedEstimator(SkipListEstimator(extensions=skip_extensions),
+                             SamplingEstimator())
@@ -4,9 +4,9 @@ import uuid
 import logging
 from threading import Timer
 
-import boto3
 import botocore.exceptions
 
+from zinc.awspool import shared_session_pool
 from . import CatalogCoordinator, LockException
 
 log = logging.getLogger(__name__)
@@ -187,7 +187,7 @@ class Lock(object):
 class SimpleDBCatalogCoordinator(CatalogCoordinator):
 
     def __init__(self, url=None, aws_key=None, aws_secret=None,
-                 sdb_connection=None, **kwargs):
+                 sdb_connection=None, session_pool=None, **kwargs):
 
         super(SimpleDBCatalogCoordinator, self).__init__(**kwargs)
 
@@ -199,12 +199,8 @@ class SimpleDBCatalogCoordinator(CatalogCoordinator):
         if sdb_domain == '':
             sdb_domain = 'zinc'
 
-        session = boto3.session.Session(
-            aws_access_key_id=aws_key,
-            aws_secret_access_key=aws_secret,
-            region_name=sdb_region,
-        )
-        client = session.client('sdb')
+        pool = session_pool if session_pool is not None else shared_session_pool
+        client = pool.client('sdb', aws_key, aws_secret, region=sdb_region)
 
         self._ensure_domain_exists(client=client, sdb_domain=sdb_domain)
 
@@ -236,5 +232,5 @@ class SimpleDBCatalogCoordinator(CatalogCoordinator):
     @classmethod
     def valid_url(cls, url):
         urlcomps = urlparse(url)
-        s = boto3.session.Session()
+        s = shared_session_pool.session()
         return urlcomps.scheme == 'sdb' and urlcomps.netloc in s.get_available_regions('sdb')
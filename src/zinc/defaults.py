@@ -7,15 +7,61 @@ zinc.defaults
 This module provides the Zinc configuration defaults.
 
 Configurations:
-:zinc_format: The format version of the Zinc catalog. Current only '1' is supported.
+:zinc_format: The format version of the Zinc catalog. Current only '1' is
+    supported.
 :catalog_index_name: The name of the catalog index file.
-:catalog_index_max_age_seconds: The maximum length of time for which a catalog index may be cached. It is the responsibility of the storage backend to handle.  Some backends (such as the 'FileSystemStorageBackend') may ignore this setting.
-:catalog_write_legacy_index: Specify that the legacy 'index.json' should be written in addition to the current catalog index file.
+:catalog_index_max_age_seconds: The maximum length of time for which a catalog
+    index may be cached. It is the responsibility of the storage backend to
+    handle.  Some backends (such as the 'FileSystemStorageBackend') may ignore
+    this setting.
+:catalog_write_legacy_index: Specify that the legacy 'index.json' should be
+    written in addition to the current catalog index file.
 :catalog_config_name: The name of the catalog index file (currently unused).
-:catalog_preferred_formats: An ordered list of the formats to try when locating a file. Must be a (non-strict) subset of 'catalog_valid_formats'.
+:catalog_preferred_formats: An ordered list of the formats to try when locating
+    a file. Must be a (non-strict) subset of 'catalog_valid_formats'. Catalogs
+    only prefer RAW and the codecs in their config.
 :catalog_valid_formats: A list of valid formats for objects in the catalog.
-:catalog_lock_timeout: Timeout for acquiring a lock on the catalog via a coordinator.
-:catalog_prev_distro_prefix: The prefix to use when writing the previous distro.
+:catalog_lock_timeout: Timeout for acquiring a lock on the catalog via a
+    coordinator.
+:catalog_journal_compact_threshold: Number of index journal records after which
+    the journal is folded into the index file, for catalogs with a journal.
+:catalog_publish_jobs: Maximum number of files written at once when publishing
+    an index or manifest and its compressed copies.
+:catalog_optimistic_retries: Number of times an index update is retried after
+    losing a race to another writer, when the catalog uses optimistic
+    concurrency.
+:catalog_prev_distro_prefix: The prefix to use when writing the previous
+    distro.
+:catalog_manifest_cache_max_entries: Maximum number of parsed manifests kept in
+    a catalog's manifest cache.
+:catalog_manifest_cache_max_bytes: Maximum total size (of the manifest JSON)
+    kept in a catalog's manifest cache.
+:catalog_share_manifest_cache: Share one manifest cache between all catalogs in
+    the process instead of giving each catalog its own.
+:bundle_update_jobs: Number of worker threads used to import files during a
+    bundle update. 1 imports files serially.
+:bundle_update_archive_jobs: Number of flavor archives built and uploaded at
+    once during a bundle update.
+:bundle_update_archive_tmp_limit: Maximum number of bytes of temporary disk
+    used during a bundle update by compressed files kept for archives and by
+    archives being built, or `None` for no limit.
+:bundle_update_stream_archives: Stream archives straight into storage instead
+    of building them in temporary files first.
+:storage_meta_cache_ttl_seconds: How long S3 storage backends cache metadata
+    lookups (including misses) for immutable catalog objects. 0 disables the
+    cache.
+:storage_meta_jobs: Maximum number of metadata requests a storage backend makes
+    at once for a batched lookup.
+:storage_async_jobs: Number of worker threads an async storage backend uses to
+    run blocking storage calls.
+:catalog_async_concurrency: Maximum number of file operations an
+    `AsyncZincCatalog` keeps outstanding at once.
+:aws_session_pool_max_size: Maximum number of boto3 sessions (one per set of
+    credentials and region) kept in the process-wide session pool.
+:hash_cache_path: Location of the local SQLite cache of file hashes used by
+    bundle updates.
+:hash_cache_max_age_seconds: Hash cache entries which have not been used for
+    this long are evicted.
 """
 
 from .formats import Formats
@@ -28,7 +74,25 @@ defaults['catalog_index_name'] = 'catalog.json'
 defaults['catalog_index_max_age_seconds'] = 300
 defaults['catalog_write_legacy_index'] = True  # TODO: move this to config once config is implemented
 defaults['catalog_config_name'] = 'config.json'
-defaults['catalog_preferred_formats'] = [Formats.GZ, Formats.RAW]
+defaults['catalog_preferred_formats'] = [Formats.GZ, Formats.RAW,
+                                         Formats.XZ, Formats.BZ2]
 defaults['catalog_valid_formats'] = defaults['catalog_preferred_formats']
 defaults['catalog_lock_timeout'] = 60
+defaults['catalog_optimistic_retries'] = 10
+defaults['catalog_journal_compact_threshold'] = 100
+defaults['catalog_publish_jobs'] = 4
 defaults['catalog_prev_distro_prefix'] = '_'
+defaults['catalog_manifest_cache_max_entries'] = 256
+defaults['catalog_manifest_cache_max_bytes'] = 64 * 1024 * 1024
+defaults['catalog_share_manifest_cache'] = False
+defaults['bundle_update_jobs'] = 1
+defaults['bundle_update_archive_jobs'] = 1
+defaults['bundle_update_archive_tmp_limit'] = None
+defaults['bundle_update_stream_archives'] = True
+defaults['storage_meta_cache_ttl_seconds'] = 300
+defaults['storage_meta_jobs'] = 16
+defaults['storage_async_jobs'] = 32
+defaults['catalog_async_concurrency'] = 256
+defaults['aws_session_pool_max_size'] = 16
+defaults['hash_cache_path'] = '~/.zinc-cache/hashes.db'
+defaults['hash_cache_max_age_seconds'] = 30 * 24 * 60 * 60
@@ -1,4 +1,4 @@
 
 from .utils import enum
 
-Formats = enum(RAW='raw', GZ='gz')
+Formats = enum(RAW='raw', GZ='gz', BZ2='bz2', XZ='xz')
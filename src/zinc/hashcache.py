@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.hashcache
+~~~~~~~~~~~~~~
+
+This module implements a persistent, local cache of file SHA1 digests, so
+that files which have not changed since the last `bundle:update` do not need
+to be read and hashed again.
+
+Entries are keyed by the canonical path of the file, and are only considered
+valid if the inode, size and modification time (in nanoseconds) still match
+the file on disk.
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Optional
+
+import zinc.utils as utils
+from .defaults import defaults
+
+log = logging.getLogger(__name__)
+
+
+class ZincHashCache(object):
+
+    def __init__(self, path: Optional[str] = None, max_age: Optional[int] = None):
+        self._path = utils.canonical_path(path or defaults['hash_cache_path'])
+        self.max_age = max_age if max_age is not None else defaults['hash_cache_max_age_seconds']
+
+        utils.makedirs(os.path.dirname(self._path))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                           'path TEXT PRIMARY KEY, '
+                           'inode INTEGER NOT NULL, '
+                           'size INTEGER NOT NULL, '
+                           'mtime_ns INTEGER NOT NULL, '
+                           'sha TEXT NOT NULL, '
+                           'last_used REAL NOT NULL)')
+        self._conn.commit()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def get(self, path: str, st: Optional[os.stat_result] = None) -> Optional[str]:
+        """Returns the cached SHA1 for `path`, or `None` if there is no entry
+        or the file has changed since it was cached. `st` may be passed to
+        avoid a second `stat` call."""
+        path = utils.canonical_path(path)
+        st = st or os.stat(path)
+        with self._lock:
+            row = self._conn.execute('SELECT inode, size, mtime_ns, sha FROM hashes WHERE path = ?',
+                                     (path,)).fetchone()
+            if row is None or tuple(row[:3]) != (st.st_ino, st.st_size, st.st_mtime_ns):
+                return None
+            self._conn.execute('UPDATE hashes SET last_used = ? WHERE path = ?',
+                               (time.time(), path))
+            return row[3]
+
+    def set(self, path: str, sha: str, st: Optional[os.stat_result] = None) -> None:
+        """Records `sha` for `path`. `st` should be the result of a `stat`
+        taken *before* the file was hashed."""
+        path = utils.canonical_path(path)
+        st = st or os.stat(path)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+                               (path, st.st_ino, st.st_size, st.st_mtime_ns, sha, time.time()))
+
+    def sha1_for_path(self, path: str) -> str:
+        """Returns the SHA1 for `path`, hashing and caching it if needed."""
+        st = os.stat(path)
+        sha = self.get(path, st=st)
+        if sha is None:
+            sha = utils.sha1_for_path(path)
+            self.set(path, sha, st=st)
+        return sha
+
+    def evict(self, max_age: Optional[int] = None) -> int:
+        """Removes entries which have not been used in `max_age` seconds.
+        Returns the number of entries removed."""
+        max_age = max_age if max_age is not None else self.max_age
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM hashes WHERE last_used < ?',
+                                        (time.time() - max_age,))
+            self._conn.commit()
+        log.debug("Evicted %d entries from hash cache %s" % (cursor.rowcount, self._path))
+        return cursor.rowcount
+
+    def flush(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def close(self) -> None:
+        self.evict()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
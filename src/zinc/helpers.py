@@ -52,6 +52,15 @@ def file_extension_for_format(format: Formats) -> Optional[str]:
     return format
 
 
+def format_for_file_extension(ext: Optional[str]) -> Formats:
+    """Returns the format for the given file extension. The inverse of
+    `file_extension_for_format`."""
+
+    if ext is None or ext == '':
+        return Formats.RAW
+    return ext
+
+
 def append_file_extension(path: str, ext: Optional[str]) -> str:
     """Appends the given extension to the path. If `ext` is `None`,
     `path` is returned."""
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.jsoncodec
+~~~~~~~~~~~~~~
+
+The JSON codec used for catalog indexes, manifests and other models.
+
+Parsing uses the fastest JSON library installed (`orjson`, then `ujson`),
+falling back to the standard library. Serializing always uses the standard
+library: the faster libraries format their output differently (separators,
+escaping of non-ASCII characters), and the files Zinc writes must stay
+byte-for-byte identical whichever libraries are installed.
+
+"""
+
+import json
+
+try:
+    import orjson as _fast_json
+except ImportError:
+    try:
+        import ujson as _fast_json
+    except ImportError:
+        _fast_json = None
+
+
+def loads(s):
+    """Parses JSON from `str` or `bytes`."""
+    if _fast_json is not None:
+        return _fast_json.loads(s)
+    return json.loads(s)
+
+
+def dumps(obj) -> str:
+    """Serializes `obj` exactly as `json.dumps` does."""
+    return json.dumps(obj)
+
+
+def dumpb(obj) -> bytes:
+    """Serializes `obj` exactly as `json.dumps` does, encoded as UTF-8."""
+    return dumps(obj).encode('utf-8')
+
+
+def implementation() -> str:
+    """The name of the library used to parse JSON."""
+    return _fast_json.__name__ if _fast_json is not None else json.__name__
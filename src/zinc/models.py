@@ -12,15 +12,20 @@ This module implements models that represent core concepts of the Zinc system.
 """
 
 
-import json
-from collections import MutableMapping
+import copy
+import hashlib
+import threading
+from collections import MutableMapping, OrderedDict
 from functools import wraps
 from pkg_resources import resource_string
 import jsonschema
 from typing import Dict
 
+from . import jsoncodec
 from .defaults import defaults
 from .pathfilter import PathFilter
+from .compression import DEFAULT_SKIP_EXTENSIONS, DEFAULT_LEVELS
+from .formats import Formats
 
 
 def mutable_only(f):
@@ -32,11 +37,17 @@ def mutable_only(f):
     return func
 
 
+_validated_digests_lock = threading.Lock()
+
+
 class ZincModel:
     """Base class for all Zinc model objects. Provides methods for reading and
     writing (JSON) and support for immutability."""
 
     _schema = None
+    _validator = None
+    _validated_digests = None
+    _max_validated_digests = 1024
 
     def __init__(self, mutable: bool = True):
         self._mutable = mutable
@@ -46,7 +57,7 @@ class ZincModel:
         return self._mutable
 
     def to_bytes(self) -> bytes:
-        return json.dumps(self.to_dict()).encode('utf8')
+        return jsoncodec.dumpb(self.to_dict())
 
     @classmethod
     def from_dict(cls, d: Dict, mutable: bool = True):
@@ -65,17 +76,60 @@ class ZincModel:
         return cls._schema
 
     @classmethod
-    def from_bytes(cls, b: str, mutable: bool = True):
-        d = json.loads(b)
-        schema = cls.schema()
-        if schema is not None:
-            jsonschema.validate(d, schema)
+    def validator(cls):
+        """Returns the schema validator for this class, which is only built
+        once, or `None` if the class has no schema."""
+        if cls._validator is None:
+            schema = cls.schema()
+            if schema is not None:
+                jsonschema.Draft4Validator.check_schema(schema)
+                cls._validator = jsonschema.Draft4Validator(schema)
+        return cls._validator
+
+    @classmethod
+    def _digest(cls, b):
+        if isinstance(b, str):
+            b = b.encode('utf-8')
+        return hashlib.sha1(b).digest()
+
+    @classmethod
+    def mark_validated(cls, b):
+        """Records that `b` is known to be valid (e.g. because it was just
+        written from a model) so loading it again skips validation."""
+        digest = cls._digest(b)
+        with _validated_digests_lock:
+            if cls._validated_digests is None:
+                cls._validated_digests = OrderedDict()
+            digests = cls._validated_digests
+            digests[digest] = True
+            digests.move_to_end(digest)
+            while len(digests) > cls._max_validated_digests:
+                digests.popitem(last=False)
+
+    @classmethod
+    def _is_validated(cls, b):
+        digests = cls._validated_digests
+        if digests is None:
+            return False
+        digest = cls._digest(b)
+        with _validated_digests_lock:
+            return digest in digests
+
+    @classmethod
+    def from_bytes(cls, b: str, mutable: bool = True, trusted: bool = False):
+        """Parses `b`, validating it against the class's schema unless
+        `trusted` is set or the same content has already been validated."""
+        d = jsoncodec.loads(b)
+        validator = cls.validator()
+        if validator is not None and not trusted and not cls._is_validated(b):
+            validator.validate(d)
+            cls.mark_validated(b)
         return cls.from_dict(d, mutable=mutable)
 
     @classmethod
-    def from_path(cls, p: str, mutable: bool = True):
+    def from_path(cls, p: str, mutable: bool = True, trusted: bool = False):
         with open(p, 'r') as f:
-            return cls.from_bytes(f.read(), mutable=mutable)
+            return cls.from_bytes(f.read(), mutable=mutable, trusted=trusted)
 
     def write(self, path: str) -> None:
         with open(path, 'wb') as f:
@@ -92,22 +146,225 @@ class ZincModel:
 
 # ZincIndex
 
+class ZincShardedBundleInfo(MutableMapping):
+    """Bundle info for a sharded catalog index, keyed by bundle name.
+
+    Only the bundle names and the generation of each bundle's shard are known
+    up front; a bundle's info is loaded with `loader(bundle_name, generation)`
+    the first time it is accessed. Bundles added since the shards were read
+    have generation 0.
+    """
+
+    def __init__(self, generations, loader):
+        self.generations = dict(generations)
+        self._loader = loader
+        self._loaded = dict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, bundle_name):
+        info = self._loaded.get(bundle_name)
+        if info is None:
+            generation = self.generations[bundle_name]
+            info = self._loader(bundle_name, generation)
+            with self._lock:
+                info = self._loaded.setdefault(bundle_name, info)
+        return info
+
+    def __setitem__(self, bundle_name, info):
+        self._loaded[bundle_name] = info
+        self.generations.setdefault(bundle_name, 0)
+
+    def __delitem__(self, bundle_name):
+        del self.generations[bundle_name]
+        self._loaded.pop(bundle_name, None)
+
+    def __len__(self):
+        return len(self.generations)
+
+    def __iter__(self):
+        return iter(self.generations)
+
+    def __contains__(self, bundle_name):
+        return bundle_name in self.generations
+
+    def copy(self):
+        cpy = self.__class__(self.generations, self._loader)
+        cpy._loaded = dict(self._loaded)
+        return cpy
+
+
 class ZincIndex(ZincModel):
+    """The catalog index.
+
+    Immutable snapshots (see `snapshot()`) share their bundle info with the
+    index they were taken from. A mutable index copies shared state before
+    modifying it (copy-on-write), so snapshots never see later changes.
+    """
 
     def __init__(self, id=None, **kwargs):
         super().__init__(**kwargs)
         self._format = defaults['zinc_format']
         self._id = id
         self._bundle_info_by_name = dict()
+        self._shared = False  # True if _bundle_info_by_name is shared
+        self._shared_bundles = set()  # bundle infos shared with snapshots
+        self._snapshot = None
+        self._dirty_bundles = set()
+        self._mutations = list()  # records of the changes since the last save
+        self._replaying = False
+        self.journal_seq = None
+
+    def _share(self, mutable):
+        index = self.__class__(id=self._id, mutable=mutable)
+        index._format = self._format
+        index._bundle_info_by_name = self._bundle_info_by_name
+        index.journal_seq = self.journal_seq
+        index._shared = True
+        self._shared = True
+        return index
+
+    def snapshot(self):
+        """Returns an immutable snapshot of the index in O(1). Snapshots are
+        structurally shared with the index and are safe to hand to other
+        threads, as they are never modified."""
+        if not self.is_mutable:
+            return self
+        if self._snapshot is None:
+            self._snapshot = self._share(mutable=False)
+        return self._snapshot
+
+    def clone(self, mutable=True):
+        if not mutable:
+            return self.snapshot()
+        return self._share(mutable=True)
+
+    def _will_mutate(self, bundle_name=None):
+        """Must be called before modifying `_bundle_info_by_name` or the info
+        for `bundle_name`. Copies whatever is shared with snapshots."""
+        self._snapshot = None
+        if self._shared:
+            self._bundle_info_by_name = self._bundle_info_by_name.copy()
+            self._shared_bundles = set(self._bundle_info_by_name.keys())
+            self._shared = False
+        if bundle_name in self._shared_bundles:
+            self._shared_bundles.discard(bundle_name)
+            info = self._bundle_info_by_name.get(bundle_name)
+            if info is not None:
+                self._bundle_info_by_name[bundle_name] = copy.deepcopy(info)
+
+    def _record(self, op, bundle_name, **fields):
+        # Only recorded changes mark a bundle dirty. Reads which fill in
+        # missing fields (e.g. `next_version` for older indexes) don't.
+        if not self._replaying:
+            self._dirty_bundles.add(bundle_name)
+            record = {'op': op, 'bundle': bundle_name}
+            record.update(fields)
+            self._mutations.append(record)
+
+    def mutations(self):
+        """Records of the changes made since the index was read or last
+        marked clean, in order. See `apply_mutation`."""
+        return list(self._mutations)
+
+    @mutable_only
+    def apply_mutation(self, record):
+        """Applies a change recorded by another index (see `mutations`), e.g.
+        when replaying a journal."""
+        op = record['op']
+        bundle_name = record['bundle']
+        self._replaying = True
+        try:
+            if op == 'add_version':
+                self.add_version_for_bundle(bundle_name, record['version'])
+            elif op == 'set_next_version':
+                self._get_or_create_bundle_info(bundle_name)['next_version'] = record['next_version']
+            elif op == 'delete_version':
+                self.delete_bundle_version(bundle_name, record['version'])
+            elif op == 'set_version_info':
+                bundle_info = self._get_or_create_bundle_info(bundle_name)
+                bundle_info.setdefault('version_info', {})[str(record['version'])] = \
+                    copy.deepcopy(record['info'])
+            elif op == 'update_distribution':
+                self.update_distribution(record['distribution'], bundle_name, record['version'])
+            elif op == 'delete_distribution':
+                self.delete_distribution(record['distribution'], bundle_name)
+            else:
+                raise ValueError("Unknown index mutation '%s'" % (op))
+        finally:
+            self._replaying = False
+
+    def dirty_bundle_names(self):
+        """Names of the bundles changed since the index was read or last
+        marked clean."""
+        return set(self._dirty_bundles)
+
+    def is_dirty(self):
+        """Whether the index has changed since it was read or last marked
+        clean."""
+        return len(self._mutations) > 0 or len(self._dirty_bundles) > 0
+
+    def mark_clean(self):
+        self._dirty_bundles = set()
+        self._mutations = list()
+
+    @classmethod
+    def from_shards(cls, d: Dict, loader, mutable: bool = True):
+        """Creates an index from the root of a sharded index, which lists the
+        generation of each bundle's shard. Shards are loaded with `loader`
+        as bundles are accessed."""
+        index = cls(id=d['id'], mutable=mutable)
+        index._format = d['format']
+        index._bundle_info_by_name = ZincShardedBundleInfo(d['bundles'], loader)
+        return index
+
+    def to_shards(self, loader):
+        """Returns a mutable copy of the index whose bundles will all be
+        written as shards when saved."""
+        index = self.__class__(id=self._id)
+        index._format = self._format
+        bundles = ZincShardedBundleInfo(dict(), loader)
+        for bundle_name, info in self._bundle_info_by_name.items():
+            bundles[bundle_name] = copy.deepcopy(info)
+        index._bundle_info_by_name = bundles
+        index._dirty_bundles = set(bundles.keys())
+        return index
+
+    @property
+    def shard_generations(self):
+        """The generation of each bundle's shard, for a sharded index."""
+        return dict(self._bundle_info_by_name.generations)
+
+    @mutable_only
+    def set_shard_generations(self, generations):
+        self._will_mutate()
+        self._bundle_info_by_name.generations.update(generations)
+
+    def shard_for_bundle(self, bundle_name):
+        """The contents of a bundle's shard in a sharded index."""
+        return self._bundle_info_by_name[bundle_name]
+
+    def shard_dict(self):
+        """The root of a sharded index."""
+        return {
+            'id': self.id,
+            'bundles': self.shard_generations,
+            'format': self._format,
+        }
 
     def to_dict(self) -> Dict:
         if self.id is None:
             raise ValueError("catalog id is None")  # TODO: better exception?
-        return {
+        bundles = self._bundle_info_by_name
+        if not isinstance(bundles, dict):
+            bundles = dict(bundles.items())
+        d = {
             'id': self.id,
-            'bundles': self._bundle_info_by_name,
+            'bundles': bundles,
             'format': self._format,
         }
+        if self.journal_seq is not None:
+            d['journal_seq'] = self.journal_seq
+        return d
 
     @property
     def id(self) -> str:
@@ -123,22 +380,26 @@ class ZincIndex(ZincModel):
         index = cls(id=d['id'], mutable=mutable)
         index._format = d['format']
         index._bundle_info_by_name = d['bundles']
+        index.journal_seq = d.get('journal_seq')
         return index
 
     @classmethod
     def _load_schema(cls):
         schema_string = resource_string('zinc.resources.schemas.v1', 'catalog.json').decode('utf-8')
-        return json.loads(schema_string)
+        return jsoncodec.loads(schema_string)
 
     def _get_bundle_info(self, bundle_name):
         info = self._bundle_info_by_name.get(bundle_name)
         if info is not None and self.is_mutable:
             if info.get('next-version'):  # clean mispelled 'next_version' key
+                self._will_mutate(bundle_name)
+                info = self._bundle_info_by_name[bundle_name]
                 del info['next-version']
         return info
 
     @mutable_only
     def _get_or_create_bundle_info(self, bundle_name):
+        self._will_mutate(bundle_name)
         info = self._get_bundle_info(bundle_name)
         if info is None:
             info = self._bundle_info_by_name[bundle_name] = {
@@ -156,11 +417,13 @@ class ZincIndex(ZincModel):
             bundle_info['versions'] = sorted(bundle_info['versions'])
         else:
             raise ValueError('Bundle version %d already exists.' % (version))
+        self._record('add_version', bundle_name, version=version)
 
     @mutable_only
     def increment_next_version_for_bundle(self, bundle_name):
         bundle_info = self._get_or_create_bundle_info(bundle_name)
         bundle_info['next_version'] = self.next_version_for_bundle(bundle_name) + 1
+        self._record('set_next_version', bundle_name, next_version=bundle_info['next_version'])
 
     def versions_for_bundle(self, bundle_name):
         info = self._get_bundle_info(bundle_name)
@@ -176,12 +439,14 @@ class ZincIndex(ZincModel):
             else:
                 next_version = versions[-1] + 1
             if bundle_info and self.is_mutable:
-                bundle_info['next_version'] = next_version
+                self._will_mutate(bundle_name)
+                self._bundle_info_by_name[bundle_name]['next_version'] = next_version
         return next_version
 
     @mutable_only
     def delete_bundle_version(self, bundle_name, bundle_version):
         assert bundle_version == int(bundle_version)
+        self._will_mutate(bundle_name)
         bundle_info = self._bundle_info_by_name.get(bundle_name)
         if bundle_info is None:
             raise Exception("Unknown bundle %s" % (bundle_name))
@@ -192,10 +457,35 @@ class ZincIndex(ZincModel):
         versions = bundle_info['versions']
         if bundle_version in versions:
             versions.remove(bundle_version)
+        bundle_info.get('version_info', {}).pop(str(bundle_version), None)
         if len(versions) == 0:  # remove info if no more versions
             del self._bundle_info_by_name[bundle_name]
         else:
             bundle_info['versions'] = versions
+        self._record('delete_version', bundle_name, version=bundle_version)
+
+    @mutable_only
+    def set_version_info_for_bundle(self, bundle_name, version, flavors,
+                                    file_count=None, size=None):
+        """Records the flavors (and optionally the number of files and their
+        total size) of a bundle version, so they can be listed without
+        loading its manifest."""
+        bundle_info = self._get_or_create_bundle_info(bundle_name)
+        info = {'flavors': sorted(flavors)}
+        if file_count is not None:
+            info['file_count'] = file_count
+        if size is not None:
+            info['size'] = size
+        bundle_info.setdefault('version_info', {})[str(version)] = info
+        self._record('set_version_info', bundle_name, version=version, info=copy.deepcopy(info))
+
+    def version_info_for_bundle(self, bundle_name, version):
+        """Returns the info recorded by `set_version_info_for_bundle`, or
+        `None` for versions added before it was recorded."""
+        info = self._bundle_info_by_name.get(bundle_name)
+        if info is None or 'version_info' not in info:
+            return None
+        return info['version_info'].get(str(version))
 
     def distributions_for_bundle(self, bundle_name):
         bundle_info = self._bundle_info_by_name.get(bundle_name)
@@ -225,13 +515,17 @@ class ZincIndex(ZincModel):
             raise ValueError("Invalid bundle version")
         bundle_info = self._get_or_create_bundle_info(bundle_name)
         bundle_info['distributions'][distribution_name] = bundle_version
+        self._record('update_distribution', bundle_name,
+                     distribution=distribution_name, version=bundle_version)
 
     @mutable_only
     def delete_distribution(self, distribution_name, bundle_name):
+        self._will_mutate(bundle_name)
         bundle_info = self._bundle_info_by_name.get(bundle_name)
         if bundle_name is None:
             raise ValueError("Unknown bundle %s" % (bundle_name))
         del bundle_info['distributions'][distribution_name]
+        self._record('delete_distribution', bundle_name, distribution=distribution_name)
 
 
 # ZincFileList
@@ -363,7 +657,7 @@ class ZincManifest(ZincModel):
     @classmethod
     def _load_schema(cls):
         schema_string = resource_string('zinc.resources.schemas.v1', 'manifest.json').decode('utf-8')
-        return json.loads(schema_string)
+        return jsoncodec.loads(schema_string)
 
     @classmethod
     def from_dict(cls, d, mutable=True):
@@ -374,7 +668,7 @@ class ZincManifest(ZincModel):
         manifest = ZincManifest(catalog_id, bundle_name,
                                 version, mutable=mutable)
         manifest._format = d.get('format') or defaults['zinc_format']
-        manifest._files = ZincFileList.from_dict(d['files'])
+        manifest._files = ZincFileList.from_dict(d['files'], mutable=mutable)
         manifest._flavors = d.get('flavors') or []  # to support legacy
         return manifest
 
@@ -498,18 +792,66 @@ class ZincFlavorSpec(ZincModel):
 # ZincCatalogConfig
 
 class ZincCatalogConfig(ZincModel):
+    """The settings of a catalog, stored in its config file.
+
+    With `index_journal` on, each index update is appended to a record under
+    `journal/` instead of rewriting the index file. The records are folded
+    into the index file every `catalog_journal_compact_threshold` records, or
+    by `catalog:compact`. Until then `catalog.json`, the legacy `index.json`
+    and their `.gz` copies do not include the latest updates, so clients that
+    read those files directly don't see new bundle versions or distributions.
+
+    With `index_layout` set to 'sharded', the index is kept in
+    `index/root.json` and one file per bundle under `index/bundles/`.
+    `catalog.json`, `index.json` and their `.gz` copies are no longer
+    updated, and only show the changes up to the last `catalog:compact`.
+    """
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.gzip_threshhold = 0.85
+        self.gzip_skip_extensions = list(DEFAULT_SKIP_EXTENSIONS)
+        self.codecs = [Formats.GZ]
+        self.compression_levels = dict()
+        self.index_concurrency = 'lock'  # or 'optimistic'
+        self.index_layout = 'single'  # or 'sharded'
+        self.index_journal = False
+        self.binary_manifests = False
+
+    def level_for_format(self, format):
+        return self.compression_levels.get(format, DEFAULT_LEVELS.get(format))
 
     @classmethod
     def from_dict(cls, d: Dict, mutable: bool = True):
-        config = ZincCatalogConfig()
-        if d.get('gzip_threshhold'):
-            config.gzip_threshhold = d.get('gzip_threshhold')
+        config = ZincCatalogConfig(mutable=mutable)
+        # `to_dict` has always written the correctly spelled key
+        threshold = d.get('gzip_threshold') or d.get('gzip_threshhold')
+        if threshold:
+            config.gzip_threshhold = threshold
+        if d.get('gzip_skip_extensions') is not None:
+            config.gzip_skip_extensions = d.get('gzip_skip_extensions')
+        if d.get('codecs') is not None:
+            config.codecs = d.get('codecs')
+        if d.get('compression_levels') is not None:
+            config.compression_levels = d.get('compression_levels')
+        if d.get('index_concurrency') is not None:
+            config.index_concurrency = d.get('index_concurrency')
+        if d.get('index_layout') is not None:
+            config.index_layout = d.get('index_layout')
+        if d.get('index_journal') is not None:
+            config.index_journal = d.get('index_journal')
+        if d.get('binary_manifests') is not None:
+            config.binary_manifests = d.get('binary_manifests')
+        return config
 
     def to_dict(self):
         return {
-            'gzip_threshold': self.gzip_threshhold
+            'gzip_threshold': self.gzip_threshhold,
+            'gzip_skip_extensions': self.gzip_skip_extensions,
+            'codecs': self.codecs,
+            'compression_levels': self.compression_levels,
+            'index_concurrency': self.index_concurrency,
+            'index_layout': self.index_layout,
+            'index_journal': self.index_journal,
+            'binary_manifests': self.binary_manifests,
         }
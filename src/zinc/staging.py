@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.staging
+~~~~~~~~~~~~
+
+This module implements a scratch area for encoded blobs, keyed by SHA and
+format, so that a file is compressed at most once during a bundle update even
+though it is needed both for import and for every archive that contains it.
+
+Blobs are kept until the stage is cleaned up at the end of the update, so
+without a limit the stage grows to about the compressed size of the bundle
+(files stored RAW are read from the source directory instead). With a
+budget, each kept blob is charged against it, and once it is full further
+blobs are encoded again each time they are needed instead of being kept.
+
+"""
+
+import os
+import errno
+import shutil
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import zinc.utils as utils
+import zinc.helpers as helpers
+from .compression import compressobj_for_format
+from .formats import Formats
+
+log = logging.getLogger(__name__)
+
+
+class ZincBlobStage(object):
+
+    def __init__(self, dir: Optional[str] = None, levels: Optional[Dict[str, int]] = None,
+                 budget=None):
+        self._dir = tempfile.mkdtemp(prefix='zinc-stage-', dir=dir)
+        self._levels = levels or dict()
+        self._budget = budget
+        self._lock = threading.Lock()
+        self._key_locks = dict()
+
+    @property
+    def dir(self) -> str:
+        return self._dir
+
+    def _path_for_blob(self, sha: str, format: Formats) -> str:
+        return os.path.join(self._dir, helpers.append_file_extension_for_format(sha, format))
+
+    def _lock_for_key(self, sha: str, format: Formats) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault((sha, format), threading.Lock())
+
+    def temporary_file(self):
+        """Returns a named temporary file inside the stage, which can later
+        be added with `add_path` without copying."""
+        return tempfile.NamedTemporaryFile(dir=self._dir, prefix='.tmp-')
+
+    def get(self, sha: str, format: Formats) -> Optional[str]:
+        """Returns the path of the staged blob, or `None`."""
+        path = self._path_for_blob(sha, format)
+        return path if os.path.exists(path) else None
+
+    def _charge(self, path: str) -> bool:
+        """Returns whether there is room in the budget to keep `path`."""
+        return self._budget is None or self._budget.charge(os.path.getsize(path))
+
+    def add_path(self, sha: str, format: Formats, path: str) -> Optional[str]:
+        """Stages the already encoded file at `path`. Files inside the stage
+        are hard linked, anything else is copied. Returns `None` if the
+        budget has no room for it."""
+        blob_path = self._path_for_blob(sha, format)
+        with self._lock_for_key(sha, format):
+            if os.path.exists(blob_path):
+                return blob_path
+            if not self._charge(path):
+                log.debug("Stage is full, not keeping %s" % (blob_path))
+                return None
+            try:
+                os.link(path, blob_path)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    pass
+                else:
+                    shutil.copyfile(path, blob_path)
+        return blob_path
+
+    @contextmanager
+    def blob(self, sha: str, format: Formats, src_path: str):
+        """Yields the path of the blob for `sha` in `format`, encoding
+        `src_path` into the stage if it is not there yet. If the budget has
+        no room to keep it, the blob is encoded into a temporary file which
+        is removed on exit."""
+        if format == Formats.RAW:
+            yield src_path
+            return
+
+        blob_path = self._path_for_blob(sha, format)
+        tmp_file = None
+        with self._lock_for_key(sha, format):
+            if not os.path.exists(blob_path):
+                compressor = compressobj_for_format(format, self._levels.get(format))
+                tmp_file = self.temporary_file()
+                try:
+                    utils.sha1_and_compress_path(src_path, [(compressor, tmp_file)])
+                    tmp_file.flush()
+                    if self._charge(tmp_file.name):
+                        os.link(tmp_file.name, blob_path)
+                        tmp_file.close()
+                        tmp_file = None
+                        log.debug("Staged %s --> %s" % (src_path, blob_path))
+                except BaseException:
+                    tmp_file.close()
+                    raise
+
+        if tmp_file is None:
+            yield blob_path
+        else:
+            with tmp_file:
+                yield tmp_file.name
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
@@ -1,5 +1,21 @@
+import os
 from io import BytesIO
 
+import zinc.utils as utils
+
+
+class PreconditionFailed(Exception):
+    """Raised by `StorageBackend.put_if_match` when the stored object no
+    longer matches the expected token."""
+    pass
+
+
+class ObjectNotFound(FileNotFoundError):
+    """Raised by a `StorageBackend` read when there is nothing at subpath.
+    The filesystem backend raises the builtin `FileNotFoundError`, so catch
+    that to handle a miss from any backend."""
+    pass
+
 
 class StorageBackend(object):
 
@@ -31,9 +47,45 @@ class StorageBackend(object):
     # Methods to override
 
     def get(self, subpath):
-        """Return file-like object at subpath."""
+        """Return file-like object at subpath. Raises `FileNotFoundError` if
+        subpath does not exist."""
         raise NotImplementedError()
 
+    def get_range(self, subpath, start, length=None):
+        """
+        Return `length` bytes of the file at subpath starting at offset
+        `start`, or everything from `start` if `length` is None. Backends
+        should override this if they can read a range without fetching the
+        whole file.
+        """
+        with self.get(subpath) as f:
+            if f.seekable():
+                f.seek(start)
+            else:
+                for _ in self._iter_fileobj(f, total=start):
+                    pass
+            return f.read() if length is None else f.read(length)
+
+    def iter_chunks(self, subpath, chunk_size=utils.CHUNK_SIZE):
+        """
+        Yield the contents of subpath in chunks of at most `chunk_size` bytes,
+        without holding the whole file in memory.
+        """
+        with self.get(subpath) as f:
+            yield from self._iter_fileobj(f, chunk_size=chunk_size)
+
+    @staticmethod
+    def _iter_fileobj(f, chunk_size=utils.CHUNK_SIZE, total=None):
+        remaining = total
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
     def get_meta(self, subpath):
         """
         Return dictionary of metadata for item at subpath or None if subpath
@@ -44,6 +96,14 @@ class StorageBackend(object):
         """
         raise NotImplementedError()
 
+    def get_metas(self, subpaths):
+        """
+        Return a dictionary of the metadata for each of `subpaths`, as
+        returned by `get_meta`, keyed by subpath. Backends should override
+        this if they can look up several paths at once.
+        """
+        return {subpath: self.get_meta(subpath) for subpath in subpaths}
+
     def put(self, subpath, fileobj, **kwargs):
         """Write data from file-like object 'fileobj' to subpath."""
         raise NotImplementedError()
@@ -52,10 +112,39 @@ class StorageBackend(object):
         """List contents, with optional prefix."""
         raise NotImplementedError()
 
+    def list_meta(self, prefix=None):
+        """
+        Return dictionary of metadata for all contents, with optional prefix,
+        keyed by path relative to `prefix`. Backends should override this if
+        they can return metadata along with a listing.
+        """
+        metas = dict()
+        for path in self.list(prefix=prefix):
+            subpath = os.path.join(prefix, path) if prefix is not None else path
+            metas[path] = self.get_meta(subpath)
+        return metas
+
     def delete(self, subpath):
         """Delete subpath."""
         raise NotImplementedError()
 
+    # Conditional writes, used for optimistic concurrency
+
+    def get_with_token(self, subpath):
+        """
+        Return a tuple of the contents of subpath as bytes and an opaque token
+        identifying that revision of it, for use with `put_if_match`.
+        """
+        raise NotImplementedError()
+
+    def put_if_match(self, subpath, bytes, token, **kwargs):
+        """
+        Write string 'bytes' to subpath only if it still matches `token`, or
+        doesn't exist if `token` is None. Returns the token of the new
+        revision. Raises `PreconditionFailed` if subpath has changed.
+        """
+        raise NotImplementedError()
+
 
 def storage_for_url(url):
     from .filesystem import FilesystemStorageBackend
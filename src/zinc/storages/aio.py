@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.storages.aio
+~~~~~~~~~~~~~~~~~
+
+This module provides an asyncio variant of the `StorageBackend` interface,
+so that storage can be used from coroutines without blocking the event
+loop.
+
+None of the backends is natively asynchronous. Each one runs the blocking
+backend's calls on a bounded pool of worker threads, so at most
+`storage_async_jobs` operations are in progress at a time and the rest wait
+for a thread; the event loop only ever waits on them. Python has no
+portable non-blocking I/O for regular files, so the filesystem backend is
+adapted the same way, one short read or write at a time.
+
+"""
+
+import asyncio
+import functools
+from copy import copy
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import zinc.utils as utils
+from zinc.defaults import defaults
+
+
+class AsyncStorageBackend(object):
+
+    @property
+    def url(self):
+        raise NotImplementedError()
+
+    def bind_to_catalog(self, id=None):
+        raise NotImplementedError()
+
+    async def puts(self, subpath: str, bytes: bytes, **kwargs):
+        """Write string 'bytes' to subpath."""
+        await self.put(subpath, BytesIO(bytes), **kwargs)
+
+    async def get_metas(self, subpaths):
+        """
+        Return a dictionary of the metadata for each of `subpaths`, keyed by
+        subpath. The lookups run concurrently.
+        """
+        subpaths = list(subpaths)
+        metas = await asyncio.gather(*[self.get_meta(subpath) for subpath in subpaths])
+        return dict(zip(subpaths, metas))
+
+    # Methods to override
+
+    async def get(self, subpath):
+        """Return the contents of subpath as bytes."""
+        raise NotImplementedError()
+
+    async def get_range(self, subpath, start, length=None):
+        """Return `length` bytes of subpath starting at `start`, or everything
+        from `start` if `length` is None."""
+        raise NotImplementedError()
+
+    async def iter_chunks(self, subpath, chunk_size=utils.CHUNK_SIZE):
+        """Asynchronously yield the contents of subpath in chunks of at most
+        `chunk_size` bytes."""
+        raise NotImplementedError()
+        yield
+
+    async def get_meta(self, subpath):
+        """Return dictionary of metadata for item at subpath or None if
+        subpath does not exist."""
+        raise NotImplementedError()
+
+    async def put(self, subpath, fileobj, **kwargs):
+        """Write data from file-like object 'fileobj' to subpath."""
+        raise NotImplementedError()
+
+    async def list(self, prefix=None):
+        """List contents, with optional prefix."""
+        raise NotImplementedError()
+
+    async def delete(self, subpath):
+        """Delete subpath."""
+        raise NotImplementedError()
+
+
+class ThreadedAsyncStorageBackend(AsyncStorageBackend):
+    """Adapts a blocking `StorageBackend` by running its methods on a pool of
+    at most `jobs` worker threads. Backends bound from it share the pool."""
+
+    def __init__(self, storage, executor=None, jobs=None):
+        self._storage = storage
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=jobs or defaults['storage_async_jobs'])
+        self._executor = executor
+
+    @property
+    def storage(self):
+        return self._storage
+
+    @property
+    def url(self):
+        return self._storage.url
+
+    def bind_to_catalog(self, id=None):
+        cpy = copy(self)
+        cpy._storage = self._storage.bind_to_catalog(id=id)
+        return cpy
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    def _read(storage, subpath):
+        with storage.get(subpath) as f:
+            return f.read()
+
+    async def get(self, subpath):
+        return await self._run(self._read, self._storage, subpath)
+
+    async def get_range(self, subpath, start, length=None):
+        return await self._run(self._storage.get_range, subpath, start, length=length)
+
+    async def iter_chunks(self, subpath, chunk_size=utils.CHUNK_SIZE):
+        chunks = self._storage.iter_chunks(subpath, chunk_size=chunk_size)
+        try:
+            while True:
+                chunk = await self._run(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await self._run(chunks.close)
+
+    async def get_meta(self, subpath):
+        return await self._run(self._storage.get_meta, subpath)
+
+    async def get_metas(self, subpaths):
+        return await self._run(self._storage.get_metas, subpaths)
+
+    async def put(self, subpath, fileobj, **kwargs):
+        return await self._run(self._storage.put, subpath, fileobj, **kwargs)
+
+    async def list(self, prefix=None):
+        return await self._run(self._storage.list, prefix=prefix)
+
+    async def delete(self, subpath):
+        return await self._run(self._storage.delete, subpath)
+
+
+class AsyncFilesystemStorageBackend(ThreadedAsyncStorageBackend):
+    """A `FilesystemStorageBackend` whose calls run on worker threads."""
+
+    def __init__(self, url=None, executor=None, jobs=None, **kwargs):
+        from .filesystem import FilesystemStorageBackend
+        super(AsyncFilesystemStorageBackend, self).__init__(
+            FilesystemStorageBackend(url=url, **kwargs), executor=executor, jobs=jobs)
+
+    @classmethod
+    def valid_url(cls, url):
+        from .filesystem import FilesystemStorageBackend
+        return FilesystemStorageBackend.valid_url(url)
+
+
+class AsyncS3StorageBackend(ThreadedAsyncStorageBackend):
+    """An `S3StorageBackend` whose calls run on worker threads."""
+
+    def __init__(self, url=None, executor=None, jobs=None, **kwargs):
+        from .aws import S3StorageBackend
+        super(AsyncS3StorageBackend, self).__init__(
+            S3StorageBackend(url=url, **kwargs), executor=executor, jobs=jobs)
+
+    @classmethod
+    def valid_url(cls, url):
+        from .aws import S3StorageBackend
+        return S3StorageBackend.valid_url(url)
+
+
+def async_storage_for_storage(storage, executor=None):
+    """Returns an `AsyncStorageBackend` for the blocking backend `storage`."""
+    return ThreadedAsyncStorageBackend(storage, executor=executor)
+
+
+def async_storage_for_url(url):
+    storage_classes = (AsyncFilesystemStorageBackend, AsyncS3StorageBackend)
+
+    for storage_class in storage_classes:
+        if storage_class.valid_url(url):
+            return storage_class
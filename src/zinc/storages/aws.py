@@ -1,20 +1,141 @@
 import os
-from tempfile import TemporaryFile
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from urllib.parse import urlparse
 import logging
 
-import boto3
+from boto3.s3.transfer import TransferConfig
 
-from . import StorageBackend
+import zinc.utils as utils
+from zinc.awspool import shared_session_pool
+from zinc.defaults import defaults
+from . import StorageBackend, PreconditionFailed, ObjectNotFound
 
 log = logging.getLogger(__name__)
 
+# Conditional request headers for the current thread's PutObject call. The
+# installed botocore doesn't model `IfMatch`/`IfNoneMatch` on PutObject, so
+# they're added to the request just before it is signed.
+_conditional_headers = threading.local()
+
+
+def _add_conditional_headers(request, **kwargs):
+    headers = getattr(_conditional_headers, 'headers', None)
+    if headers:
+        for name, value in headers.items():
+            request.headers[name] = value
+
+
+class _MetaCache(object):
+    """A thread-safe cache of `get_meta` results, including misses, which
+    expire after `ttl` seconds."""
+
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns a tuple of whether `key` was found, and its metadata."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, meta = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            return True, meta
+
+    def put(self, key, meta):
+        if self._ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, meta)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class S3TransferStats(object):
+    """Running totals for the managed transfers made by an
+    `S3StorageBackend`, shared by the backends bound from it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transfers = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def record(self, nbytes, seconds):
+        with self._lock:
+            self.transfers += 1
+            self.bytes += nbytes
+            self.seconds += seconds
+
+    @property
+    def throughput(self):
+        """Average bytes per second over all transfers."""
+        with self._lock:
+            return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'transfers': self.transfers,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+            }
+
+
+class _TransferProgress(object):
+    """A boto3 transfer callback that measures the throughput of a single
+    transfer. The callback may be called from several threads at once."""
+
+    def __init__(self, keyname, stats, log_threshold):
+        self._keyname = keyname
+        self._stats = stats
+        self._log_threshold = log_threshold
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self.bytes = 0
+
+    def __call__(self, nbytes):
+        with self._lock:
+            self.bytes += nbytes
+
+    def finish(self):
+        seconds = time.monotonic() - self._start
+        self._stats.record(self.bytes, seconds)
+        rate = self.bytes / seconds if seconds > 0 else 0.0
+        # only multipart transfers are interesting enough to log by default
+        level = logging.INFO if self.bytes >= self._log_threshold else logging.DEBUG
+        log.log(level, "Uploaded %s: %d bytes in %.2fs (%.2f MB/s)" % (
+            self._keyname, self.bytes, seconds, rate / (1024 * 1024)))
+
 
 class S3StorageBackend(StorageBackend):
+    """
+    Stores a catalog in an S3 bucket. Besides the credentials and bucket,
+    a storage section of the client config may tune uploads with:
+
+    :multipart_threshold: Size in bytes above which files are uploaded in parts.
+    :multipart_chunksize: Size in bytes of each part of a multipart upload.
+    :max_concurrency: Number of threads uploading parts of a file at once.
+    """
+
+    # Catalog objects are content-addressed and never rewritten, so lookups
+    # for them can be cached.
+    CACHEABLE_PREFIXES = ('objects/',)
 
     def __init__(self, url=None, aws_key=None, aws_secret=None,
-                 s3connection=None, bucket=None, prefix=None, **kwargs):
+                 s3connection=None, bucket=None, prefix=None,
+                 meta_cache_ttl=None, meta_jobs=None,
+                 multipart_threshold=None, multipart_chunksize=None,
+                 max_concurrency=None, session_pool=None, **kwargs):
 
         super(S3StorageBackend, self).__init__(**kwargs)
 
@@ -22,27 +143,37 @@ class S3StorageBackend(StorageBackend):
 
         assert bucket or url
         bucket_name = bucket or urlparse(url).netloc
-        session = boto3.session.Session(aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-        connection = session.resource('s3')
-        self._bucket = self._get_bucket(bucket_name, connection)
+        pool = session_pool if session_pool is not None else shared_session_pool
+        connection = pool.resource('s3', aws_key, aws_secret)
+        if pool.bucket_exists(bucket_name, aws_key, aws_secret):
+            self._bucket = connection.Bucket(bucket_name)
+        else:
+            self._bucket = None
         self._prefix = prefix
+        if meta_cache_ttl is None:
+            meta_cache_ttl = defaults['storage_meta_cache_ttl_seconds']
+        self._meta_cache = _MetaCache(meta_cache_ttl)
+        self._meta_jobs = meta_jobs or defaults['storage_meta_jobs']
+        self._transfer_config = self._make_transfer_config(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency)
+        self._transfer_stats = S3TransferStats()
 
-    def _get_bucket(self, bucket_name, connection):
-        import botocore.exceptions
-        bucket = connection.Bucket(bucket_name)
-        exists = True
-        try:
-            connection.meta.client.head_bucket(Bucket=bucket_name)
-        except botocore.exceptions.ClientError as error:
-            error_code = error.response['Error']['Code']
-            if error_code == '404':
-                exists = False
-            else:
-                raise error
-        if exists:
-            return bucket
-        else:
-            return None
+    @staticmethod
+    def _make_transfer_config(**kwargs):
+        # options not given in the storage config keep boto3's defaults
+        options = {name: int(value) for name, value in kwargs.items()
+                   if value is not None}
+        return TransferConfig(**options)
+
+    @property
+    def transfer_config(self):
+        return self._transfer_config
+
+    @property
+    def transfer_stats(self):
+        return self._transfer_stats
 
     @classmethod
     def valid_url(cls, url):
@@ -60,27 +191,77 @@ class S3StorageBackend(StorageBackend):
         else:
             return subpath
 
+    def _get_object(self, subpath, **kwargs):
+        import botocore.exceptions
+        try:
+            return self._bucket.meta.client.get_object(Bucket=self._bucket.name,
+                                                       Key=self._get_keyname(subpath),
+                                                       **kwargs)
+        except botocore.exceptions.ClientError as error:
+            error_code = error.response['Error']['Code']
+            if error_code in ('404', 'NoSuchKey', 'NotFound'):
+                raise ObjectNotFound(subpath) from error
+            raise
+
     def get(self, subpath):
-        keyname = self._get_keyname(subpath)
-        t = TemporaryFile(mode='w+b')
-        self._bucket.download_fileobj(keyname, t)
-        if t.tell() == 0:
+        # The body is streamed from the response as it's read, so the returned
+        # object is not seekable.
+        response = self._get_object(subpath)
+        body = response['Body']
+        if response['ContentLength'] == 0:
+            body.close()
             return None
-        t.seek(0)
-        return t
+        return body
 
-    def get_meta(self, subpath):
+    def get_range(self, subpath, start, length=None):
+        if length is not None and length <= 0:
+            return b''
+        end = '' if length is None else start + length - 1
+        response = self._get_object(subpath, Range='bytes=%d-%s' % (start, end))
+        with response['Body'] as body:
+            return body.read()
+
+    def iter_chunks(self, subpath, chunk_size=utils.CHUNK_SIZE):
+        response = self._get_object(subpath)
+        with response['Body'] as body:
+            yield from body.iter_chunks(chunk_size)
 
+    def _is_cacheable(self, subpath):
+        return subpath.startswith(self.CACHEABLE_PREFIXES)
+
+    def _head(self, keyname):
+        import botocore.exceptions
+        try:
+            response = self._bucket.meta.client.head_object(Bucket=self._bucket.name,
+                                                            Key=keyname)
+        except botocore.exceptions.ClientError as error:
+            error_code = error.response['Error']['Code']
+            if error_code in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {'size': response['ContentLength']}
+
+    def get_meta(self, subpath):
         keyname = self._get_keyname(subpath)
-        object_summary_iterator = self._bucket.objects.filter(Prefix=keyname, MaxKeys=1)
-        object_summaries = list(object_summary_iterator)
-        if len(object_summaries) == 0:
-            return None
-        object_summary = object_summaries[0]
-        meta = dict()
-        meta['size'] = object_summary.size
+        cacheable = self._is_cacheable(subpath)
+        if cacheable:
+            found, meta = self._meta_cache.get(keyname)
+            if found:
+                return meta
+        meta = self._head(keyname)
+        if cacheable:
+            self._meta_cache.put(keyname, meta)
         return meta
 
+    def get_metas(self, subpaths):
+        subpaths = list(subpaths)
+        if len(subpaths) <= 1:
+            return super(S3StorageBackend, self).get_metas(subpaths)
+        jobs = min(self._meta_jobs, len(subpaths))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            metas = executor.map(self.get_meta, subpaths)
+            return dict(zip(subpaths, metas))
+
     def put(self, subpath, fileobj, max_age=None, **kwargs):
         log.debug(f"S3StorageBackend: put() called. (subpath: '{subpath}', max_age: {max_age})")
         extra_args = None
@@ -89,7 +270,16 @@ class S3StorageBackend(StorageBackend):
                 'CacheControl': f'max-age={max_age}'
             }
         keyname = self._get_keyname(subpath)
-        self._bucket.upload_fileobj(fileobj, keyname, ExtraArgs=extra_args)
+        # `fileobj` may be a non-seekable stream (e.g. an `ArchiveStream`). If
+        # its first `multipart_threshold` bytes come back from one read, it is
+        # sent as a multipart upload, one part at a time; otherwise s3transfer
+        # reads it into memory and sends a single PutObject.
+        progress = _TransferProgress(keyname, self._transfer_stats,
+                                     self._transfer_config.multipart_threshold)
+        self._bucket.upload_fileobj(fileobj, keyname, ExtraArgs=extra_args,
+                                    Callback=progress, Config=self._transfer_config)
+        progress.finish()
+        self._meta_cache.invalidate(keyname)
 
     def list(self, prefix=None):
         contents = []
@@ -102,5 +292,49 @@ class S3StorageBackend(StorageBackend):
             contents.append(rel_path)
         return contents
 
+    def list_meta(self, prefix=None):
+        metas = dict()
+        subpath = self._get_keyname(prefix)
+        for object_summary in self._bucket.objects.filter(Prefix=subpath + '/'):
+            if object_summary.key.endswith('/'):
+                # skip "directory" keys
+                continue
+            rel_path = object_summary.key[len(subpath) + 1:]
+            metas[rel_path] = {'size': object_summary.size}
+        return metas
+
     def delete(self, subpath):
-        self._bucket.objects.delete([self._get_keyname(subpath)])
+        keyname = self._get_keyname(subpath)
+        self._meta_cache.invalidate(keyname)
+        self._bucket.objects.delete([keyname])
+
+    def get_with_token(self, subpath):
+        response = self._get_object(subpath)
+        return response['Body'].read(), response['ETag']
+
+    def put_if_match(self, subpath, bytes, token, max_age=None, **kwargs):
+        import botocore.exceptions
+        client = self._bucket.meta.client
+        client.meta.events.register('before-sign.s3.PutObject',
+                                    _add_conditional_headers,
+                                    unique_id='zinc-conditional-put')
+        extra_args = dict()
+        if max_age is not None:
+            extra_args['CacheControl'] = f'max-age={max_age}'
+        if token is not None:
+            headers = {'If-Match': token}
+        else:
+            headers = {'If-None-Match': '*'}
+        _conditional_headers.headers = headers
+        try:
+            response = client.put_object(Bucket=self._bucket.name,
+                                         Key=self._get_keyname(subpath),
+                                         Body=bytes, **extra_args)
+        except botocore.exceptions.ClientError as error:
+            error_code = error.response['Error']['Code']
+            if error_code in ('PreconditionFailed', 'ConditionalRequestConflict', '412'):
+                raise PreconditionFailed(subpath)
+            raise
+        finally:
+            _conditional_headers.headers = None
+        return response['ETag']
@@ -1,10 +1,12 @@
 import os
+import fcntl
+import shutil
 from urllib.parse import urlparse
 from atomicwrites import atomic_write
 from copy import copy
 
 import zinc.utils as utils
-from . import StorageBackend
+from . import StorageBackend, PreconditionFailed
 
 
 class FilesystemStorageBackend(StorageBackend):
@@ -41,6 +43,11 @@ class FilesystemStorageBackend(StorageBackend):
         f = open(abs_path, 'rb')
         return f
 
+    def get_range(self, subpath, start, length=None):
+        with open(self._abs_path(subpath), 'rb') as f:
+            f.seek(start)
+            return f.read() if length is None else f.read(length)
+
     def get_meta(self, subpath):
         abs_path = self._abs_path(subpath)
         if not os.path.exists(abs_path):
@@ -55,7 +62,7 @@ class FilesystemStorageBackend(StorageBackend):
 
         # TODO: is overwrite correct behavior here?
         with atomic_write(abs_path, mode='wb', overwrite=True) as f:
-            f.write(fileobj.read())
+            shutil.copyfileobj(fileobj, f, utils.CHUNK_SIZE)
 
     def list(self, prefix=None):
         if prefix is not None:
@@ -72,6 +79,56 @@ class FilesystemStorageBackend(StorageBackend):
 
         return contents
 
+    def list_meta(self, prefix=None):
+        if prefix is not None:
+            dir = self._abs_path(prefix)
+        else:
+            dir = self._root_abs_path()
+
+        metas = dict()
+        for path, dirs, files in os.walk(dir):
+            for fn in files:
+                abs_path = os.path.join(path, fn)
+                rel_path = abs_path[len(dir) + 1:]  # get path relative to dir
+                metas[rel_path] = {'size': os.path.getsize(abs_path)}
+
+        return metas
+
     def delete(self, subpath):
         path = self._abs_path(subpath)
         os.remove(path)
+
+    @staticmethod
+    def _token_for_stat(st):
+        # every write replaces the file, so the inode changes too
+        return '%d-%d-%d' % (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _token(self, abs_path):
+        try:
+            return self._token_for_stat(os.stat(abs_path))
+        except FileNotFoundError:
+            return None
+
+    def get_with_token(self, subpath):
+        abs_path = self._abs_path(subpath)
+        with open(abs_path, 'rb') as f:
+            token = self._token_for_stat(os.fstat(f.fileno()))
+            return f.read(), token
+
+    def put_if_match(self, subpath, bytes, token, **kwargs):
+        abs_path = self._abs_path(subpath)
+        dir = os.path.dirname(abs_path)
+        utils.makedirs(dir)
+
+        # conditional writers serialize on a lock on the parent directory
+        dir_fd = os.open(dir, os.O_RDONLY)
+        try:
+            fcntl.flock(dir_fd, fcntl.LOCK_EX)
+            if self._token(abs_path) != token:
+                raise PreconditionFailed(subpath)
+            with atomic_write(abs_path, mode='wb', overwrite=True) as f:
+                f.write(bytes)
+            return self._token(abs_path)
+        finally:
+            fcntl.flock(dir_fd, fcntl.LOCK_UN)
+            os.close(dir_fd)
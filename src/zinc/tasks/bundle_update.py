@@ -1,16 +1,61 @@
 import os
 import logging
 import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import zinc.utils as utils
+from zinc.defaults import defaults
 from zinc.models import ZincFileList, ZincManifest
-from zinc.archives import build_archive_with_manifest
+from zinc.archives import build_archive_with_manifest, ArchiveStream
+from zinc.staging import ZincBlobStage
 
 log = logging.getLogger(__name__)
 
 # TODO: real ignore system
 IGNORE = ['.DS_Store']
 
+# rough per-member overhead of a tar archive (header + padding)
+TAR_MEMBER_OVERHEAD = 1024
+
+
+class TempDiskBudget(object):
+    """Limits the number of bytes of scratch disk in use at once. Bytes taken
+    with `charge` (e.g. blobs kept in a `ZincBlobStage`) are held until the
+    budget is discarded, and are only granted if they fit. Bytes taken with
+    `reserve` are returned when the reservation ends. A single reservation is
+    always granted, even if it is larger than the limit, so that oversized
+    archives can still be built one at a time."""
+
+    def __init__(self, limit=None):
+        self._limit = limit
+        self._held = 0
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def charge(self, nbytes):
+        """Takes `nbytes` for good if they fit, returning whether they did."""
+        with self._cond:
+            if self._limit is not None and self._held + self._used + nbytes > self._limit:
+                return False
+            self._held += nbytes
+            return True
+
+    @contextmanager
+    def reserve(self, nbytes):
+        with self._cond:
+            while self._limit is not None and self._used > 0 \
+                    and self._held + self._used + nbytes > self._limit:
+                self._cond.wait()
+            self._used += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._used -= nbytes
+                self._cond.notify_all()
+
 
 class ZincBundleUpdateTask(object):
 
@@ -20,15 +65,35 @@ class ZincBundleUpdateTask(object):
                  src_dir=None,
                  flavor_spec=None,
                  force=False,
-                 skip_master_archive=True):
+                 skip_master_archive=True,
+                 jobs=None,
+                 hash_cache=None,
+                 archive_jobs=None,
+                 archive_tmp_limit=None,
+                 stream_archives=None,
+                 incremental=False):
 
         self.catalog = catalog
         self.bundle_name = bundle_name
         self.flavor_spec = flavor_spec
         self.force = force
         self.skip_master_archive = skip_master_archive
-
-        self._src_dir = src_dir
+        self.jobs = jobs or defaults['bundle_update_jobs']
+        self.hash_cache = hash_cache
+        self.archive_jobs = archive_jobs or defaults['bundle_update_archive_jobs']
+        self.archive_tmp_limit = archive_tmp_limit or defaults['bundle_update_archive_tmp_limit']
+        if stream_archives is None:
+            stream_archives = defaults['bundle_update_stream_archives']
+        self.stream_archives = stream_archives
+        if incremental and hash_cache is None:
+            # without one every file would be hashed to find the changed ones
+            raise ValueError("Incremental bundle updates require a hash cache.")
+        self.incremental = incremental
+
+        self.src_dir = src_dir
+        self._blob_stage = None
+        self._disk_budget = None
+        self._previous_formats = None
 
     @property
     def src_dir(self):
@@ -41,19 +106,20 @@ class ZincBundleUpdateTask(object):
         self._src_dir = val
 
     @staticmethod
-    def _build_archive(catalog, manifest, src_dir, flavor=None):
+    def _build_archive(catalog, manifest, src_dir, flavor=None, blob_stage=None):
 
         archive_filename = catalog.path_helper.archive_name(manifest.bundle_name,
                                                             manifest.version,
                                                             flavor=flavor)
         archive_path = os.path.join(tempfile.mkdtemp(), archive_filename)
-        build_archive_with_manifest(manifest, src_dir, archive_path, flavor=flavor)
+        build_archive_with_manifest(manifest, src_dir, archive_path, flavor=flavor,
+                                    blob_stage=blob_stage)
         return archive_path
 
-    def _import_files(self, src_dir, flavor_spec=None):
-
-        filelist = ZincFileList()
-
+    @staticmethod
+    def _walk_src_dir(src_dir):
+        """Yields `(full_path, rel_path)` for every file to import, in a stable
+        order."""
         for root, dirs, files in os.walk(src_dir):
             for f in files:
                 if f in IGNORE:
@@ -61,20 +127,130 @@ class ZincBundleUpdateTask(object):
                 full_path = os.path.join(root, f)
                 rel_dir = root[len(src_dir) + 1:]
                 rel_path = os.path.join(rel_dir, f)
+                yield full_path, rel_path
 
-                file_info = self.catalog.import_path(full_path)
-                if file_info is not None:
-                    filelist.add_file(rel_path, file_info['sha'])
-                    filelist.add_format_for_file(rel_path, file_info['format'], file_info['size'])
+    @staticmethod
+    def _estimate_archive_size(manifest, flavor=None):
+        size = 0
+        for f in manifest.get_all_files(flavor=flavor):
+            format, format_info = manifest.get_format_info_for_file(f)
+            size += format_info['size'] + TAR_MEMBER_OVERHEAD
+        return size
+
+    def _build_and_write_archive(self, manifest, flavor, disk_budget):
+        if self.stream_archives:
+            # the archive itself isn't written to scratch disk; its members
+            # come from the blob stage, which is charged against the budget
+            with ArchiveStream(manifest, self.src_dir, flavor=flavor,
+                               blob_stage=self._blob_stage) as archive_stream:
+                self.catalog._write_archive_fileobj(
+                    self.bundle_name, manifest.version,
+                    archive_stream, flavor=flavor)
+            return
+
+        with disk_budget.reserve(self._estimate_archive_size(manifest, flavor=flavor)):
+            tmp_tar_path = self._build_archive(
+                self.catalog, manifest, self.src_dir, flavor=flavor,
+                blob_stage=self._blob_stage)
+            try:
+                self.catalog._write_archive(
+                    self.bundle_name, manifest.version,
+                    tmp_tar_path, flavor=flavor)
+            finally:
+                os.remove(tmp_tar_path)
+                os.rmdir(os.path.dirname(tmp_tar_path))
+
+    def _build_and_write_archives(self, manifest, archive_flavors):
+        """Builds and uploads the archive for each flavor in
+        `archive_flavors`, using up to `self.archive_jobs` threads so that
+        uploads overlap with the building of other archives."""
+        disk_budget = self._disk_budget
+
+        if self.archive_jobs <= 1 or len(archive_flavors) <= 1:
+            for flavor in archive_flavors:
+                self._build_and_write_archive(manifest, flavor, disk_budget)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.archive_jobs) as executor:
+            futures = [executor.submit(self._build_and_write_archive, manifest, flavor, disk_budget)
+                       for flavor in archive_flavors]
+            for future in futures:
+                future.result()
+
+    def _import_path(self, full_path):
+        st = sha = None
+        if self.hash_cache is not None:
+            st = os.stat(full_path)
+            sha = self.hash_cache.get(full_path, st=st)
+
+        if self._previous_formats is not None:
+            # incremental: unchanged files are found from the hash cache with
+            # a stat each, and copied from the previous manifest without
+            # touching the catalog; only new or changed files are hashed
+            if sha is None:
+                sha = utils.sha1_for_path(full_path)
+                self.hash_cache.set(full_path, sha, st=st)
+            formats = self._previous_formats.get(sha)
+            if formats is not None:
+                return {
+                    'sha': sha,
+                    'formats': {format: dict(info) for format, info in formats.items()},
+                }
+
+        file_info = self.catalog.import_path(full_path, sha=sha, blob_stage=self._blob_stage)
+        if self.hash_cache is not None and file_info is not None and file_info['sha'] != sha:
+            self.hash_cache.set(full_path, file_info['sha'], st=st)
+        return file_info
+
+    def _import_paths(self, full_paths):
+        """Imports `full_paths` into the catalog, returning the file infos in
+        the same order. Uses a pool of `self.jobs` worker threads. Hashing,
+        compression and storage I/O all release the GIL, so threads keep both
+        the CPU cores and the network busy."""
+        if self.jobs <= 1 or len(full_paths) <= 1:
+            return [self._import_path(p) for p in full_paths]
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(self._import_path, full_paths))
+
+    def _import_files(self, src_dir, flavor_spec=None, previous_manifest=None):
+        """Imports all files in `src_dir` and returns the `ZincFileList`. If
+        `previous_manifest` is given, files whose contents already appear in
+        it are not imported again; their formats and sizes are copied."""
+
+        filelist = ZincFileList()
 
-                    if flavor_spec is not None:
-                        for flavor in flavor_spec.flavors:
-                            filter = flavor_spec.filter_for_flavor(flavor)
-                            if filter.match(full_path):
-                                filelist.add_flavor_for_file(rel_path, flavor)
+        if previous_manifest is not None:
+            self._previous_formats = dict()
+            for path, info in previous_manifest.files.items():
+                if info.get('formats'):
+                    self._previous_formats[info['sha']] = info['formats']
+
+        paths = list(self._walk_src_dir(src_dir))
+        try:
+            file_infos = self._import_paths([full_path for full_path, rel_path in paths])
+        finally:
+            self._previous_formats = None
+
+        # build the filelist in walk order so the result does not depend on
+        # the number of jobs
+        for (full_path, rel_path), file_info in zip(paths, file_infos):
+            if file_info is not None:
+                filelist.add_file(rel_path, file_info['sha'])
+                if file_info.get('formats') is not None:
+                    for format, format_info in file_info['formats'].items():
+                        filelist.add_format_for_file(rel_path, format, format_info['size'])
                 else:
-                    # TODO: better error
-                    raise Exception("we broke")
+                    filelist.add_format_for_file(rel_path, file_info['format'], file_info['size'])
+
+                if flavor_spec is not None:
+                    for flavor in flavor_spec.flavors:
+                        filter = flavor_spec.filter_for_flavor(flavor)
+                        if filter.match(full_path):
+                            filelist.add_flavor_for_file(rel_path, flavor)
+            else:
+                # TODO: better error
+                raise Exception("we broke")
 
         return filelist
 
@@ -84,13 +260,34 @@ class ZincBundleUpdateTask(object):
         assert self.bundle_name
         assert self.src_dir
 
-        filelist = self._import_files(self.src_dir, self.flavor_spec)
+        # compressed blobs are shared between import and all archive builds,
+        # and count against the same scratch disk limit as the archives
+        self._disk_budget = TempDiskBudget(limit=self.archive_tmp_limit)
+        with ZincBlobStage(levels=self.catalog.config.compression_levels,
+                           budget=self._disk_budget) as blob_stage:
+            self._blob_stage = blob_stage
+            try:
+                return self._run()
+            finally:
+                self._blob_stage = None
+                self._disk_budget = None
+
+    def _run(self):
+
+        existing_manifest = None
+        if self.incremental or not self.force:
+            existing_manifest = self.catalog.manifest_for_bundle(self.bundle_name)
+
+        previous_manifest = existing_manifest if self.incremental else None
+        filelist = self._import_files(self.src_dir, self.flavor_spec,
+                                      previous_manifest=previous_manifest)
+        if self.hash_cache is not None:
+            self.hash_cache.flush()
 
         # Check if it matches the newest version
         # TODO: optionally check it if matches any existing versions?
 
         if not self.force:
-            existing_manifest = self.catalog.manifest_for_bundle(self.bundle_name)
             if existing_manifest is not None \
                and existing_manifest.files.contents_are_equalivalent(filelist):
                 log.info("Found existing version with same contents.")
@@ -119,15 +316,7 @@ class ZincBundleUpdateTask(object):
             if new_manifest.flavors is not None:
                 archive_flavors.extend(new_manifest.flavors)
 
-            for flavor in archive_flavors:
-                tmp_tar_path = self._build_archive(
-                    self.catalog, new_manifest, self.src_dir, flavor=flavor)
-                self.catalog._write_archive(
-                    self.bundle_name, new_manifest.version,
-                    tmp_tar_path, flavor=flavor)
-
-                # TODO: remove remove?
-                os.remove(tmp_tar_path)
+            self._build_and_write_archives(new_manifest, archive_flavors)
 
         self.catalog.update_bundle(new_manifest)
 
@@ -21,6 +21,9 @@ from itertools import tee
 
 Tee: type = tee([], 1)[0].__class__
 
+# Size of the blocks read from disk when hashing or compressing files.
+CHUNK_SIZE = 64 * 1024
+
 
 class EnumMC(type):
     def __contains__(self, val):
@@ -50,14 +53,53 @@ def memoized(f):
 def sha1_for_path(path: str) -> str:
     """Returns the SHA1 hash as a string for the given path."""
     sha1 = hashlib.sha1()
-    f = open(path, 'rb')
-    try:
-        sha1.update(f.read())
-    finally:
-        f.close()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
     return sha1.hexdigest()
 
 
+def gzip_compressobj(level: int = 9):
+    """Returns a zlib compressor that writes the gzip container format, so its
+    output can be read by `gunzip_bytes` and `gzip`. The default level matches
+    the `gzip` module."""
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def sha1_and_gzip_path(src_path: str, dst_file, chunk_size: int = CHUNK_SIZE):
+    """Reads `src_path` once, in chunks of `chunk_size` bytes, feeding a SHA1
+    digest, a gzip compressor and a byte counter at the same time. The gzipped
+    bytes are written to the file-like object `dst_file`. Returns a tuple of
+    `(sha, size, gz_size)`."""
+    sha, size, (gz_size,) = sha1_and_compress_path(
+        src_path, [(gzip_compressobj(), dst_file)], chunk_size=chunk_size)
+    return sha, size, gz_size
+
+
+def sha1_and_compress_path(src_path: str, outputs, chunk_size: int = CHUNK_SIZE):
+    """Like `sha1_and_gzip_path`, but feeds any number of compressors in the
+    same pass. `outputs` is a list of `(compressor, dst_file)` pairs, where
+    `compressor` has `compress` and `flush` methods (e.g. from
+    `zlib.compressobj`). Returns a tuple of `(sha, size, compressed_sizes)`."""
+    sha1 = hashlib.sha1()
+    size = 0
+    compressed_sizes = [0] * len(outputs)
+    with open(src_path, 'rb') as src_file:
+        for chunk in iter(lambda: src_file.read(chunk_size), b''):
+            sha1.update(chunk)
+            size += len(chunk)
+            for i, (compressor, dst_file) in enumerate(outputs):
+                compressed_chunk = compressor.compress(chunk)
+                if compressed_chunk:
+                    dst_file.write(compressed_chunk)
+                    compressed_sizes[i] += len(compressed_chunk)
+    for i, (compressor, dst_file) in enumerate(outputs):
+        compressed_chunk = compressor.flush()
+        dst_file.write(compressed_chunk)
+        compressed_sizes[i] += len(compressed_chunk)
+    return sha1.hexdigest(), size, compressed_sizes
+
+
 def canonical_path(path: str) -> str:
     path = os.path.expanduser(path)
     path = os.path.normpath(path)
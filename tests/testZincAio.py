@@ -0,0 +1,107 @@
+import os
+import asyncio
+
+from zinc.aio import AsyncZincCatalog
+from zinc.client import connect, create_bundle_version
+from zinc.models import ZincCatalogConfig
+from zinc.formats import Formats
+from zinc.storages.aio import AsyncFilesystemStorageBackend, async_storage_for_url
+import zinc.utils as utils
+
+from tests import TempDirTestCase, create_random_file
+
+
+class AsyncFilesystemStorageBackendTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage = AsyncFilesystemStorageBackend(url='file://%s' % (self.dir))
+
+    def test_storage_for_url(self):
+        self.assertIs(async_storage_for_url('file://%s' % (self.dir)), AsyncFilesystemStorageBackend)
+
+    def test_put_get_delete(self):
+
+        async def run():
+            await self.storage.puts('foo/bar', b'0123456789')
+            self.assertEqual(await self.storage.get('foo/bar'), b'0123456789')
+            self.assertEqual(await self.storage.get_range('foo/bar', 3, 2), b'34')
+            self.assertEqual(await self.storage.get_meta('foo/bar'), {'size': 10})
+            self.assertEqual(await self.storage.list('foo'), ['bar'])
+            await self.storage.delete('foo/bar')
+            self.assertIsNone(await self.storage.get_meta('foo/bar'))
+
+        asyncio.run(run())
+
+    def test_iter_chunks(self):
+        b = os.urandom(utils.CHUNK_SIZE + 17)
+
+        async def run():
+            await self.storage.puts('foo', b)
+            return [chunk async for chunk in self.storage.iter_chunks('foo')]
+
+        chunks = asyncio.run(run())
+        self.assertEqual([len(c) for c in chunks], [utils.CHUNK_SIZE, 17])
+        self.assertEqual(b''.join(chunks), b)
+
+    def test_bind_to_catalog(self):
+        bound = self.storage.bind_to_catalog(id='meep')
+        self.assertIsInstance(bound, AsyncFilesystemStorageBackend)
+        asyncio.run(bound.puts('foo', b'bar'))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'meep', 'foo')))
+
+
+class AsyncZincCatalogTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.catalog_dir = os.path.join(self.dir, "catalog")
+        os.mkdir(self.catalog_dir)
+        self.scratch_dir = os.path.join(self.dir, "scratch")
+        os.mkdir(self.scratch_dir)
+        service = connect('/')
+        service.create_catalog(id='com.mindsnacks.test', loc=self.catalog_dir)
+        self.catalog = service.get_catalog(loc=self.catalog_dir)
+
+    def test_import_paths(self):
+        paths = [create_random_file(self.scratch_dir) for i in range(5)]
+        async_catalog = AsyncZincCatalog(self.catalog, concurrency=2)
+        file_infos = asyncio.run(async_catalog.import_paths(paths))
+        self.assertEqual([info['sha'] for info in file_infos],
+                         [utils.sha1_for_path(path) for path in paths])
+        # the facade isn't tied to the event loop it was first used in
+        self.assertEqual(asyncio.run(async_catalog.import_paths(paths)), file_infos)
+        for info in file_infos:
+            self.assertIsNotNone(self.catalog._get_file_info(info['sha']))
+
+    def test_clone_and_verify(self):
+        config = ZincCatalogConfig()
+        config.codecs = [Formats.XZ]
+        self.catalog.update_config(config)
+        paths = [create_random_file(self.scratch_dir, size=100000) for i in range(3)]
+        manifest = create_bundle_version(self.catalog, "meep", self.scratch_dir)
+        async_catalog = AsyncZincCatalog(self.catalog)
+
+        clone_dir = os.path.join(self.dir, "clone")
+        asyncio.run(async_catalog.clone_bundle("meep", manifest.version,
+                                               root_path=clone_dir, bundle_dir_name="meep"))
+        for path in paths:
+            with open(path, 'rb') as src, open(os.path.join(clone_dir, "meep", os.path.basename(path)), 'rb') as dst:
+                self.assertEqual(src.read(), dst.read())
+
+        messages = asyncio.run(async_catalog.verify_bundle("meep", manifest.version))
+        self.assertEqual(len(messages), 3)
+        self.assertEqual([m for m in messages if m.type == 'error'], [])
+
+    def test_verify_detects_corruption(self):
+        path = create_random_file(self.scratch_dir)
+        manifest = create_bundle_version(self.catalog, "meep", self.scratch_dir)
+        sha = utils.sha1_for_path(path)
+        info = self.catalog._get_file_info(sha)
+        subpath = self.catalog.path_helper.path_for_file_with_sha(sha, format=info['format'])
+        data = bytearray(self.catalog._read(subpath))
+        data[-1] ^= 0xff
+        self.catalog._storage.puts(subpath, bytes(data))
+
+        messages = asyncio.run(AsyncZincCatalog(self.catalog).verify_bundle("meep", manifest.version))
+        self.assertEqual([m.type for m in messages], ['error'])
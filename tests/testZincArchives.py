@@ -0,0 +1,75 @@
+import os
+import tarfile
+from unittest import mock
+
+from zinc.archives import ArchiveStream, build_archive_with_manifest
+from zinc.models import ZincManifest
+from zinc.formats import Formats
+from zinc.storages.aws import S3StorageBackend
+from zinc.awspool import AWSSessionPool
+import zinc.utils as utils
+
+from tests import TempDirTestCase, create_random_file
+
+
+class TestArchiveStream(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.src_dir = os.path.join(self.dir, 'src')
+        os.mkdir(self.src_dir)
+        self.manifest = ZincManifest('com.mindsnacks.test', 'meep', 1)
+        for i in range(3):
+            path = create_random_file(self.src_dir, size=100000)
+            rel_path = os.path.basename(path)
+            self.manifest.add_file(rel_path, utils.sha1_for_path(path))
+            self.manifest.add_format_for_file(rel_path, Formats.RAW, os.path.getsize(path))
+
+    def test_stream_matches_built_archive(self):
+        archive_path = os.path.join(self.dir, 'meep-1.tar')
+        build_archive_with_manifest(self.manifest, self.src_dir, archive_path)
+        with tarfile.open(archive_path) as tar:
+            expected = {m.name: tar.extractfile(m).read() for m in tar.getmembers()}
+
+        stream_path = os.path.join(self.dir, 'meep-1-stream.tar')
+        with ArchiveStream(self.manifest, self.src_dir) as stream, open(stream_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(4096), b''):
+                f.write(chunk)
+        with tarfile.open(stream_path) as tar:
+            actual = {m.name: tar.extractfile(m).read() for m in tar.getmembers()}
+
+        self.assertEqual(expected, actual)
+
+    def test_stream_raises_if_build_fails(self):
+        with mock.patch('zinc.archives.write_archive_with_manifest', side_effect=OSError('boom')):
+            with ArchiveStream(self.manifest, self.src_dir) as stream:
+                self.assertRaises(IOError, stream.read)
+
+    def test_read_fills_the_requested_size(self):
+        with ArchiveStream(self.manifest, self.src_dir) as stream:
+            self.assertEqual(len(stream.read(250000)), 250000)
+
+    def test_s3_upload_is_multipart(self):
+        import boto3
+        from botocore.stub import Stubber, ANY
+
+        with mock.patch('zinc.awspool.boto3'):
+            storage = S3StorageBackend(aws_key='key', aws_secret='secret', bucket='bucket',
+                                       session_pool=AWSSessionPool(),
+                                       multipart_threshold=64 * 1024, max_concurrency=1)
+        session = boto3.session.Session(aws_access_key_id='key', aws_secret_access_key='secret',
+                                        region_name='us-east-1')
+        storage._bucket = session.resource('s3').Bucket('bucket')
+        client = storage._bucket.meta.client
+        with Stubber(client) as stubber:
+            stubber.add_response('create_multipart_upload', {'UploadId': 'upload'},
+                                 {'Bucket': 'bucket', 'Key': ANY})
+            stubber.add_response('upload_part', {'ETag': '"part"'},
+                                 {'Bucket': 'bucket', 'Key': ANY, 'UploadId': 'upload',
+                                  'PartNumber': 1, 'Body': ANY})
+            stubber.add_response('complete_multipart_upload', {},
+                                 {'Bucket': 'bucket', 'Key': ANY, 'UploadId': 'upload',
+                                  'MultipartUpload': ANY})
+            with ArchiveStream(self.manifest, self.src_dir) as stream:
+                storage.put('archives/meep-1.tar', stream)
+            stubber.assert_no_pending_responses()
@@ -0,0 +1,49 @@
+import unittest
+import os
+
+import zinc.binarymanifest as binarymanifest
+from zinc.models import ZincManifest
+from zinc.formats import Formats
+
+
+class ZincBinaryManifestTestCase(unittest.TestCase):
+
+    def _make_manifest(self, file_count=10):
+        manifest = ZincManifest('com.mindsnacks.test', 'meep', 3)
+        for i in range(file_count):
+            path = 'dir/fïle-%d.txt' % (i)
+            manifest.add_file(path, os.urandom(20).hex())
+            manifest.add_format_for_file(path, Formats.RAW, 200 + i)
+            if i % 2:
+                manifest.add_format_for_file(path, Formats.GZ, 100 + i)
+                manifest.add_flavor_for_file(path, 'small')
+            if i % 3:
+                manifest.add_flavor_for_file(path, 'large')
+        return manifest
+
+    def test_round_trip(self):
+        manifest = self._make_manifest()
+        decoded = binarymanifest.decode(binarymanifest.encode(manifest))
+        self.assertEqual(decoded.to_dict(), manifest.to_dict())
+        self.assertEqual(decoded.format, manifest.format)
+
+    def test_round_trip_empty_manifest(self):
+        manifest = ZincManifest('com.mindsnacks.test', 'meep', 1)
+        decoded = binarymanifest.decode(binarymanifest.encode(manifest))
+        self.assertEqual(decoded.to_dict(), manifest.to_dict())
+
+    def test_decode_immutable(self):
+        manifest = self._make_manifest()
+        decoded = binarymanifest.decode(binarymanifest.encode(manifest), mutable=False)
+        self.assertFalse(decoded.is_mutable)
+
+    def test_smaller_than_json(self):
+        manifest = self._make_manifest(1000)
+        self.assertTrue(len(binarymanifest.encode(manifest)) < len(manifest.to_bytes()) / 2)
+
+    def test_decode_bad_magic(self):
+        self.assertRaises(ValueError, binarymanifest.decode, b'{"catalog": 1}')
+
+    def test_decode_truncated(self):
+        b = binarymanifest.encode(self._make_manifest())
+        self.assertRaises(ValueError, binarymanifest.decode, b[:len(b) // 2])
@@ -1,17 +1,27 @@
 import unittest
+from unittest import mock
 import os
 import logging
 import json
+import threading
+import time
 
-from zinc.models import ZincIndex, ZincManifest, ZincFlavorSpec
+from zinc.models import ZincIndex, ZincManifest, ZincFlavorSpec, ZincCatalogConfig
+from zinc.formats import Formats
 from zinc.catalog import ZincCatalogPathHelper
 from zinc.defaults import defaults
-from zinc.catalog import ZincCatalog
-from zinc.storages import StorageBackend
+from zinc.catalog import ZincCatalog, ZincManifestCache, ZincPublishError
+from zinc.storages import StorageBackend, PreconditionFailed, ObjectNotFound
+from zinc.storages.filesystem import FilesystemStorageBackend
+from zinc.storages.aws import S3StorageBackend
+from zinc.awspool import AWSSessionPool
+from zinc.staging import ZincBlobStage
 
-from zinc.client import connect, create_bundle_version
+from zinc.client import connect, create_bundle_version, clone_bundle, bundle_verify
 
+import zinc.compression as compression
 import zinc.helpers as helpers
+import zinc.utils as utils
 
 from tests import TempDirTestCase, create_random_file
 
@@ -31,6 +41,183 @@ class StorageBackendTestCase(unittest.TestCase):
     def test_put_raises(self):
         self.assertRaises(NotImplementedError, self.storage.put, 'foo', 'bar')
 
+    def test_put_if_match_raises(self):
+        self.assertRaises(NotImplementedError, self.storage.put_if_match, 'foo', b'bar', None)
+
+
+class FilesystemStorageBackendTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage = FilesystemStorageBackend(url='file://%s' % (self.dir))
+
+    def test_put_if_match_new_file(self):
+        token = self.storage.put_if_match('foo', b'bar', None)
+        self.assertEqual(self.storage.get_with_token('foo'), (b'bar', token))
+        self.assertRaises(PreconditionFailed, self.storage.put_if_match, 'foo', b'baz', None)
+
+    def test_put_if_match_existing_file(self):
+        self.storage.puts('foo', b'bar')
+        _, token = self.storage.get_with_token('foo')
+        new_token = self.storage.put_if_match('foo', b'baz', token)
+        self.assertNotEqual(token, new_token)
+        self.assertRaises(PreconditionFailed, self.storage.put_if_match, 'foo', b'qux', token)
+        self.assertEqual(self.storage.get_with_token('foo')[0], b'baz')
+
+    def test_get_range(self):
+        self.storage.puts('foo', b'0123456789')
+        self.assertEqual(self.storage.get_range('foo', 2, 3), b'234')
+        self.assertEqual(self.storage.get_range('foo', 7), b'789')
+        self.assertEqual(self.storage.get_range('foo', 8, 10), b'89')
+
+    def test_iter_chunks(self):
+        b = os.urandom(utils.CHUNK_SIZE * 2 + 17)
+        self.storage.puts('foo', b)
+        chunks = list(self.storage.iter_chunks('foo', chunk_size=utils.CHUNK_SIZE))
+        self.assertEqual([len(c) for c in chunks], [utils.CHUNK_SIZE, utils.CHUNK_SIZE, 17])
+        self.assertEqual(b''.join(chunks), b)
+
+
+class NonSeekableStorageBackend(FilesystemStorageBackend):
+    """Returns unseekable files from `get`, like a streaming network backend."""
+
+    def get(self, subpath):
+        f = super().get(subpath)
+        f.seekable = lambda: False
+        f.seek = None
+        return f
+
+    get_range = StorageBackend.get_range
+
+
+class StreamingStorageBackendTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage = NonSeekableStorageBackend(url='file://%s' % (self.dir))
+
+    def test_get_range_without_seek(self):
+        b = b'0123456789' * utils.CHUNK_SIZE
+        self.storage.puts('foo', b)
+        self.assertEqual(self.storage.get_range('foo', len(b) - 7, 4), b'3456')
+
+
+class S3StorageBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = AWSSessionPool()
+        with mock.patch('zinc.awspool.boto3'):
+            self.storage = S3StorageBackend(aws_key='key', aws_secret='secret',
+                                            bucket='bucket', prefix='catalog',
+                                            session_pool=self.pool)
+        self.client = self.storage._bucket.meta.client
+        self.sizes = {'catalog/objects/ab/cd/abcd.gz': 3}
+
+        def head_object(Bucket=None, Key=None):
+            import botocore.exceptions
+            if Key not in self.sizes:
+                raise botocore.exceptions.ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+            return {'ContentLength': self.sizes[Key]}
+
+        self.client.head_object.side_effect = head_object
+
+    def test_get_meta_uses_exact_key(self):
+        self.assertEqual(self.storage.get_meta('objects/ab/cd/abcd.gz'), {'size': 3})
+        self.assertIsNone(self.storage.get_meta('objects/ab/cd/abcd'))
+        self.client.head_object.assert_called_with(Bucket=self.storage._bucket.name,
+                                                   Key='catalog/objects/ab/cd/abcd')
+
+    def test_get_meta_caches_objects(self):
+        for i in range(2):
+            self.storage.get_meta('objects/ab/cd/abcd.gz')
+            self.storage.get_meta('objects/ab/cd/abcd')
+        self.assertEqual(self.client.head_object.call_count, 2)
+
+    def test_get_meta_does_not_cache_mutable_paths(self):
+        for i in range(2):
+            self.storage.get_meta('index.json')
+        self.assertEqual(self.client.head_object.call_count, 2)
+
+    def test_put_invalidates_cached_meta(self):
+        self.assertIsNone(self.storage.get_meta('objects/ab/cd/abcd'))
+        self.sizes['catalog/objects/ab/cd/abcd'] = 5
+        self.storage.puts('objects/ab/cd/abcd', b'hello')
+        self.assertEqual(self.storage.get_meta('objects/ab/cd/abcd'), {'size': 5})
+
+    def test_get_metas(self):
+        subpaths = ['objects/ab/cd/abcd.gz', 'objects/ab/cd/abcd', 'objects/ab/cd/abcd.xz']
+        metas = self.storage.get_metas(subpaths)
+        self.assertEqual(metas, {'objects/ab/cd/abcd.gz': {'size': 3},
+                                 'objects/ab/cd/abcd': None,
+                                 'objects/ab/cd/abcd.xz': None})
+        self.assertEqual(self.client.head_object.call_count, 3)
+
+    def test_get_missing_object_raises_not_found(self):
+        import botocore.exceptions
+        self.client.get_object.side_effect = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        with self.assertRaises(ObjectNotFound):
+            self.storage.get('manifests/meep-1.zbm')
+        with self.assertRaises(FileNotFoundError):
+            self.storage.get_range('manifests/meep-1.zbm', 0, 4)
+
+    def test_transfer_config(self):
+        with mock.patch('zinc.awspool.boto3'):
+            storage = S3StorageBackend(aws_key='key', aws_secret='secret', bucket='bucket',
+                                       session_pool=self.pool, multipart_threshold=16 * 1024 * 1024,
+                                       multipart_chunksize='32000000', max_concurrency=20)
+        self.assertEqual(storage.transfer_config.multipart_threshold, 16 * 1024 * 1024)
+        self.assertEqual(storage.transfer_config.multipart_chunksize, 32000000)
+        self.assertEqual(storage.transfer_config.max_concurrency, 20)
+
+    def test_put_records_transfer_stats(self):
+
+        def upload_fileobj(fileobj, keyname, ExtraArgs=None, Callback=None, Config=None):
+            self.assertIs(Config, self.storage.transfer_config)
+            Callback(len(fileobj.read()))
+
+        self.storage._bucket.upload_fileobj.side_effect = upload_fileobj
+        self.storage.puts('objects/ab/cd/abcd', b'hello')
+        bound = self.storage.bind_to_catalog(id='other')
+        bound.puts('objects/ab/cd/abcd', b'world!')
+        stats = self.storage.transfer_stats.to_dict()
+        self.assertEqual(stats['transfers'], 2)
+        self.assertEqual(stats['bytes'], 11)
+
+
+class AWSSessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('zinc.awspool.boto3')
+        self.boto3 = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.boto3.session.Session.side_effect = lambda **kwargs: mock.MagicMock()
+        self.pool = AWSSessionPool(max_size=2)
+
+    def test_reuses_sessions_and_clients(self):
+        client = self.pool.client('sdb', 'key', 'secret', region='us-east-1')
+        self.assertIs(self.pool.client('sdb', 'key', 'secret', region='us-east-1'), client)
+        self.assertIsNot(self.pool.client('sdb', 'key', 'secret', region='us-west-2'), client)
+        self.assertIsNot(self.pool.client('sdb', 'other', 'secret', region='us-east-1'), client)
+        self.assertEqual(self.boto3.session.Session.call_count, 3)
+
+    def test_evicts_least_recently_used(self):
+        session = self.pool.session('a', 'secret')
+        self.pool.session('b', 'secret')
+        self.pool.session('a', 'secret')
+        self.pool.session('c', 'secret')
+        self.assertEqual(len(self.pool), 2)
+        self.assertIs(self.pool.session('a', 'secret'), session)
+        self.assertEqual(self.boto3.session.Session.call_count, 3)
+
+    def test_storages_share_bucket_lookup(self):
+        for i in range(3):
+            S3StorageBackend(aws_key='key', aws_secret='secret', bucket='bucket',
+                             session_pool=self.pool)
+        client = self.pool.resource('s3', 'key', 'secret').meta.client
+        self.assertEqual(client.head_bucket.call_count, 1)
+        self.assertEqual(self.boto3.session.Session.call_count, 1)
+
 
 def create_catalog_at_path(path, id):
     service = connect('/')
@@ -57,6 +244,48 @@ class ZincCatalogPathHelperTestCase(unittest.TestCase):
         self.assertEqual(expected_path, actual_path)
 
 
+class ZincManifestCacheTestCase(unittest.TestCase):
+
+    def _manifest(self, version):
+        return ZincManifest('com.mindsnacks.test', 'meep', version, mutable=False)
+
+    def test_get_missing(self):
+        cache = ZincManifestCache()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.misses, 1)
+
+    def test_evicts_least_recently_used_entry(self):
+        cache = ZincManifestCache(max_entries=2)
+        cache.put(1, self._manifest(1), 10)
+        cache.put(2, self._manifest(2), 10)
+        cache.get(1)
+        cache.put(3, self._manifest(3), 10)
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+        self.assertIsNotNone(cache.get(3))
+
+    def test_evicts_by_size(self):
+        cache = ZincManifestCache(max_bytes=25)
+        cache.put(1, self._manifest(1), 10)
+        cache.put(2, self._manifest(2), 10)
+        cache.put(3, self._manifest(3), 10)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.size, 20)
+        self.assertIsNone(cache.get(1))
+
+    def test_oversized_manifest_not_cached(self):
+        cache = ZincManifestCache(max_bytes=5)
+        cache.put(1, self._manifest(1), 10)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = ZincManifestCache()
+        cache.put(1, self._manifest(1), 10)
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.size, 0)
+
+
 class ZincCatalogTestCase(TempDirTestCase):
 
     def setUp(self):
@@ -92,6 +321,133 @@ class ZincCatalogTestCase(TempDirTestCase):
         f1 = create_random_file(self.scratch_dir)
         catalog.import_path(f1)
 
+    def test_update_bundle_rejects_objects_removed_since_import(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        file_info = catalog.import_path(create_random_file(self.scratch_dir))
+        # e.g. another process cleans up the still-unreferenced object
+        subpath = catalog.path_helper.path_for_file_with_sha(file_info['sha'], format=file_info['format'])
+        catalog._storage.delete(subpath)
+        manifest = ZincManifest(catalog.id, "meep", catalog._reserve_version_for_bundle("meep"))
+        manifest.add_file("f", file_info['sha'])
+        manifest.add_format_for_file("f", file_info['format'], file_info['size'])
+        with self.assertRaisesRegex(Exception, "Missing shas"):
+            catalog.update_bundle(manifest)
+        self.assertEqual(catalog.get_index().versions_for_bundle("meep"), [])
+
+    def test_update_bundle_lists_objects_once(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        manifest = ZincManifest(catalog.id, "meep", catalog._reserve_version_for_bundle("meep"))
+        for i in range(3):
+            file_info = catalog.import_path(create_random_file(self.scratch_dir))
+            manifest.add_file("f%d" % (i), file_info['sha'])
+            manifest.add_format_for_file("f%d" % (i), file_info['format'], file_info['size'])
+        storage = catalog._storage
+        with mock.patch.object(storage, 'get_meta', wraps=storage.get_meta) as get_meta, \
+                mock.patch.object(storage, 'list_meta', wraps=storage.list_meta) as list_meta:
+            catalog.update_bundle(manifest)
+        list_meta.assert_called_once_with(catalog.path_helper.objects_dir)
+        self.assertFalse([c for c in get_meta.call_args_list
+                          if c[0][0].startswith('objects/')])
+        self.assertEqual(catalog.get_index().versions_for_bundle("meep"), [1])
+
+    def test_file_info_from_object_index(self):
+        catalog = self._build_test_catalog()
+        manifest = catalog.manifest_for_bundle("meep", 1)
+        catalog = ZincCatalog(storage=catalog._storage)
+        with mock.patch.object(catalog._storage, 'get_meta') as get_meta:
+            for path in manifest.files.keys():
+                file_info = catalog._get_file_info(manifest.sha_for_file(path))
+                format, format_info = manifest.get_format_info_for_file(path)
+                self.assertEqual(file_info['format'], format)
+                self.assertEqual(file_info['size'], format_info['size'])
+            self.assertIsNone(catalog._get_file_info('0' * 40))
+            self.assertFalse(get_meta.called)
+
+    def test_object_index_updated_on_import(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog._get_object_index()
+        f1 = create_random_file(self.scratch_dir)
+        file_info = catalog.import_path(f1)
+        self.assertEqual(catalog._get_file_info(file_info['sha']), file_info)
+
+    def test_import_picks_smallest_codec(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        config = ZincCatalogConfig()
+        config.codecs = [Formats.GZ, Formats.XZ]
+        config.compression_levels = {Formats.GZ: 1}
+        catalog.update_config(config)
+
+        catalog = ZincCatalog(storage=catalog._storage)
+        self.assertEqual(catalog.config.codecs, [Formats.GZ, Formats.XZ])
+        self.assertEqual(catalog.config.level_for_format(Formats.GZ), 1)
+
+        f1 = create_random_file(self.scratch_dir, size=100000)
+        file_info = catalog.import_path(f1)
+        self.assertEqual(file_info['format'], Formats.XZ)
+        subpath = catalog.path_helper.path_for_file_with_sha(file_info['sha'], format=Formats.XZ)
+        with open(f1, 'rb') as f:
+            self.assertEqual(compression.decompress_bytes(Formats.XZ, catalog._read(subpath)), f.read())
+
+    def test_preferred_formats_follow_config_codecs(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        self.assertEqual(catalog._preferred_formats(), [Formats.GZ, Formats.RAW])
+        config = ZincCatalogConfig()
+        config.codecs = [Formats.XZ]
+        catalog.update_config(config)
+        self.assertEqual(catalog._preferred_formats(), [Formats.RAW, Formats.XZ])
+
+        # objects stored with a codec that was dropped are still found
+        file_info = catalog.import_path(create_random_file(self.scratch_dir, size=100000))
+        self.assertEqual(file_info['format'], Formats.XZ)
+        config.codecs = [Formats.GZ]
+        catalog.update_config(config)
+        self.assertEqual(catalog._get_file_info(file_info['sha']), file_info)
+
+    def test_config_is_read_once(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        config = ZincCatalogConfig()
+        config.codecs = [Formats.XZ]
+        catalog.update_config(config)
+        catalog = ZincCatalog(storage=catalog._storage, coordinator=catalog._coordinator)
+        self.assertEqual(catalog.config.codecs, [Formats.XZ])
+        with mock.patch.object(catalog, '_read', wraps=catalog._read) as read, \
+                mock.patch.object(catalog._storage, 'get_meta', wraps=catalog._storage.get_meta) as get_meta:
+            catalog._reload()
+        config_name = defaults['catalog_config_name']
+        self.assertNotIn(mock.call(config_name), read.call_args_list)
+        self.assertNotIn(mock.call(config_name), get_meta.call_args_list)
+
+    def test_import_stages_only_chosen_codec(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        config = ZincCatalogConfig()
+        config.codecs = [Formats.GZ, Formats.XZ]
+        catalog.update_config(config)
+        catalog = ZincCatalog(storage=catalog._storage)
+
+        f1 = create_random_file(self.scratch_dir, size=100000)
+        with ZincBlobStage() as blob_stage:
+            file_info = catalog.import_path(f1, blob_stage=blob_stage)
+            self.assertEqual(file_info['format'], Formats.XZ)
+            self.assertIsNotNone(blob_stage.get(file_info['sha'], Formats.XZ))
+            self.assertIsNone(blob_stage.get(file_info['sha'], Formats.GZ))
+
+    def test_clone_bundle_with_xz_codec(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        config = ZincCatalogConfig()
+        config.codecs = [Formats.XZ]
+        catalog.update_config(config)
+        f1 = create_random_file(self.scratch_dir)
+        f2 = create_random_file(self.scratch_dir)
+        manifest = create_bundle_version(catalog, "meep", self.scratch_dir)
+
+        clone_dir = os.path.join(self.dir, "clone")
+        clone_bundle(catalog, "meep", manifest.version, root_path=clone_dir, bundle_dir_name="meep")
+        for path in (f1, f2):
+            with open(path, 'rb') as src, open(os.path.join(clone_dir, "meep", os.path.basename(path)), 'rb') as dst:
+                self.assertEqual(src.read(), dst.read())
+        errors = [r for r in bundle_verify(catalog, "meep", manifest.version) if r.type == 'error']
+        self.assertEqual(errors, [])
+
     def test_bundle_names_with_no_bundles(self):
         catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
         self.assertTrue(len(catalog.index.bundle_names()) == 0)
@@ -125,6 +481,352 @@ class ZincCatalogTestCase(TempDirTestCase):
                 object_path = ZincCatalogPathHelper().path_for_file_with_sha(sha, ext)
                 self.assertTrue(self.path_exists_in_catalog(object_path))
 
+    def test_get_manifest_is_cached(self):
+        catalog = self._build_test_catalog()
+        manifest = catalog.get_manifest("meep", 1)
+        self.assertFalse(manifest.is_mutable)
+        self.assertFalse(manifest.files.is_mutable)
+        with mock.patch.object(catalog._storage, 'get') as get:
+            self.assertIs(catalog.get_manifest("meep", 1), manifest)
+            self.assertIs(catalog.manifest_for_bundle("meep"), manifest)
+            self.assertFalse(get.called)
+        self.assertEqual(catalog.manifest_cache.hits, 2)
+        self.assertEqual(catalog.manifest_cache.misses, 1)
+
+    def test_manifest_cache_shared_between_catalogs(self):
+        catalog = self._build_test_catalog()
+        cache = ZincManifestCache()
+        catalog1 = ZincCatalog(storage=catalog._storage, manifest_cache=cache)
+        catalog2 = ZincCatalog(storage=catalog._storage, manifest_cache=cache)
+        manifest = catalog1.get_manifest("meep", 1)
+        self.assertIs(catalog2.get_manifest("meep", 1), manifest)
+        self.assertEqual(cache.hits, 1)
+
+    def test_update_bundle_records_version_info(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        create_random_file(self.scratch_dir)
+        create_random_file(self.scratch_dir)
+        flavor_spec = ZincFlavorSpec.from_dict({'dummy': ['+ *']})
+        manifest = create_bundle_version(catalog, "meep", self.scratch_dir,
+                                         flavor_spec=flavor_spec)
+        info = catalog.get_index().version_info_for_bundle("meep", manifest.version)
+        self.assertEqual(info['flavors'], ['dummy'])
+        self.assertEqual(info['file_count'], 2)
+        self.assertTrue(info['size'] > 0)
+
+    def test_bundle_descriptors_does_not_load_manifests(self):
+        catalog = self._build_test_catalog()
+        catalog.manifest_cache.clear()
+        with mock.patch.object(catalog, 'get_manifest') as get_manifest:
+            self.assertEqual(catalog.bundle_descriptors(), ['meep-1'])
+            self.assertFalse(get_manifest.called)
+
+    def test_backfill_version_info(self):
+        catalog = self._build_test_catalog()
+        with catalog.lock():
+            catalog.index._bundle_info_by_name['meep'].pop('version_info')
+        catalog = ZincCatalog(storage=catalog._storage,
+                              coordinator=catalog._coordinator)
+        self.assertIsNone(catalog.get_index().version_info_for_bundle("meep", 1))
+        self.assertEqual(catalog.backfill_version_info(), 1)
+        self.assertIsNotNone(catalog.get_index().version_info_for_bundle("meep", 1))
+        self.assertEqual(catalog.backfill_version_info(), 0)
+
+    def _optimistic_catalog(self, catalog):
+        return ZincCatalog(storage=catalog._storage, optimistic=True)
+
+    def test_optimistic_update_without_coordinator(self):
+        catalog = self._optimistic_catalog(self._build_test_catalog())
+        catalog.update_distribution("live", "meep", 1)
+        index = ZincIndex.from_path(os.path.join(catalog.path, defaults['catalog_index_name']))
+        self.assertEqual(index.version_for_bundle("meep", "live"), 1)
+
+    def test_optimistic_update_conflict(self):
+        catalog = self._build_test_catalog()
+        catalog1 = self._optimistic_catalog(catalog)
+        catalog2 = self._optimistic_catalog(catalog)
+        with self.assertRaises(PreconditionFailed):
+            with catalog1.lock():
+                catalog2.update_distribution("test", "meep", 1)
+                catalog1.index.update_distribution("live", "meep", 1)
+        index = ZincIndex.from_path(os.path.join(catalog.path, defaults['catalog_index_name']))
+        self.assertEqual(index.version_for_bundle("meep", "test"), 1)
+        self.assertIsNone(index.version_for_bundle("meep", "live"))
+
+    def test_optimistic_update_retries_on_conflict(self):
+        catalog = self._build_test_catalog()
+        catalog1 = self._optimistic_catalog(catalog)
+        catalog2 = self._optimistic_catalog(catalog)
+        real_reload = catalog1._reload
+        calls = []
+
+        def reload_with_race():
+            real_reload()
+            if not calls:  # another writer sneaks in on the first attempt
+                catalog2.update_distribution("test", "meep", 1)
+            calls.append(1)
+
+        with mock.patch.object(catalog1, '_reload', side_effect=reload_with_race):
+            catalog1.update_distribution("live", "meep", 1)
+        self.assertEqual(len(calls), 2)
+        index = ZincIndex.from_path(os.path.join(catalog.path, defaults['catalog_index_name']))
+        self.assertEqual(index.version_for_bundle("meep", "test"), 1)
+        self.assertEqual(index.version_for_bundle("meep", "live"), 1)
+
+    def test_optimistic_threads_sharing_a_catalog_take_turns(self):
+        catalog = self._optimistic_catalog(self._build_test_catalog())
+        real_reload = catalog._reload
+        active = []
+        overlaps = []
+
+        def reload():
+            active.append(1)
+            overlaps.append(len(active))
+            time.sleep(0.05)
+            real_reload()
+
+        def save():
+            real_save()
+            active.pop()
+
+        real_save = catalog.save
+        with mock.patch.object(catalog, '_reload', side_effect=reload), \
+                mock.patch.object(catalog, 'save', side_effect=save):
+            threads = [threading.Thread(target=catalog.update_distribution, args=(name, "meep", 1))
+                       for name in ("live", "beta")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(overlaps, [1, 1])
+        index = ZincCatalog(storage=catalog._storage).get_index()
+        self.assertEqual(index.version_for_bundle("meep", "live"), 1)
+        self.assertEqual(index.version_for_bundle("meep", "beta"), 1)
+
+    def test_optimistic_lock_skips_unchanged_index(self):
+        catalog = self._optimistic_catalog(self._build_test_catalog())
+        with mock.patch.object(catalog._storage, 'put_if_match') as put_if_match:
+            with catalog.lock():
+                catalog.index.next_version_for_bundle("meep")
+            self.assertFalse(put_if_match.called)
+
+    def test_optimistic_mode_from_config(self):
+        catalog = self._build_test_catalog()
+        config = ZincCatalogConfig()
+        config.index_concurrency = 'optimistic'
+        catalog.update_config(config)
+        catalog = ZincCatalog(storage=catalog._storage)
+        self.assertTrue(catalog.is_optimistic)
+
+    def test_optimistic_mode_is_decided_once(self):
+        catalog = self._build_test_catalog()
+        config = ZincCatalogConfig()
+        config.index_concurrency = 'optimistic'
+        catalog.update_config(config)
+        optimistic_catalog = ZincCatalog(storage=catalog._storage)
+        optimistic_catalog.update_config(ZincCatalogConfig())
+        optimistic_catalog._reload()
+        self.assertTrue(optimistic_catalog.is_optimistic)
+        self.assertFalse(ZincCatalog(storage=catalog._storage).is_optimistic)
+
+    def test_optimistic_clean_is_refused(self):
+        catalog = self._optimistic_catalog(self._build_test_catalog())
+        with mock.patch.object(catalog._storage, 'delete') as delete:
+            self.assertRaises(Exception, catalog.clean, dry_run=False)
+            self.assertFalse(delete.called)
+
+    def _sharded_catalog(self, catalog):
+        config = ZincCatalogConfig()
+        config.index_layout = 'sharded'
+        catalog.update_config(config)
+        with catalog.lock():
+            pass  # writes every bundle's shard
+        return ZincCatalog(storage=catalog._storage,
+                           coordinator=catalog._coordinator)
+
+    def test_sharded_index_layout(self):
+        catalog = self._sharded_catalog(self._build_test_catalog())
+        self.assertTrue(self.path_exists_in_catalog('index/root.json'))
+        self.assertTrue(self.path_exists_in_catalog('index/bundles/meep/1.json'))
+        self.assertEqual(catalog.get_index().versions_for_bundle("meep"), [1])
+        self.assertEqual(catalog.get_index().id, 'com.mindsnacks.test')
+
+    def test_sharded_index_writes_only_changed_shard(self):
+        catalog = self._sharded_catalog(self._build_test_catalog())
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "beep", self.scratch_dir)
+        with mock.patch.object(catalog._storage, 'puts', wraps=catalog._storage.puts) as puts:
+            catalog.update_distribution("live", "meep", 1)
+        written = [c[0][0] for c in puts.call_args_list]
+        self.assertEqual(sorted(written), ['index/bundles/meep/2.json', 'index/root.json'])
+
+        catalog = ZincCatalog(storage=catalog._storage)
+        self.assertEqual(catalog.get_index().version_for_bundle("meep", "live"), 1)
+        self.assertEqual(catalog.get_index().versions_for_bundle("beep"), [1])
+
+    def test_compact_writes_sharded_index_for_legacy_readers(self):
+        catalog = self._sharded_catalog(self._build_test_catalog())
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "beep", self.scratch_dir)
+        legacy_path = os.path.join(self.catalog_dir, 'index.json')
+        self.assertEqual(list(ZincIndex.from_path(legacy_path).bundle_names()), ["meep"])
+
+        catalog.compact_index()
+        for name in ('catalog.json', 'index.json'):
+            index = ZincIndex.from_path(os.path.join(self.catalog_dir, name))
+            self.assertEqual(sorted(index.bundle_names()), ["beep", "meep"])
+            self.assertEqual(index.versions_for_bundle("beep"), [1])
+        self.assertTrue(self.path_exists_in_catalog('catalog.json.gz'))
+        # the root is still what the catalog reads
+        self.assertEqual(ZincCatalog(storage=catalog._storage).get_index().versions_for_bundle("beep"), [1])
+
+    def test_optimistic_sharded_writers_do_not_overwrite_shards(self):
+        catalog = self._sharded_catalog(self._build_test_catalog())
+        catalog1 = self._optimistic_catalog(catalog)
+        catalog2 = self._optimistic_catalog(catalog)
+        real_reload = catalog2._reload
+        calls = []
+
+        def reload_with_race():
+            real_reload()
+            if not calls:  # another writer commits the same shard first
+                catalog1.update_distribution("prod", "meep", 1)
+            calls.append(1)
+
+        with mock.patch.object(catalog2, '_reload', side_effect=reload_with_race):
+            catalog2.update_distribution("beta", "meep", 1)
+        self.assertEqual(len(calls), 2)
+        index = ZincCatalog(storage=catalog._storage).get_index()
+        self.assertEqual(index.version_for_bundle("meep", "prod"), 1)
+        self.assertEqual(index.version_for_bundle("meep", "beta"), 1)
+
+    def test_sharded_index_loads_shards_lazily(self):
+        catalog = self._sharded_catalog(self._build_test_catalog())
+        with mock.patch.object(catalog, '_read_index_shard',
+                               wraps=catalog._read_index_shard) as read_index_shard:
+            catalog._reload()
+            self.assertEqual(list(catalog.get_index().bundle_names()), ["meep"])
+            self.assertFalse(read_index_shard.called)
+            catalog.get_index().versions_for_bundle("meep")
+            read_index_shard.assert_called_once_with("meep", 1)
+
+    def test_clean_removes_superseded_shards(self):
+        catalog = self._sharded_catalog(self._build_test_catalog())
+        catalog.update_distribution("live", "meep", 1)
+        self.assertTrue(self.path_exists_in_catalog('index/bundles/meep/1.json'))
+        catalog.clean(dry_run=False)
+        self.assertFalse(self.path_exists_in_catalog('index/bundles/meep/1.json'))
+        self.assertTrue(self.path_exists_in_catalog('index/bundles/meep/2.json'))
+
+    def _journaled_catalog(self, catalog):
+        config = ZincCatalogConfig()
+        config.index_journal = True
+        catalog.update_config(config)
+        return ZincCatalog(storage=catalog._storage,
+                           coordinator=catalog._coordinator)
+
+    def test_journaled_update_appends_record(self):
+        catalog = self._journaled_catalog(self._build_test_catalog())
+        index_path = os.path.join(self.catalog_dir, defaults['catalog_index_name'])
+        mtime = os.stat(index_path).st_mtime_ns
+        catalog.update_distribution("live", "meep", 1)
+        self.assertEqual(os.stat(index_path).st_mtime_ns, mtime)
+        self.assertTrue(self.path_exists_in_catalog('journal/0000000001.json'))
+
+        catalog = ZincCatalog(storage=catalog._storage)
+        self.assertEqual(catalog.get_index().version_for_bundle("meep", "live"), 1)
+        self.assertEqual(catalog.get_index().journal_seq, 1)
+        records = list(catalog.journal_records())
+        self.assertEqual(records[0]['mutations'][0]['op'], 'update_distribution')
+
+    def test_journal_compaction(self):
+        catalog = self._journaled_catalog(self._build_test_catalog())
+        with mock.patch.dict(defaults, {'catalog_journal_compact_threshold': 2}):
+            catalog.update_distribution("live", "meep", 1)
+            catalog.update_distribution("test", "meep", 1)
+            index = ZincIndex.from_path(os.path.join(self.catalog_dir, defaults['catalog_index_name']))
+            self.assertEqual(index.journal_seq, 2)
+            self.assertEqual(index.version_for_bundle("meep", "test"), 1)
+            self.assertTrue(self.path_exists_in_catalog('journal/0000000001.json'))
+
+            catalog.delete_distribution("test", "meep", delete_previous=False)
+            catalog.delete_distribution("live", "meep", delete_previous=False)
+            self.assertFalse(self.path_exists_in_catalog('journal/0000000001.json'))
+            self.assertFalse(self.path_exists_in_catalog('journal/0000000002.json'))
+            self.assertTrue(self.path_exists_in_catalog('journal/0000000004.json'))
+
+        catalog = ZincCatalog(storage=catalog._storage)
+        self.assertEqual(len(catalog.get_index().distributions_for_bundle("meep")), 0)
+
+    def test_compact_index(self):
+        catalog = self._journaled_catalog(self._build_test_catalog())
+        catalog.update_distribution("live", "meep", 1)
+        catalog.compact_index()
+        index = ZincIndex.from_path(os.path.join(self.catalog_dir, defaults['catalog_index_name']))
+        self.assertEqual(index.version_for_bundle("meep", "live"), 1)
+
+    def test_save_compresses_index_once(self):
+        catalog = self._build_test_catalog()
+        with mock.patch('zinc.utils.gzip_bytes', wraps=utils.gzip_bytes) as gzip_bytes:
+            with mock.patch.object(catalog._storage, 'puts', wraps=catalog._storage.puts) as puts:
+                catalog.save()
+        self.assertEqual(gzip_bytes.call_count, 1)
+        written = sorted(c[0][0] for c in puts.call_args_list)
+        self.assertEqual(written, ['catalog.json', 'catalog.json.gz', 'index.json', 'index.json.gz'])
+
+    def test_save_reports_failed_files(self):
+        catalog = self._build_test_catalog()
+        real_puts = catalog._storage.puts
+
+        def puts(subpath, bytes, **kwargs):
+            if subpath.endswith('.gz'):
+                raise IOError('boom')
+            real_puts(subpath, bytes, **kwargs)
+
+        with mock.patch.object(catalog._storage, 'puts', side_effect=puts):
+            with self.assertRaises(ZincPublishError) as cm:
+                catalog.save()
+        self.assertEqual(sorted(cm.exception.failures.keys()),
+                         ['catalog.json.gz', 'index.json.gz'])
+
+    def test_binary_manifests(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        config = ZincCatalogConfig()
+        config.binary_manifests = True
+        catalog.update_config(config)
+        create_random_file(self.scratch_dir)
+        create_random_file(self.scratch_dir)
+        manifest = create_bundle_version(catalog, "meep", self.scratch_dir)
+        self.assertTrue(self.path_exists_in_catalog('manifests/meep-1.zbm'))
+
+        catalog = ZincCatalog(storage=catalog._storage, coordinator=catalog._coordinator)
+        with mock.patch.object(catalog, '_read', wraps=catalog._read) as read:
+            self.assertEqual(catalog.get_manifest("meep", 1).to_dict(), manifest.to_dict())
+        read.assert_called_once_with('manifests/meep-1.zbm')
+
+        catalog.clean(dry_run=False)
+        self.assertTrue(self.path_exists_in_catalog('manifests/meep-1.zbm'))
+
+    def test_binary_manifests_read_without_meta_lookup(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        create_random_file(self.scratch_dir)
+        manifest1 = create_bundle_version(catalog, "meep", self.scratch_dir)
+        config = ZincCatalogConfig()
+        config.binary_manifests = True
+        catalog.update_config(config)
+        create_random_file(self.scratch_dir)
+        manifest2 = create_bundle_version(catalog, "meep", self.scratch_dir)
+        self.assertFalse(self.path_exists_in_catalog('manifests/meep-1.zbm'))
+
+        catalog = ZincCatalog(storage=catalog._storage, coordinator=catalog._coordinator)
+        with mock.patch.object(catalog._storage, 'get_meta',
+                               wraps=catalog._storage.get_meta) as get_meta:
+            self.assertEqual(catalog.get_manifest("meep", 2).to_dict(), manifest2.to_dict())
+            # written before binary manifests were enabled
+            self.assertEqual(catalog.get_manifest("meep", 1).to_dict(), manifest1.to_dict())
+        self.assertFalse([c for c in get_meta.call_args_list
+                          if c[0][0].startswith('manifests/')])
+
     def test_bundle_name_in_manifest(self):
         catalog = self._build_test_catalog()
         bundle_name = "meep"
@@ -0,0 +1,75 @@
+import unittest
+import os
+from unittest import mock
+
+from zinc.compression import SkipListEstimator, SamplingEstimator, CombinedEstimator
+import zinc.compression as compression
+from zinc.client import connect
+from zinc.formats import Formats
+
+from tests import TempDirTestCase, create_random_file
+
+
+class TestCompressibilityEstimators(TempDirTestCase):
+
+    def _write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_skip_list_by_extension(self):
+        path = self._write('cat.JPG', b'0' * 100)
+        self.assertFalse(SkipListEstimator().is_compressible(path, 0.85))
+
+    def test_skip_list_by_magic_number(self):
+        path = self._write('cat', b'\x89PNG\r\n\x1a\n' + b'0' * 100)
+        self.assertFalse(SkipListEstimator().is_compressible(path, 0.85))
+
+    def test_skip_list_accepts_text(self):
+        path = create_random_file(self.dir)
+        self.assertTrue(SkipListEstimator().is_compressible(path, 0.85))
+
+    def test_sampling_rejects_random_bytes(self):
+        path = self._write('noise', os.urandom(256 * 1024))
+        self.assertFalse(SamplingEstimator().is_compressible(path, 0.85))
+
+    def test_sampling_accepts_compressible(self):
+        path = create_random_file(self.dir, size=256 * 1024)
+        self.assertTrue(SamplingEstimator().is_compressible(path, 0.85))
+
+    def test_sampling_accepts_small_files(self):
+        path = self._write('noise', os.urandom(1024))
+        self.assertTrue(SamplingEstimator().is_compressible(path, 0.85))
+
+    def test_combined(self):
+        path = self._write('cat.png', b'0' * 100)
+        estimator = CombinedEstimator(SamplingEstimator(), SkipListEstimator())
+        self.assertFalse(estimator.is_compressible(path, 0.85))
+
+    def test_import_skips_compression(self):
+        catalog_dir = os.path.join(self.dir, 'catalog')
+        service = connect('/')
+        service.create_catalog(id='com.mindsnacks.test', loc=catalog_dir)
+        catalog = service.get_catalog(loc=catalog_dir)
+
+        path = self._write('noise', os.urandom(256 * 1024))
+        with mock.patch('zinc.utils.sha1_and_compress_path') as sha1_and_compress_path:
+            file_info = catalog.import_path(path)
+            self.assertFalse(sha1_and_compress_path.called)
+        self.assertEqual(file_info['format'], Formats.RAW)
+        self.assertEqual(file_info['size'], 256 * 1024)
+
+
+class TestDecompressChunks(unittest.TestCase):
+
+    def test_decompress_chunks(self):
+        b = os.urandom(1024) * 200
+        for format in (Formats.RAW, Formats.GZ, Formats.BZ2, Formats.XZ):
+            if format == Formats.RAW:
+                encoded = b
+            else:
+                compressor = compression.compressobj_for_format(format)
+                encoded = compressor.compress(b) + compressor.flush()
+            chunks = [encoded[i:i + 1000] for i in range(0, len(encoded), 1000)]
+            self.assertEqual(b''.join(compression.decompress_chunks(format, chunks)), b)
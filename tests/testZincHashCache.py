@@ -0,0 +1,49 @@
+import os
+import time
+
+import zinc.utils as utils
+from zinc.hashcache import ZincHashCache
+
+from tests import TempDirTestCase, create_random_file
+
+
+class TestZincHashCache(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ZincHashCache(path=os.path.join(self.dir, 'cache', 'hashes.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        super().tearDown()
+
+    def test_get_missing(self):
+        path = create_random_file(self.dir)
+        self.assertIsNone(self.cache.get(path))
+
+    def test_sha1_for_path_caches(self):
+        path = create_random_file(self.dir)
+        sha = self.cache.sha1_for_path(path)
+        self.assertEqual(sha, utils.sha1_for_path(path))
+        self.assertEqual(self.cache.get(path), sha)
+
+    def test_modified_file_is_not_a_hit(self):
+        path = create_random_file(self.dir)
+        self.cache.sha1_for_path(path)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        self.assertIsNone(self.cache.get(path))
+
+    def test_persists_across_instances(self):
+        path = create_random_file(self.dir)
+        sha = self.cache.sha1_for_path(path)
+        self.cache.close()
+        self.cache = ZincHashCache(path=os.path.join(self.dir, 'cache', 'hashes.db'))
+        self.assertEqual(self.cache.get(path), sha)
+
+    def test_evict_stale_entries(self):
+        path = create_random_file(self.dir)
+        self.cache.sha1_for_path(path)
+        time.sleep(0.01)
+        self.assertEqual(self.cache.evict(max_age=0), 1)
+        self.assertIsNone(self.cache.get(path))
@@ -0,0 +1,37 @@
+import unittest
+from unittest import mock
+import json
+
+import zinc.jsoncodec as jsoncodec
+from zinc.models import ZincManifest
+
+
+class ZincJsonCodecTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = {
+            'b': [1, 2.5, None, True],
+            'a': {'café': 'déjà vu', 'emoji': '\U0001f600'},
+        }
+
+    def test_dumps_matches_stdlib(self):
+        self.assertEqual(jsoncodec.dumps(self.obj), json.dumps(self.obj))
+        self.assertEqual(jsoncodec.dumpb(self.obj), json.dumps(self.obj).encode('utf-8'))
+
+    def test_loads_str_and_bytes(self):
+        s = json.dumps(self.obj)
+        self.assertEqual(jsoncodec.loads(s), self.obj)
+        self.assertEqual(jsoncodec.loads(s.encode('utf-8')), self.obj)
+
+    def test_loads_without_fast_json(self):
+        with mock.patch.object(jsoncodec, '_fast_json', None):
+            self.assertEqual(jsoncodec.loads(json.dumps(self.obj)), self.obj)
+            self.assertEqual(jsoncodec.implementation(), 'json')
+
+    def test_model_round_trip_is_byte_identical(self):
+        manifest = ZincManifest('com.mindsnacks.test', 'meep', 1)
+        manifest.add_file('café.txt', 'ea502a7bbd407872e50b9328956277d0228272d4')
+        manifest.add_format_for_file('café.txt', 'raw', 123)
+        b = manifest.to_bytes()
+        self.assertEqual(b, json.dumps(manifest.to_dict()).encode('utf-8'))
+        self.assertEqual(ZincManifest.from_bytes(b).to_bytes(), b)
@@ -1,4 +1,6 @@
 import unittest
+from unittest import mock
+import json
 import os.path
 
 from zinc.models import ZincIndex, ZincFlavorSpec, ZincFileList, ZincManifest
@@ -111,6 +113,114 @@ class ZincIndexTestCase(TempDirTestCase):
         self.assertTrue("master" in distros[1])
         self.assertTrue("test" in distros[1])
 
+    def test_version_info_for_bundle(self):
+        index = ZincIndex('com.mindsnacks.test')
+        index.add_version_for_bundle("meep", 1)
+        self.assertIsNone(index.version_info_for_bundle("meep", 1))
+        index.set_version_info_for_bundle("meep", 1, ["small", "large"],
+                                          file_count=2, size=10)
+        info = index.version_info_for_bundle("meep", 1)
+        self.assertEqual(info, {'flavors': ["large", "small"],
+                                'file_count': 2, 'size': 10})
+        ZincIndex.from_bytes(index.to_bytes())  # validates against schema
+
+    def test_del_version_removes_version_info(self):
+        index = ZincIndex()
+        index.add_version_for_bundle("meep", 1)
+        index.add_version_for_bundle("meep", 2)
+        index.set_version_info_for_bundle("meep", 1, [])
+        index.delete_bundle_version("meep", 1)
+        self.assertIsNone(index.version_info_for_bundle("meep", 1))
+
+    def test_snapshot_is_immutable(self):
+        index = ZincIndex()
+        index.add_version_for_bundle("meep", 1)
+        snapshot = index.snapshot()
+        self.assertFalse(snapshot.is_mutable)
+        self.assertRaises(TypeError, snapshot.add_version_for_bundle, "meep", 2)
+
+    def test_snapshot_is_reused_until_index_changes(self):
+        index = ZincIndex()
+        index.add_version_for_bundle("meep", 1)
+        snapshot = index.snapshot()
+        self.assertIs(index.snapshot(), snapshot)
+        index.add_version_for_bundle("meep", 2)
+        self.assertIsNot(index.snapshot(), snapshot)
+
+    def test_snapshot_does_not_see_later_changes(self):
+        index = ZincIndex()
+        index.add_version_for_bundle("meep", 1)
+        index.update_distribution("live", "meep", 1)
+        snapshot = index.snapshot()
+        index.add_version_for_bundle("meep", 2)
+        index.update_distribution("live", "meep", 2)
+        index.add_version_for_bundle("beep", 1)
+        index.delete_bundle_version("meep", 1)
+        self.assertEqual(snapshot.versions_for_bundle("meep"), [1])
+        self.assertEqual(snapshot.version_for_bundle("meep", "live"), 1)
+        self.assertNotIn("beep", snapshot.bundle_names())
+        self.assertEqual(index.versions_for_bundle("meep"), [2])
+
+    def test_snapshot_does_not_see_next_version_cleanup(self):
+        p = abs_path_for_fixture("index-pre-next_version.json")
+        index = ZincIndex.from_path(p)
+        snapshot = index.snapshot()
+        index.next_version_for_bundle("meep")
+        self.assertNotIn("next_version", snapshot.to_dict()["bundles"]["meep"])
+
+    def test_mutable_clone_does_not_share_changes(self):
+        index = ZincIndex()
+        index.add_version_for_bundle("meep", 1)
+        clone = index.clone()
+        clone.add_version_for_bundle("meep", 2)
+        self.assertEqual(index.versions_for_bundle("meep"), [1])
+
+    def test_sharded_index_snapshot(self):
+        shards = {("meep", 1): {'versions': [1], 'distributions': {}, 'next_version': 2}}
+        index = ZincIndex.from_shards({'id': 'com.mindsnacks.test', 'format': '1',
+                                       'bundles': {"meep": 1}},
+                                      lambda name, generation: shards[(name, generation)])
+        snapshot = index.snapshot()
+        index.add_version_for_bundle("meep", 2)
+        index.set_shard_generations({"meep": 2})
+        self.assertEqual(index.dirty_bundle_names(), {"meep"})
+        self.assertEqual(snapshot.versions_for_bundle("meep"), [1])
+        self.assertEqual(snapshot.shard_generations, {"meep": 1})
+        self.assertEqual(shards[("meep", 1)]['versions'], [1])
+
+    def test_reads_do_not_mark_bundles_dirty(self):
+        shards = {("meep", 1): {'versions': [1], 'distributions': {}}}
+        index = ZincIndex.from_shards({'id': 'com.mindsnacks.test', 'format': '1',
+                                       'bundles': {"meep": 1}},
+                                      lambda name, generation: shards[(name, generation)])
+        self.assertEqual(index.next_version_for_bundle("meep"), 2)
+        self.assertEqual(index.dirty_bundle_names(), set())
+        index.increment_next_version_for_bundle("meep")
+        self.assertEqual(index.dirty_bundle_names(), {"meep"})
+
+    def test_apply_mutations(self):
+        index = ZincIndex('com.mindsnacks.test')
+        index.increment_next_version_for_bundle("meep")
+        index.add_version_for_bundle("meep", 1)
+        index.add_version_for_bundle("meep", 2)
+        index.set_version_info_for_bundle("meep", 1, ["small"])
+        index.update_distribution("live", "meep", 1)
+        index.update_distribution("test", "meep", 1)
+        index.delete_distribution("test", "meep")
+        index.delete_bundle_version("meep", 2)
+
+        replica = ZincIndex('com.mindsnacks.test')
+        for mutation in index.mutations():
+            replica.apply_mutation(mutation)
+        self.assertEqual(replica.to_dict(), index.to_dict())
+        self.assertEqual(replica.mutations(), [])
+
+    def test_mark_clean_clears_mutations(self):
+        index = ZincIndex()
+        index.add_version_for_bundle("meep", 1)
+        index.mark_clean()
+        self.assertEqual(index.mutations(), [])
+
     def test_next_version_for_bundle_from_old_index(self):
         p = abs_path_for_fixture("index-pre-next_version.json")
         index = ZincIndex.from_path(p)
@@ -254,6 +364,38 @@ class ZincManifestTestCase(TempDirTestCase):
         self.assertFalse(immutable_manifest.is_mutable)
 
 
+class ZincModelValidationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        ZincManifest._validated_digests = None
+        self.invalid_bytes = json.dumps({
+            'catalog': 'com.mindsnacks.test', 'bundle': 'meep', 'version': 1,
+            'files': {'a': {'sha': 'not-a-sha', 'formats': {}}},
+        })
+
+    def test_validator_is_built_once(self):
+        self.assertIs(ZincManifest.validator(), ZincManifest.validator())
+        self.assertIsNot(ZincManifest.validator(), ZincIndex.validator())
+
+    def test_invalid_bytes_raise(self):
+        self.assertRaises(Exception, ZincManifest.from_bytes, self.invalid_bytes)
+
+    def test_trusted_skips_validation(self):
+        manifest = ZincManifest.from_bytes(self.invalid_bytes, trusted=True)
+        self.assertEqual(manifest.bundle_name, 'meep')
+
+    def test_validated_content_is_not_validated_again(self):
+        b = ZincManifest('com.mindsnacks.test', 'meep', 1).to_bytes().decode('utf-8')
+        with mock.patch.object(ZincManifest.validator(), 'validate') as validate:
+            ZincManifest.from_bytes(b)
+            ZincManifest.from_bytes(b)
+        self.assertEqual(validate.call_count, 1)
+
+    def test_mark_validated(self):
+        ZincManifest.mark_validated(self.invalid_bytes)
+        ZincManifest.from_bytes(self.invalid_bytes)
+
+
 class ZincFlavorSpecTestCase(unittest.TestCase):
 
     def test_load_from_dict_1(self):
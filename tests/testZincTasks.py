@@ -1,4 +1,208 @@
+import os
+import tarfile
+import threading
+from unittest import mock
+
+import zinc.utils as utils
+from zinc.client import connect
+from zinc.hashcache import ZincHashCache
+from zinc.models import ZincFlavorSpec
+from zinc.staging import ZincBlobStage
+from zinc.tasks.bundle_update import ZincBundleUpdateTask, TempDiskBudget
+
 from tests import *
 
+
 class TestZincBundleCloneTask(unittest.TestCase):
     pass
+
+
+class TestZincBundleUpdateTask(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.catalog_dir = os.path.join(self.dir, "catalog")
+        self.scratch_dir = os.path.join(self.dir, "scratch")
+        os.mkdir(self.scratch_dir)
+        service = connect('/')
+        service.create_catalog(id='com.mindsnacks.test', loc=self.catalog_dir)
+        self.catalog = service.get_catalog(loc=self.catalog_dir)
+
+    def _make_task(self, **kwargs):
+        task = ZincBundleUpdateTask(catalog=self.catalog, bundle_name="meep", **kwargs)
+        task.src_dir = self.scratch_dir
+        return task
+
+    def test_parallel_import_matches_serial(self):
+        for i in range(4):
+            sub_dir = os.path.join(self.scratch_dir, str(i))
+            os.mkdir(sub_dir)
+            for j in range(5):
+                create_random_file(sub_dir)
+        flavor_spec = ZincFlavorSpec.from_dict({'dummy': ['+ 1/*']})
+
+        serial = self._make_task(jobs=1)._import_files(self.scratch_dir, flavor_spec)
+        parallel = self._make_task(jobs=4)._import_files(self.scratch_dir, flavor_spec)
+
+        self.assertEqual(serial.to_dict(), parallel.to_dict())
+        self.assertEqual(list(serial.keys()), list(parallel.keys()))
+
+    def test_jobs_defaults_to_serial(self):
+        task = self._make_task()
+        self.assertEqual(task.jobs, 1)
+
+    def test_hash_cache_skips_hashing_existing_files(self):
+        for i in range(3):
+            create_random_file(self.scratch_dir)
+        with ZincHashCache(path=os.path.join(self.dir, 'hashes.db')) as hash_cache:
+            first = self._make_task(hash_cache=hash_cache)._import_files(self.scratch_dir)
+            with mock.patch('zinc.utils.sha1_and_compress_path') as sha1_and_compress_path:
+                second = self._make_task(hash_cache=hash_cache)._import_files(self.scratch_dir)
+                self.assertFalse(sha1_and_compress_path.called)
+        self.assertEqual(first.to_dict(), second.to_dict())
+
+    def test_each_file_compressed_once_per_update(self):
+        for i in range(3):
+            create_random_file(self.scratch_dir)
+        flavor_spec = ZincFlavorSpec.from_dict({'one': ['+ *'], 'two': ['+ *']})
+        task = self._make_task(flavor_spec=flavor_spec, skip_master_archive=False)
+
+        with mock.patch('zinc.utils.sha1_and_compress_path',
+                        wraps=utils.sha1_and_compress_path) as sha1_and_compress_path:
+            manifest = task.run()
+        self.assertEqual(sha1_and_compress_path.call_count, 3)
+
+        # archive members are the same bytes as the catalog objects
+        for flavor in (None, 'one', 'two'):
+            with self.catalog._read_archive("meep", manifest.version, flavor=flavor) as f:
+                with tarfile.open(fileobj=f) as tar:
+                    for member in tar.getmembers():
+                        sha, ext = os.path.splitext(member.name)
+                        with self.catalog._read_file(sha, ext=ext[1:] or None) as obj:
+                            self.assertEqual(tar.extractfile(member).read(), obj.read())
+
+    def test_parallel_archive_builds(self):
+        for i in range(4):
+            create_random_file(self.scratch_dir)
+        flavor_spec = ZincFlavorSpec.from_dict({'one': ['+ *'], 'two': ['+ *'], 'three': ['+ *']})
+        task = self._make_task(flavor_spec=flavor_spec, archive_jobs=3, archive_tmp_limit=1,
+                               stream_archives=False)
+        manifest = task.run()
+        for flavor in ('one', 'two', 'three'):
+            self.assertIsNotNone(self.catalog._get_archive_info("meep", manifest.version, flavor=flavor))
+
+    def test_stage_is_limited_by_archive_tmp_limit(self):
+        for i in range(3):
+            create_random_file(self.scratch_dir)
+        flavor_spec = ZincFlavorSpec.from_dict({'one': ['+ *'], 'two': ['+ *']})
+        task = self._make_task(flavor_spec=flavor_spec, archive_tmp_limit=1)
+        self.assertTrue(task.stream_archives)
+
+        staged = list()
+        real_cleanup = ZincBlobStage.cleanup
+
+        def cleanup(stage):
+            staged.extend(os.listdir(stage.dir))
+            real_cleanup(stage)
+
+        with mock.patch.object(ZincBlobStage, 'cleanup', autospec=True, side_effect=cleanup):
+            manifest = task.run()
+        self.assertEqual(staged, [])
+
+        for flavor in ('one', 'two'):
+            with self.catalog._read_archive("meep", manifest.version, flavor=flavor) as f:
+                with tarfile.open(fileobj=f) as tar:
+                    self.assertEqual(len(tar.getmembers()), 3)
+                    for member in tar.getmembers():
+                        sha, ext = os.path.splitext(member.name)
+                        with self.catalog._read_file(sha, ext=ext[1:] or None) as obj:
+                            self.assertEqual(tar.extractfile(member).read(), obj.read())
+
+    def test_incremental_only_imports_changed_files(self):
+        for i in range(3):
+            create_random_file(self.scratch_dir)
+        first = self._make_task().run()
+
+        new_path = create_random_file(self.scratch_dir)
+        with ZincHashCache(path=os.path.join(self.dir, 'hashes.db')) as hash_cache:
+            task = self._make_task(incremental=True, hash_cache=hash_cache)
+            with mock.patch.object(self.catalog, 'import_path',
+                                   wraps=self.catalog.import_path) as import_path:
+                second = task.run()
+            self.assertEqual(import_path.call_count, 1)
+            self.assertEqual(import_path.call_args[0][0], new_path)
+
+        self.assertEqual(second.version, first.version + 1)
+        for path in first.files.keys():
+            self.assertEqual(second.files[path], first.files[path])
+        self.assertEqual(len(second.files), 4)
+
+    def test_incremental_matches_full_update(self):
+        for i in range(3):
+            create_random_file(self.scratch_dir)
+        first = self._make_task().run()
+        with ZincHashCache(path=os.path.join(self.dir, 'hashes.db')) as hash_cache:
+            incremental = self._make_task(incremental=True, hash_cache=hash_cache).run()
+        self.assertEqual(first.version, incremental.version)
+
+    def test_incremental_skips_hashing_unchanged_files(self):
+        for i in range(3):
+            create_random_file(self.scratch_dir)
+        with ZincHashCache(path=os.path.join(self.dir, 'hashes.db')) as hash_cache:
+            self._make_task(hash_cache=hash_cache).run()
+            new_path = create_random_file(self.scratch_dir)
+            task = self._make_task(incremental=True, hash_cache=hash_cache)
+            with mock.patch('zinc.utils.sha1_for_path', wraps=utils.sha1_for_path) as sha1_for_path:
+                task.run()
+            sha1_for_path.assert_called_once_with(new_path)
+
+    def test_incremental_requires_hash_cache(self):
+        with self.assertRaises(ValueError):
+            self._make_task(incremental=True)
+
+
+class TestTempDiskBudget(unittest.TestCase):
+
+    def test_reserve_waits_for_space(self):
+        budget = TempDiskBudget(limit=10)
+        events = []
+
+        def worker():
+            with budget.reserve(8):
+                events.append('second')
+
+        with budget.reserve(8):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join(0.05)
+            events.append('first')
+        thread.join()
+        self.assertEqual(events, ['first', 'second'])
+
+    def test_oversized_reservation_is_granted(self):
+        budget = TempDiskBudget(limit=10)
+        with budget.reserve(100):
+            pass
+
+    def test_charge_only_takes_bytes_that_fit(self):
+        budget = TempDiskBudget(limit=10)
+        self.assertTrue(budget.charge(6))
+        self.assertFalse(budget.charge(6))
+        self.assertTrue(budget.charge(4))
+
+    def test_reserve_counts_charged_bytes(self):
+        budget = TempDiskBudget(limit=10)
+        budget.charge(6)
+        events = []
+
+        def worker():
+            with budget.reserve(2):
+                events.append('second')
+
+        with budget.reserve(3):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join(0.05)
+            events.append('first')
+        thread.join()
+        self.assertEqual(events, ['first', 'second'])
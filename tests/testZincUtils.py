@@ -0,0 +1,35 @@
+import hashlib
+import os
+from io import BytesIO
+
+import zinc.utils as utils
+
+from tests import TempDirTestCase, create_random_file
+
+
+class TestZincUtils(TempDirTestCase):
+
+    def test_sha1_and_gzip_path(self):
+        path = create_random_file(self.dir, size=(utils.CHUNK_SIZE * 3) + 17)
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        gz_file = BytesIO()
+        sha, size, gz_size = utils.sha1_and_gzip_path(path, gz_file, chunk_size=4096)
+
+        self.assertEqual(sha, hashlib.sha1(data).hexdigest())
+        self.assertEqual(sha, utils.sha1_for_path(path))
+        self.assertEqual(size, len(data))
+        self.assertEqual(gz_size, len(gz_file.getvalue()))
+        self.assertEqual(utils.gunzip_bytes(gz_file.getvalue()), data)
+
+    def test_sha1_and_gzip_empty_path(self):
+        path = os.path.join(self.dir, 'empty')
+        open(path, 'wb').close()
+
+        gz_file = BytesIO()
+        sha, size, gz_size = utils.sha1_and_gzip_path(path, gz_file)
+
+        self.assertEqual(sha, hashlib.sha1(b'').hexdigest())
+        self.assertEqual(size, 0)
+        self.assertEqual(utils.gunzip_bytes(gz_file.getvalue()), b'')